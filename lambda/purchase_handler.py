@@ -321,6 +321,7 @@ async def run_purchase_bot(tickets_path: str, dry_run: bool = True, target_date:
             process_tickets,
         )
         from constants import Timeouts
+        from utils import block_unneeded_resources, BROWSER_VIEWPORT
     except ImportError as e:
         logger.error(f"Failed to import bot_simple modules: {e}")
         raise
@@ -354,10 +355,11 @@ async def run_purchase_bot(tickets_path: str, dry_run: bool = True, target_date:
             )
 
             context = await browser.new_context(
-                viewport={'width': 1280, 'height': 720},
+                viewport=BROWSER_VIEWPORT,
                 locale='ja-JP',
                 timezone_id='Asia/Tokyo'
             )
+            await block_unneeded_resources(context)
 
             page = await context.new_page()
 
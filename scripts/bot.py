@@ -3,28 +3,48 @@
 IPAT自動投票Bot v2 - Seleniumコードを基にした実装
 """
 import os
+import re
+import time
 import asyncio
+import functools
 import json
+import html
+import io
 import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright, Page, TimeoutError
 import pandas as pd
 import boto3
 from botocore.exceptions import ClientError
-import requests
-from bs4 import BeautifulSoup
+import aiohttp
+
+# 任意依存: 未インストール時は結合正規表現で代替
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # カスタムユーティリティ
 from utils import (
     retry_async,
     take_screenshot,
+    take_screenshot_in_background,
+    wait_for_background_screenshots,
     wait_and_click,
     wait_and_fill,
     safe_navigate,
-    setup_file_logging
+    wait_for_any,
+    block_unneeded_resources,
+    BROWSER_VIEWPORT,
+    block_stylesheets,
+    unblock_stylesheets,
+    setup_file_logging,
+    disable_unused_log_record_fields,
+    fetch_secret
 )
 from slack_notifier import SlackNotifier
 
@@ -46,19 +66,29 @@ except Exception as e:
 
 # 定数
 IPAT_URL = "https://www.ipat.jra.go.jp/"  # 中央競馬（JRA）のみ
+IPAT_HOME_URL = "https://www.ipat.jra.go.jp/2017/pw_890_i.cgi#!/"  # ログイン後のメニュー
 TIMEOUT_MS = int(os.environ.get('TIMEOUT_MS', '20000'))
 HEADLESS_MODE = os.environ.get('HEADLESS_MODE', 'true').lower() == 'true'
 DRY_RUN = os.environ.get('DRY_RUN', 'false').lower() == 'true'
+# 途中経過のスクリーンショットはPNG転送のコストが大きいため既定では無効（DRY_RUN時は有効）
+SCREENSHOTS_ENABLED = os.environ.get('SCREENSHOTS_ENABLED', 'true' if DRY_RUN else 'false').lower() == 'true'
+# ログイン・入金時のフォーム送信先と項目名をログに出す（HTTP直接送信を検討するための記録用）
+LOG_FORM_POSTS = os.environ.get('LOG_FORM_POSTS', 'false').lower() == 'true'
+# ログイン済みセッション（Cookie等）の保存先。次回はログインを省略できるか試す（空文字で無効）
+# ログイン済みセッション（Cookie）の保存先。スクリーンショット等と一緒に共有されないよう output/ の外に置く
+SESSION_STATE_PATH = os.environ.get('SESSION_STATE_PATH', os.path.expanduser('~/.akatsuki/session_state.json'))
+SELECTOR_CACHE_PATH = os.environ.get('SELECTOR_CACHE_PATH', 'output/selector_cache.json')  # 前回成功したセレクタの保存先
+# 投票を並列に行うワーカー数（2以上でログイン済みセッションを共有するコンテキストを追加する）
+PURCHASE_CONCURRENCY = int(os.environ.get('PURCHASE_CONCURRENCY', '1'))
+# 投票開始の上限（1秒あたりの件数）。投票自体がこれより遅ければ待機は発生しない（0以下で無制限）
+BET_RATE_PER_SEC = float(os.environ.get('BET_RATE_PER_SEC', '1'))
 
 
 async def get_all_secrets():
     """AWS Secrets Managerから認証情報とSlack情報を取得"""
     try:
-        client = boto3.client('secretsmanager', region_name=os.environ.get('AWS_DEFAULT_REGION', 'ap-northeast-1'))
         secret_id = os.environ['AWS_SECRET_NAME']
-        
-        response = client.get_secret_value(SecretId=secret_id)
-        secrets = json.loads(response['SecretString'])
+        secrets = fetch_secret(secret_id)
         
         # IPAT認証情報
         credentials = {
@@ -85,72 +115,532 @@ async def get_all_secrets():
         raise
 
 
-async def analyze_page_structure(page: Page):
-    """ページのHTML構造を解析してログインフィールドを検出"""
+async def click_first_match(locator, timeout: int = 5000) -> bool:
+    """ロケータに一致する最初の要素をクリック（ブラウザ側でマッチング）"""
+    try:
+        await locator.first.click(timeout=timeout)
+        return True
+    except TimeoutError:
+        return False
+
+
+def accept_dialogs(page: Page):
+    """投票・入金時の確認ダイアログを自動で承認する（context.on('page', ...) で全ページに登録する）"""
+    page.on('dialog', lambda dialog: dialog.accept())
+
+
+def log_form_post(request):
+    """POSTリクエストの送信先と項目名だけを記録（値は資格情報を含むため出さない）"""
+    if request.method != 'POST':
+        return
+    try:
+        data = request.post_data_json
+    except ValueError:
+        data = None
+    fields = sorted(data) if isinstance(data, dict) else []
+    logger.info(f"📮 POST {request.url} fields={fields}")
+
+
+async def take_milestone_screenshot(page: Page, name: str):
+    """途中経過のスクリーンショット（SCREENSHOTS_ENABLED のときのみ。エラー時は常に take_screenshot を使う）"""
+    if SCREENSHOTS_ENABLED:
+        await take_screenshot(page, name)
+
+
+# ログインボタン候補（CSSセレクタ, 含むべきテキスト）。優先順に1回の evaluate で探す
+LOGIN_BUTTON_CANDIDATES = [
+    ('button', 'ログイン'),
+    ('input[type="button"][value*="ログイン"]', None),
+    ('input[type="submit"][value*="ログイン"]', None),
+    ('input[type="image"][alt*="ログイン"]', None),
+    ('img[alt*="ログイン"]', None),
+    ('a', 'ログイン'),
+    ('div[class*="button"]', 'ログイン'),
+    ('span[class*="button"]', 'ログイン'),
+]
+
+
+# 要素のテキスト・属性を判定するキーワード（大文字小文字を区別しない）
+LOGIN_TEXT_PATTERN = re.compile(r'ログイン|LOGIN', re.IGNORECASE)
+LOGIN_SUBMIT_TEXT_PATTERN = re.compile(r'ログイン|LOGIN|送信|submit|次へ|next', re.IGNORECASE)
+OK_TEXT_PATTERN = re.compile(r'O ?K|確認|次へ|進む', re.IGNORECASE)
+ACCOUNT_INFO_PATTERN = re.compile(r'口座|残高|照会|明細|入金|出金|account|balance', re.IGNORECASE)
+VOTE_KEYWORDS = ['通常投票', '投票', '馬券', '購入', 'BET', '単勝', '複勝', 'ワイド', '馬連', '馬単', '三連単', '三連複']
+VOTE_KEYWORD_PATTERN = re.compile('|'.join(VOTE_KEYWORDS))
+NORMAL_VOTE_PATTERN = re.compile(r'通常.*投票')
+
+# 投票メニューが表示されたと判断できる要素
+MENU_READY_SELECTORS = ['text=投票メニュー', 'text=通常投票']
+
+
+async def click_login_button(page: Page) -> bool:
+    """
+    ログインボタン候補を優先順に探し、最初に見つかった要素をクリック（見つからなければ待たずに False）
+
+    まとめたロケータの .first は文書順になり、ヘルプのリンクやボタンを囲む要素が先に一致するため使わない。
+    """
+    found = await page.evaluate(
+        """(candidates) => {
+            for (const [k, [selector, text]] of candidates.entries()) {
+                const i = [...document.querySelectorAll(selector)].findIndex(
+                    e => !text || (e.textContent || '').includes(text)
+                );
+                if (i >= 0) return [k, i];
+            }
+            return null;
+        }""",
+        LOGIN_BUTTON_CANDIDATES
+    )
+    if not found:
+        return False
+    selector = LOGIN_BUTTON_CANDIDATES[found[0]][0]
+    button = page.locator(selector).nth(found[1])
+    try:
+        logger.info(f"Clicking login button: {selector} '{(await button.text_content() or '').strip()}'")
+        await button.click(timeout=5000)
+    except Exception as e:
+        logger.warning(f"Failed to click login button {selector}: {e}")
+        return False
+    return True
+
+
+def button_or_link(page: Page, pattern: re.Pattern):
+    """名前が一致するボタンまたはリンクのロケータ"""
+    return page.get_by_role("button", name=pattern).or_(page.get_by_role("link", name=pattern))
+
+
+async def click_button_before_link(page: Page, pattern: re.Pattern, timeout: int = 5000) -> bool:
+    """
+    名前が一致するボタン（submit/button の input を含む）をクリックし、ボタンがなければリンクをクリック
+
+    文書順で先に出てくるメニューのリンクを押さないよう、ボタンを常に優先する（購入・確認ボタン用）。
+    """
+    buttons = page.get_by_role("button", name=pattern)
+    links = page.get_by_role("link", name=pattern)
+    try:
+        await buttons.or_(links).first.wait_for(timeout=timeout)
+    except TimeoutError:
+        return False
+    target = buttons if await buttons.count() else links
+    return await click_first_match(target, timeout=timeout)
+
+
+# 購入・確認ボタンの名前（部分一致だと「投票履歴」「投票メニュー」等のリンクにも一致するため完全一致）
+PURCHASE_BUTTON_PATTERN = re.compile(r"^\s*(?:購入する|購入|投票する|投票|BUY|BET)\s*$")
+CONFIRM_BUTTON_PATTERN = re.compile(r"^\s*(?:O\s?K|確認|完了|結果)\s*$", re.I)
+
+
+# 競馬場の別名（ブラウザ側マッチング用に事前コンパイル）
+RACECOURSE_ALIASES = {
+    '東京': ['東京', '府中', 'サラブレッド'],
+    '中山': ['中山', 'ナカヤマ'],
+    '京都': ['京都', 'キョウト'],
+    '阪神': ['阪神', 'ハンシン'],
+    '小倉': ['小倉', 'コクラ'],
+    '中京': ['中京', 'チュウキョウ'],
+    '新潟': ['新潟', 'ニイガタ'],
+    '鹿児島': ['鹿児島', 'カゴシマ'],
+    '函館': ['函館', 'ハコダテ']
+}
+RACECOURSE_PATTERNS = {
+    name: re.compile("|".join(re.escape(alias) for alias in aliases))
+    for name, aliases in RACECOURSE_ALIASES.items()
+}
+
+class KeywordSet:
+    """複数キーワードを本文1回の走査で検出（優先順は定義順）"""
+    
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            # 先読みで全位置を調べる（重なったキーワードも取りこぼさない）
+            self._regex = re.compile("(?=(" + "|".join(re.escape(k) for k in self.keywords) + "))")
+    
+    def found(self, text: str) -> set:
+        """本文に含まれるキーワードの集合（代替実装では同じ位置から始まるものは優先順位の高い方のみ）"""
+        if self._automaton is not None:
+            return {keyword for _, keyword in self._automaton.iter(text)}
+        return set(self._regex.findall(text))
+    
+    def first(self, text: str) -> Optional[str]:
+        """本文に含まれるキーワードのうち優先順位が最も高いもの"""
+        found = self.found(text)
+        return next((keyword for keyword in self.keywords if keyword in found), None)
+
+
+# extract_detailed_time_info 用の時間パターン
+DETAILED_TIME_PATTERNS = (
+    # 開始時間パターン
+    (re.compile(r'発売開始[:：]\s*(\d{1,2}[:：]\d{2})'), 'sales_start'),
+    (re.compile(r'投票開始[:：]\s*(\d{1,2}[:：]\d{2})'), 'voting_start'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})'), 'time_range'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*開始'), 'start_time'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*発売'), 'sales_time'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*受付'), 'reception_time'),
+
+    # 次回開催情報
+    (re.compile(r'次回.*?(\d{1,2}[:：]\d{2})'), 'next_time'),
+    (re.compile(r'明日.*?(\d{1,2}[:：]\d{2})'), 'tomorrow_time'),
+    (re.compile(r'土曜.*?(\d{1,2}[:：]\d{2})'), 'saturday_time'),
+    (re.compile(r'日曜.*?(\d{1,2}[:：]\d{2})'), 'sunday_time'),
+
+    # 曜日別営業時間
+    (re.compile(r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'weekday_hours'),
+    (re.compile(r'土日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'weekend_hours'),
+    (re.compile(r'月曜.*?(\d{1,2}[:：]\d{2})'), 'monday_hours'),
+    (re.compile(r'火曜.*?(\d{1,2}[:：]\d{2})'), 'tuesday_hours'),
+    (re.compile(r'水曜.*?(\d{1,2}[:：]\d{2})'), 'wednesday_hours'),
+    (re.compile(r'木曜.*?(\d{1,2}[:：]\d{2})'), 'thursday_hours'),
+    (re.compile(r'金曜.*?(\d{1,2}[:：]\d{2})'), 'friday_hours'),
+)
+
+# ページ文言 → 現在のステータス（先に一致したものを採用）
+STATUS_KEYWORDS = {
+    '投票時間外': 'outside_hours',
+    'サービス時間外': 'outside_service',
+    '受付時間外': 'outside_reception',
+    'メンテナンス': 'maintenance',
+    '休業': 'closed',
+    '終了': 'ended',
+    'ログイン': 'available',
+    '投票': 'voting_available'
+}
+STATUS_KEYWORD_SET = KeywordSet(STATUS_KEYWORDS)
+
+# 営業時間パターン
+HOURS_PATTERNS = (
+    re.compile(r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})'),
+    re.compile(r'(\d{1,2})時\s*[〜～]\s*(\d{1,2})時'),
+    re.compile(r'(\d{1,2}[:：]\d{2})\s*開始.*?(\d{1,2}[:：]\d{2})\s*終了'),
+)
+
+# レース情報パターン
+RACE_INFO_PATTERNS = (
+    re.compile(r'(\d+)回\s*(\w+)\s*(\d+)日目'),
+    re.compile(r'(\w+競馬場)'),
+    re.compile(r'第(\d+)レース'),
+    re.compile(r'(\d+)R'),
+)
+
+# 投票不可/可能を示すキーワード
+UNAVAILABLE_KEYWORDS = (
+    '投票時間外', 'サービス時間外', '受付時間外', 'メンテナンス中', '休業中', '終了'
+)
+
+AVAILABLE_KEYWORDS = ('ログイン', '投票', 'INET-ID', '加入者番号')
+
+# 投票不可/可能の判定は両方のキーワードを1回の走査で検出する（不可を優先）
+VOTING_KEYWORD_SET = KeywordSet(UNAVAILABLE_KEYWORDS + AVAILABLE_KEYWORDS)
+
+# ページ構造解析でログに出す時間関連キーワード
+TIME_MESSAGE_KEYWORDS = KeywordSet((
+    '投票時間外', 'サービス時間外', '運営時間', 'メンテナンス', '受付時間', '販売時間', '休業', '終了'
+))
+
+# HTTP解析用の時間パターン
+HTTP_TIME_PATTERNS = (
+    re.compile(r'発売開始[:：]\s*(\d{1,2}[:：]\d{2})'),
+    re.compile(r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})'),
+    re.compile(r'次回.*?(\d{1,2}[:：]\d{2})'),
+    re.compile(r'土曜.*?(\d{1,2}[:：]\d{2})'),
+    re.compile(r'日曜.*?(\d{1,2}[:：]\d{2})'),
+)
+
+# 受付時間ページ用の時間パターン
+RECEPTION_TIME_PATTERNS = (
+    (re.compile(r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'Weekday hours'),
+    (re.compile(r'土.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'Saturday hours'),
+    (re.compile(r'日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'Sunday hours'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*～\s*(\d{1,2}[:：]\d{2})'), 'General time range'),
+    (re.compile(r'(\d{1,2})時\s*～\s*(\d{1,2})時'), 'Hour range'),
+    (re.compile(r'月.*?(\d{1,2}[:：]\d{2})'), 'Monday time'),
+    (re.compile(r'火.*?(\d{1,2}[:：]\d{2})'), 'Tuesday time'),
+    (re.compile(r'水.*?(\d{1,2}[:：]\d{2})'), 'Wednesday time'),
+    (re.compile(r'木.*?(\d{1,2}[:：]\d{2})'), 'Thursday time'),
+    (re.compile(r'金.*?(\d{1,2}[:：]\d{2})'), 'Friday time'),
+    (re.compile(r'開催.*?(\d{1,2}[:：]\d{2})'), 'Race day start time'),
+    (re.compile(r'発売.*?(\d{1,2}[:：]\d{2})'), 'Ticket sales start time'),
+)
+
+# 発売時間詳細ページ用の時間パターン
+HATSUBAI_DETAIL_PATTERNS = (
+    (re.compile(r'金曜.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'Friday detailed hours'),
+    (re.compile(r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})'), 'Weekday detailed hours'),
+    (re.compile(r'(\d{1,2}[:：]\d{2})\s*～\s*(\d{1,2}[:：]\d{2})'), 'Time ranges'),
+    (re.compile(r'開始.*?(\d{1,2}[:：]\d{2})'), 'Start times'),
+    (re.compile(r'終了.*?(\d{1,2}[:：]\d{2})'), 'End times'),
+    (re.compile(r'発売.*?(\d{1,2}[:：]\d{2})'), 'Sales times'),
+)
+
+
+
+def combine_patterns(patterns) -> re.Pattern:
+    """複数のパターンを名前付きグループの選択肢として1つの正規表現にまとめる"""
+    return re.compile("|".join(f"(?P<p{i}>{pattern.pattern})" for i, pattern in enumerate(patterns)))
+
+
+def findall_each(combined: re.Pattern, patterns, text: str) -> list:
+    """結合パターンで1回だけ走査し、パターンごとの findall 相当の結果を返す"""
+    results = [[] for _ in patterns]
+    for match in combined.finditer(text):
+        i = int(match.lastgroup[1:])
+        start = combined.groupindex[match.lastgroup]
+        groups = match.groups()[start:start + patterns[i].groups]
+        if not groups:
+            results[i].append(match.group(0))
+        elif len(groups) == 1:
+            results[i].append(groups[0])
+        else:
+            results[i].append(groups)
+    return results
+
+
+def keyword_contexts(text: str, keyword: str, before: int, after: int, limit: int) -> list:
+    """キーワードの前後の文脈を同じ行の範囲で最大limit件取得（正規表現を使わずに走査）"""
+    contexts = []
+    idx = text.find(keyword)
+    while idx >= 0 and len(contexts) < limit:
+        end = idx + len(keyword)
+        line_start = text.rfind('\n', 0, idx) + 1
+        line_end = text.find('\n', end)
+        if line_end < 0:
+            line_end = len(text)
+        context_end = min(line_end, end + after)
+        contexts.append(text[max(line_start, idx - before):context_end])
+        idx = text.find(keyword, context_end)
+    return contexts
+
+
+DETAILED_TIME_REGEX = combine_patterns(pattern for pattern, _ in DETAILED_TIME_PATTERNS)
+HOURS_REGEX = combine_patterns(HOURS_PATTERNS)
+HTTP_TIME_REGEX = combine_patterns(HTTP_TIME_PATTERNS)
+RECEPTION_TIME_REGEX = combine_patterns(pattern for pattern, _ in RECEPTION_TIME_PATTERNS)
+HATSUBAI_DETAIL_REGEX = combine_patterns(pattern for pattern, _ in HATSUBAI_DETAIL_PATTERNS)
+
+# HTTP解析用のHTMLスキャンパターン（BeautifulSoupでの全体パースの代わり）
+SCRIPT_STYLE_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]*>')
+TITLE_RE = re.compile(r'<title[^>]*>([^<]*)', re.I)
+FORM_OR_INPUT_TAG_RE = re.compile(r'<(?:form|input)\b', re.I)
+INPUT_TAG_RE = re.compile(r'<input\b([^>]*)>', re.I)
+LOGIN_WORD_RE = re.compile('login', re.I)
+LOGIN_WORD_BYTES_RE = re.compile(b'login', re.I)
+PASSWORD_WORD_RE = re.compile('password', re.I)
+PASSWORD_WORD_BYTES_RE = re.compile(b'password', re.I)
+ATTR_RE = re.compile(r'([\w-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+
+
+def decode_html(body: bytes, charset: Optional[str]) -> str:
+    """レスポンス本文をデコード（charset未指定・欧文指定はJRAサイトの文字コードとみなす）"""
+    if not charset or charset.lower() in ['iso-8859-1', 'windows-1252']:
+        charset = 'euc-jp'
+    try:
+        # 不正なバイトが1つあってもページ全体を文字化けさせないよう、その文字だけ置き換える
+        return body.decode(charset, errors='replace')
+    except LookupError:
+        # 未知の文字コード名の場合のフォールバック: UTF-8で試行
+        return body.decode('utf-8', errors='replace')
+
+
+def html_to_text(raw_html: str) -> str:
+    """script/style とタグを除いた表示テキスト"""
+    return html.unescape(TAG_RE.sub('', SCRIPT_STYLE_RE.sub('', raw_html)))
+
+
+def input_tag_attrs(raw_html: str) -> list:
+    """HTML中の<input>タグの属性を辞書のリストで取得"""
+    inputs = []
+    for tag in INPUT_TAG_RE.finditer(raw_html):
+        inputs.append({
+            name.lower(): html.unescape(double or single or bare)
+            for name, double, single, bare in ATTR_RE.findall(tag.group(1))
+        })
+    return inputs
+
+
+# 残高テキストから数字を抜き出すパターン
+AMOUNT_NUMBER_PATTERN = re.compile(r'[0-9,]+')
+
+# 残高キーワードの直後にある金額（レースのオッズや金額を拾わないようキーワードで位置を固定）
+BALANCE_TEXT_PATTERN = re.compile(r'(?:口座残高|残高|現在高|利用可能金額)[^0-9]{0,20}(\d[\d,]*)\s*円')
+
+# 残高表示に使われるクラス（キーワードもtdも無いページ向けのフォールバック）
+BALANCE_CLASS_SELECTOR = ', '.join([
+    '.balance',
+    '.amount',
+    '[class*="balance"]',
+    '[class*="amount"]',
+    '[class*="money"]',
+    '[class*="zandaka"]',  # 残高
+    '[class*="kingaku"]',  # 金額
+])
+
+# ボタン/リンク以外で選択肢になりうる要素
+CLICKABLE_FALLBACK_SELECTOR = 'a, button, div[onclick]'
+
+
+@functools.lru_cache(maxsize=None)
+def race_number_pattern(race_number: int) -> re.Pattern:
+    """レース番号表記（11R / R11 / 11レース）に一致するパターン"""
+    return re.compile(rf"^\s*(?:{race_number}R|R{race_number}\b|{race_number}レース)")
+
+
+async def click_by_pattern(page: Page, pattern: re.Pattern) -> bool:
+    """ボタン/リンク → クリック可能要素 → セレクトボックスの順に一致する要素を選択"""
+    if await click_first_match(button_or_link(page, pattern)):
+        return True
+    if await click_first_match(page.locator(CLICKABLE_FALLBACK_SELECTOR).filter(has_text=pattern), timeout=1000):
+        return True
+    
+    option = page.locator('select option').filter(has_text=pattern).first
+    if await option.count() == 0:
+        return False
+    try:
+        label = (await option.text_content() or '').strip()
+        await option.locator('xpath=ancestor::select').select_option(label=label)
+        return True
+    except Exception as select_error:
+        logger.debug(f"Failed to select option: {select_error}")
+        return False
+
+
+# 要素のテキストと主な属性をまとめて返す（ページ内で評価する関数）
+ELEMENT_ATTRS_JS = """e => ({
+    tag: e.tagName,
+    text: e.textContent || '',
+    value: e.getAttribute('value') || '',
+    alt: e.getAttribute('alt') || '',
+    src: e.getAttribute('src') || '',
+    class: e.getAttribute('class') || '',
+    onclick: e.getAttribute('onclick') || '',
+    href: e.getAttribute('href') || '',
+    name: e.getAttribute('name') || '',
+    placeholder: e.getAttribute('placeholder') || ''
+})"""
+
+
+async def element_attrs(element) -> dict:
+    """ElementHandle のテキストと主な属性を1回の呼び出しで取得"""
+    return await element.evaluate(ELEMENT_ATTRS_JS)
+
+
+async def all_element_attrs(page: Page, selector: str) -> list:
+    """selector に一致する全要素のテキストと主な属性を1回の呼び出しで取得（クリックは locator(selector).nth(i) で行う）"""
+    return await page.eval_on_selector_all(selector, "els => els.map(" + ELEMENT_ATTRS_JS + ")")
+
+
+async def describe_elements(page: Page, selectors: list, limit: int) -> list:
+    """各セレクタの件数と先頭limit件のテキスト・主要属性を1回の evaluate で取得（デバッグ用）"""
+    return await page.evaluate(
+        """([selectors, limit]) => selectors.map(selector => {
+            const elements = [...document.querySelectorAll(selector)];
+            return {
+                selector,
+                count: elements.length,
+                items: elements.slice(0, limit).map(""" + ELEMENT_ATTRS_JS + """)
+            };
+        })""",
+        [selectors, limit]
+    )
+
+
+# selectors を順に走査し、fields のいずれかが keywords のいずれかを含む最初の要素を返す
+FIND_BY_KEYWORDS_JS = """([selectors, keywords, fields, ignoreCase]) => {
+    const norm = s => ignoreCase ? s.toLowerCase() : s;
+    const needles = keywords.map(norm);
+    for (const selector of selectors) {
+        const elements = [...document.querySelectorAll(selector)];
+        for (let index = 0; index < elements.length; index++) {
+            const attrs = (""" + ELEMENT_ATTRS_JS + """)(elements[index]);
+            if (fields.some(f => needles.some(k => norm(attrs[f]).includes(k)))) {
+                return {...attrs, selector, index};
+            }
+        }
+    }
+    return null;
+}"""
+
+
+async def find_by_keywords(page: Page, selectors: list, keywords: list,
+                           fields=('text', 'alt', 'value'), ignore_case: bool = False) -> Optional[dict]:
+    """キーワードを含む最初の要素を1回の evaluate で探す（属性と selector/index を返す）"""
+    return await page.evaluate(FIND_BY_KEYWORDS_JS, [selectors, keywords, list(fields), ignore_case])
+
+
+def matched_locator(page: Page, match: dict):
+    """find_by_keywords の結果を指すロケータ"""
+    return page.locator(match['selector']).nth(match['index'])
+
+
+async def analyze_page_structure(page: Page, page_text: Optional[str] = None):
+    """ページのHTML構造を解析してログインフィールドを検出（page_text があれば再取得しない）"""
     try:
         # ページのタイトルを取得
         title = await page.title()
         logger.info(f"Page title: {title}")
         
         # ページ全体のテキストを取得して投票時間の状況を確認
-        page_text = await page.text_content('body')
+        if page_text is None:
+            page_text = await page.text_content('body')
         logger.info(f"Page content (first 500 chars): {page_text[:500] if page_text else 'No content'}")
         
         # 投票時間関連のメッセージをチェック
         if page_text:
-            time_keywords = ['投票時間外', 'サービス時間外', '運営時間', 'メンテナンス', 
-                           '受付時間', '販売時間', '休業', '終了']
-            for keyword in time_keywords:
-                if keyword in page_text:
+            found_keywords = TIME_MESSAGE_KEYWORDS.found(page_text)
+            for keyword in TIME_MESSAGE_KEYWORDS.keywords:
+                if keyword in found_keywords:
                     logger.warning(f"Found time-related message: {keyword}")
                     # 関連する部分を抽出
-                    import re
-                    pattern = f'.{{0,50}}{re.escape(keyword)}.{{0,100}}'
-                    matches = re.findall(pattern, page_text)
-                    for match in matches[:3]:  # 最初の3件を表示
+                    for match in keyword_contexts(page_text, keyword, 50, 100, limit=3):  # 最初の3件を表示
                         logger.info(f"Context: {match.strip()}")
         
+        # input/button/a の属性を1回の evaluate でまとめて取得
+        structure = await page.evaluate("""() => {
+            const attr = (e, name) => e.getAttribute(name) || '';
+            const links = [...document.querySelectorAll('a')];
+            return {
+                inputs: [...document.querySelectorAll('input')].map((e, i) => ({
+                    index: i,
+                    name: attr(e, 'name'),
+                    type: attr(e, 'type'),
+                    id: attr(e, 'id'),
+                    placeholder: attr(e, 'placeholder'),
+                    class: attr(e, 'class')
+                })),
+                buttons: [...document.querySelectorAll('button')].map(e => ({
+                    text: e.textContent || '',
+                    class: attr(e, 'class')
+                })),
+                linkCount: links.length,
+                links: links.slice(0, 10).map(e => ({
+                    text: e.textContent || '',
+                    href: attr(e, 'href')
+                }))
+            };
+        }""")
+        
         # すべてのinput要素を検出
-        inputs = await page.query_selector_all('input')
-        logger.info(f"Found {len(inputs)} input elements")
-        
-        input_info = []
-        for i, input_elem in enumerate(inputs):
-            name = await input_elem.get_attribute('name') or ''
-            type_attr = await input_elem.get_attribute('type') or ''
-            id_attr = await input_elem.get_attribute('id') or ''
-            placeholder = await input_elem.get_attribute('placeholder') or ''
-            class_attr = await input_elem.get_attribute('class') or ''
-            
-            input_info.append({
-                'index': i,
-                'name': name,
-                'type': type_attr,
-                'id': id_attr,
-                'placeholder': placeholder,
-                'class': class_attr
-            })
-            
-            logger.info(f"Input {i}: name='{name}', type='{type_attr}', id='{id_attr}', placeholder='{placeholder}'")
+        input_info = structure['inputs']
+        logger.info(f"Found {len(input_info)} input elements")
+        for info in input_info:
+            logger.info(f"Input {info['index']}: name='{info['name']}', type='{info['type']}', id='{info['id']}', placeholder='{info['placeholder']}'")
         
         # すべてのbutton要素を検出
-        buttons = await page.query_selector_all('button')
-        logger.info(f"Found {len(buttons)} button elements")
-        
-        for i, button in enumerate(buttons):
-            text = await button.text_content() or ''
-            class_attr = await button.get_attribute('class') or ''
-            logger.info(f"Button {i}: text='{text.strip()}', class='{class_attr}'")
+        logger.info(f"Found {len(structure['buttons'])} button elements")
+        for i, button in enumerate(structure['buttons']):
+            logger.info(f"Button {i}: text='{button['text'].strip()}', class='{button['class']}'")
         
         # aタグもチェック（ログインリンクの可能性）
-        links = await page.query_selector_all('a')
-        logger.info(f"Found {len(links)} link elements")
-        
-        for i, link in enumerate(links[:10]):  # 最初の10個だけ表示
-            text = await link.text_content() or ''
-            href = await link.get_attribute('href') or ''
-            if text.strip():
-                logger.info(f"Link {i}: text='{text.strip()}', href='{href}'")
+        logger.info(f"Found {structure['linkCount']} link elements")
+        for i, link in enumerate(structure['links']):  # 最初の10個だけ表示
+            if link['text'].strip():
+                logger.info(f"Link {i}: text='{link['text'].strip()}', href='{link['href']}'")
         
         return input_info
         
@@ -159,8 +649,8 @@ async def analyze_page_structure(page: Page):
         return []
 
 
-async def extract_detailed_time_info(page: Page) -> dict:
-    """ページから詳細な時間情報を抽出"""
+async def extract_detailed_time_info(page: Page, page_text: Optional[str] = None) -> dict:
+    """ページから詳細な時間情報を抽出（page_text があれば再取得しない）"""
     time_info = {
         'next_start_time': None,
         'current_status': 'unknown',
@@ -170,41 +660,12 @@ async def extract_detailed_time_info(page: Page) -> dict:
     }
     
     try:
-        page_text = await page.text_content('body') or ''
+        if page_text is None:
+            page_text = await page.text_content('body') or ''
         
         # 時間パターンの詳細解析
-        import re
-        
-        # より詳細な時間パターン
-        time_patterns = [
-            # 開始時間パターン
-            (r'発売開始[:：]\s*(\d{1,2}[:：]\d{2})', 'sales_start'),
-            (r'投票開始[:：]\s*(\d{1,2}[:：]\d{2})', 'voting_start'),
-            (r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})', 'time_range'),
-            (r'(\d{1,2}[:：]\d{2})\s*開始', 'start_time'),
-            (r'(\d{1,2}[:：]\d{2})\s*発売', 'sales_time'),
-            (r'(\d{1,2}[:：]\d{2})\s*受付', 'reception_time'),
-            
-            # 次回開催情報
-            (r'次回.*?(\d{1,2}[:：]\d{2})', 'next_time'),
-            (r'明日.*?(\d{1,2}[:：]\d{2})', 'tomorrow_time'),
-            (r'土曜.*?(\d{1,2}[:：]\d{2})', 'saturday_time'),
-            (r'日曜.*?(\d{1,2}[:：]\d{2})', 'sunday_time'),
-            
-            # 曜日別営業時間
-            (r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'weekday_hours'),
-            (r'土日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'weekend_hours'),
-            (r'月曜.*?(\d{1,2}[:：]\d{2})', 'monday_hours'),
-            (r'火曜.*?(\d{1,2}[:：]\d{2})', 'tuesday_hours'),
-            (r'水曜.*?(\d{1,2}[:：]\d{2})', 'wednesday_hours'),
-            (r'木曜.*?(\d{1,2}[:：]\d{2})', 'thursday_hours'),
-            (r'金曜.*?(\d{1,2}[:：]\d{2})', 'friday_hours'),
-            (r'土曜.*?(\d{1,2}[:：]\d{2})', 'saturday_hours'),
-            (r'日曜.*?(\d{1,2}[:：]\d{2})', 'sunday_hours'),
-        ]
-        
-        for pattern, time_type in time_patterns:
-            matches = re.findall(pattern, page_text)
+        found = findall_each(DETAILED_TIME_REGEX, [p for p, _ in DETAILED_TIME_PATTERNS], page_text)
+        for (_, time_type), matches in zip(DETAILED_TIME_PATTERNS, found):
             if matches:
                 logger.info(f"Found {time_type}: {matches}")
                 time_info['specific_times'].append({
@@ -217,45 +678,20 @@ async def extract_detailed_time_info(page: Page) -> dict:
                     time_info['next_start_time'] = matches[0] if isinstance(matches[0], str) else matches[0][0]
         
         # 現在のステータスを判定
-        status_keywords = {
-            '投票時間外': 'outside_hours',
-            'サービス時間外': 'outside_service',
-            '受付時間外': 'outside_reception', 
-            'メンテナンス': 'maintenance',
-            '休業': 'closed',
-            '終了': 'ended',
-            'ログイン': 'available',
-            '投票': 'voting_available'
-        }
-        
-        for keyword, status in status_keywords.items():
-            if keyword in page_text:
-                time_info['current_status'] = status
-                logger.info(f"Current status: {status} (keyword: {keyword})")
-                break
+        keyword = STATUS_KEYWORD_SET.first(page_text)
+        if keyword:
+            status = STATUS_KEYWORDS[keyword]
+            time_info['current_status'] = status
+            logger.info(f"Current status: {status} (keyword: {keyword})")
         
         # 営業時間の詳細情報を抽出
-        hours_patterns = [
-            r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})',
-            r'(\d{1,2})時\s*[〜～]\s*(\d{1,2})時',
-            r'(\d{1,2}[:：]\d{2})\s*開始.*?(\d{1,2}[:：]\d{2})\s*終了'
-        ]
-        
-        for pattern in hours_patterns:
-            hours_matches = re.findall(pattern, page_text)
+        for hours_matches in findall_each(HOURS_REGEX, HOURS_PATTERNS, page_text):
             if hours_matches:
                 time_info['detailed_hours'].extend(hours_matches)
         
         # レース情報を検索
-        race_patterns = [
-            r'(\d+)回\s*(\w+)\s*(\d+)日目',
-            r'(\w+競馬場)',
-            r'第(\d+)レース',
-            r'(\d+)R'
-        ]
-        
-        for pattern in race_patterns:
-            race_matches = re.findall(pattern, page_text)
+        for pattern in RACE_INFO_PATTERNS:
+            race_matches = pattern.findall(page_text)
             if race_matches:
                 time_info['next_race_info'] = race_matches
                 logger.info(f"Found race info: {race_matches}")
@@ -268,37 +704,34 @@ async def extract_detailed_time_info(page: Page) -> dict:
         return time_info
 
 
-async def check_voting_availability(page: Page) -> bool:
-    """投票可能時間かどうかをチェック（詳細解析対応）"""
+async def check_voting_availability(page: Page, page_text: Optional[str] = None) -> bool:
+    """投票可能時間かどうかをチェック（詳細解析対応・page_text があれば再取得しない）"""
     try:
-        # 詳細な時間情報を抽出
-        time_info = await extract_detailed_time_info(page)
-        
-        page_text = await page.text_content('body')
+        if page_text is None:
+            page_text = await page.text_content('body') or ''
         if not page_text:
             return False
         
-        # 投票不可を示すキーワード
-        unavailable_keywords = ['投票時間外', 'サービス時間外', '受付時間外',
-                               'メンテナンス中', '休業中', '終了']
+        # 詳細な時間情報を抽出
+        time_info = await extract_detailed_time_info(page, page_text)
         
-        for keyword in unavailable_keywords:
-            if keyword in page_text:
-                logger.warning(f"Voting unavailable: {keyword} found in page")
-                
-                # 次回開始時間があれば表示
-                if time_info['next_start_time']:
-                    logger.info(f"Next start time may be: {time_info['next_start_time']}")
-                
-                return False
+        # 投票不可を示すキーワード
+        found_keywords = VOTING_KEYWORD_SET.found(page_text)
+        keyword = next((k for k in UNAVAILABLE_KEYWORDS if k in found_keywords), None)
+        if keyword:
+            logger.warning(f"Voting unavailable: {keyword} found in page")
+            
+            # 次回開始時間があれば表示
+            if time_info['next_start_time']:
+                logger.info(f"Next start time may be: {time_info['next_start_time']}")
+            
+            return False
         
         # 投票可能を示すキーワード
-        available_keywords = ['ログイン', '投票', 'INET-ID', '加入者番号']
-        
-        for keyword in available_keywords:
-            if keyword in page_text:
-                logger.info(f"Voting may be available: {keyword} found in page")
-                return True
+        keyword = next((k for k in AVAILABLE_KEYWORDS if k in found_keywords), None)
+        if keyword:
+            logger.info(f"Voting may be available: {keyword} found in page")
+            return True
         
         return False
         
@@ -307,6 +740,33 @@ async def check_voting_availability(page: Page) -> bool:
         return False
 
 
+# 有名な開催日（例：ダービー、天皇賞など）
+SPECIAL_RACE_DAYS = frozenset({
+    (5, 4),   # みどりの日（春の天皇賞）
+    (5, 5),   # こどもの日（NHKマイルC）
+    (10, 14), # 体育の日（秋の天皇賞）
+    (12, 28), # 年末（有馬記念）
+    (12, 29), # 年末
+})
+
+# 祝日（簡易版）
+JP_HOLIDAYS = {
+    (1, 1): "元日",
+    (2, 11): "建国記念の日",
+    (4, 29): "昭和の日",
+    (5, 3): "憲法記念日",
+    (5, 4): "みどりの日",
+    (5, 5): "こどもの日",
+    (7, 20): "海の日",
+    (8, 11): "山の日",
+    (9, 21): "敬老の日",
+    (10, 14): "体育の日",
+    (11, 3): "文化の日",
+    (11, 23): "勤労感謝の日",
+    (12, 23): "天皇誕生日"
+}
+
+
 async def check_race_day_schedule(current_time) -> dict:
     """今日の競馬開催日かどうかを詳細チェック"""
     try:
@@ -334,39 +794,15 @@ async def check_race_day_schedule(current_time) -> dict:
         month = current_time.month
         day = current_time.day
         
-        # 有名な開催日（例：ダービー、天皇賞など）
-        special_dates = [
-            (5, 4),   # みどりの日（春の天皇賞）
-            (5, 5),   # こどもの日（NHKマイルC）
-            (10, 14), # 体育の日（秋の天皇賞）
-            (12, 28), # 年末（有馬記念）
-            (12, 29), # 年末
-        ]
-        
-        if (month, day) in special_dates:
+        if (month, day) in SPECIAL_RACE_DAYS:
             schedule_info['central_jra'] = True
             schedule_info['reason'] += f" / Special racing day: {month}/{day}"
         
         # 今日が祝日かチェック（簡易版）
-        holidays = {
-            (1, 1): "元日",
-            (2, 11): "建国記念の日",
-            (4, 29): "昭和の日",
-            (5, 3): "憲法記念日",
-            (5, 4): "みどりの日",
-            (5, 5): "こどもの日",
-            (7, 20): "海の日",
-            (8, 11): "山の日",
-            (9, 21): "敬老の日",
-            (10, 14): "体育の日",
-            (11, 3): "文化の日",
-            (11, 23): "勤労感謝の日",
-            (12, 23): "天皇誕生日"
-        }
-        
-        if (month, day) in holidays:
+        holiday = JP_HOLIDAYS.get((month, day))
+        if holiday:
             schedule_info['central_jra'] = True
-            schedule_info['reason'] += f" / Holiday: {holidays[(month, day)]}"
+            schedule_info['reason'] += f" / Holiday: {holiday}"
         
         return schedule_info
         
@@ -379,6 +815,34 @@ async def check_race_day_schedule(current_time) -> dict:
         }
 
 
+# これより小さい応答は詳細解析しない（時間外のスタブページなど）
+MIN_ANALYSIS_BODY_BYTES = 500
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """サイト解析用のHTTPセッション（接続・TLSセッションを使い回す）"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            headers=HTTP_HEADERS,
+            connector=aiohttp.TCPConnector(limit=4)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """サイト解析用のHTTPセッションを閉じる"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
 async def http_based_site_analysis():
     """HTTPリクエストベースでのサイト解析（中央JRAのみ）"""
     logger.info("Starting HTTP-based site analysis for central JRA...")
@@ -386,36 +850,45 @@ async def http_based_site_analysis():
     try:
         logger.info(f"Analyzing central JRA: {IPAT_URL}")
         
-        # HTTPリクエストでページを取得
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(IPAT_URL, headers=headers, timeout=30)
-        
-        # エンコーディングを自動検出してから設定
-        if response.encoding.lower() in ['iso-8859-1', 'windows-1252']:
-            response.encoding = 'euc-jp'  # JRAサイトの文字コード
+        # HTTPリクエストでページを取得（イベントループを止めないよう aiohttp で取得）
+        async with get_http_session().get(IPAT_URL, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            status_code = response.status
+            content_type = response.headers.get('content-type', 'N/A')
+            encoding = response.charset
+            body = await response.read()
         
-        logger.info(f"Response encoding: {response.encoding}, Content-Type: {response.headers.get('content-type', 'N/A')}")
+        logger.info(f"Response encoding: {encoding or 'euc-jp (assumed)'}, Content-Type: {content_type}")
         
-        if response.status_code != 200:
-            logger.warning(f"Central JRA: HTTP {response.status_code}")
+        if status_code != 200:
+            logger.warning(f"Central JRA: HTTP {status_code}")
             return {
                 'status': 'error',
-                'http_code': response.status_code,
+                'http_code': status_code,
                 'available': False
             }
         
+        # ASCIIのみの目印はデコード前のバイト列で判定
+        has_out_of_service = b'OutOfService' in body
+        has_doctype = b'DOCTYPE' in body
+        mentions_javascript = b'JavaScript' in body
+        
+        # 時間外のスタブページ・極小ページはデコードや解析をせずに返す
+        if has_out_of_service or len(body) < MIN_ANALYSIS_BODY_BYTES:
+            service_status = 'out_of_service' if has_out_of_service else 'unknown'
+            logger.info(f"Skipping detailed analysis: status={service_status}, body={len(body)} bytes")
+            logger.warning("✗ Central JRA is not available for voting")
+            return {
+                'status': service_status,
+                'http_code': status_code,
+                'available': False,
+                'time_info': [],
+                'page_title': '',
+                'content_length': len(body)
+            }
+        
         # HTMLを解析（複数エンコーディングで試行）
-        try:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            page_text = soup.get_text()
-        except UnicodeDecodeError:
-            # フォールバック: UTF-8で試行
-            response.encoding = 'utf-8'
-            soup = BeautifulSoup(response.text, 'html.parser')
-            page_text = soup.get_text()
+        raw_html = decode_html(body, encoding)
+        page_text = html_to_text(raw_html)
         
         logger.info(f"Page text length: {len(page_text)}")
         logger.info(f"First 200 chars of page text: {repr(page_text[:200])}")
@@ -424,9 +897,8 @@ async def http_based_site_analysis():
         service_status = 'unknown'
         
         # まず生のHTMLをチェック
-        raw_html = response.text
         logger.info(f"Raw HTML length: {len(raw_html)}")
-        logger.info(f"Raw HTML contains: OutOfService={bool('OutOfService' in raw_html)}, DOCTYPE={bool('DOCTYPE' in raw_html)}")
+        logger.info(f"Raw HTML contains: OutOfService={has_out_of_service}, DOCTYPE={has_doctype}")
         
         # HTMLパースしたテキストもチェック
         if '投票時間外' in page_text or '受付時間外' in page_text:
@@ -438,10 +910,10 @@ async def http_based_site_analysis():
         elif 'ログイン' in page_text and 'INET-ID' in page_text:
             service_status = 'available'
             logger.info("Found 'ログイン' and 'INET-ID' in page text - voting likely available")
-        elif 'OutOfService' in raw_html:
+        elif has_out_of_service:
             service_status = 'out_of_service'
             logger.info("Found 'OutOfService' in raw HTML")
-        elif 'DOCTYPE' in raw_html and len(page_text) > 200:
+        elif has_doctype and len(page_text) > 200:
             # 正常なHTMLページがロードされている場合
             logger.info(f"Page text preview (first 500 chars): {page_text[:500]}")
             
@@ -451,25 +923,25 @@ async def http_based_site_analysis():
                 
                 # より詳細なキーワード検索（生HTMLとパースされたテキスト両方で）
                 keywords_check = {
-                    'INET-ID': ('INET-ID' in page_text or 'INET-ID' in raw_html),
+                    'INET-ID': ('INET-ID' in page_text or b'INET-ID' in body),
                     'ログイン': ('ログイン' in page_text or 'ログイン' in raw_html),
                     '投票': ('投票' in page_text or '投票' in raw_html),
                     '加入者番号': ('加入者番号' in page_text or '加入者番号' in raw_html),
                     '暗証番号': ('暗証番号' in page_text or '暗証番号' in raw_html),
                     'パスワード': ('パスワード' in page_text or 'パスワード' in raw_html),
-                    'login': ('login' in page_text.lower() or 'login' in raw_html.lower()),
-                    'password': ('password' in page_text.lower() or 'password' in raw_html.lower()),
+                    'login': bool(LOGIN_WORD_RE.search(page_text) or LOGIN_WORD_BYTES_RE.search(body)),
+                    'password': bool(PASSWORD_WORD_RE.search(page_text) or PASSWORD_WORD_BYTES_RE.search(body)),
                 }
                 
                 found_keywords = [k for k, v in keywords_check.items() if v]
                 logger.info(f"Keywords found on page: {found_keywords}")
                 
                 # フォーム要素を探す
-                form_elements = soup.find_all(['form', 'input'])
-                logger.info(f"Found {len(form_elements)} form elements on page")
+                form_element_count = len(FORM_OR_INPUT_TAG_RE.findall(raw_html))
+                logger.info(f"Found {form_element_count} form elements on page")
                 
                 # 入力フィールドの詳細
-                input_fields = soup.find_all('input')
+                input_fields = input_tag_attrs(raw_html)
                 input_types = [inp.get('type', 'text') for inp in input_fields]
                 input_names = [inp.get('name', '') for inp in input_fields]
                 logger.info(f"Input field types: {input_types}")
@@ -483,41 +955,32 @@ async def http_based_site_analysis():
                 if has_login_keywords or (has_input_fields and has_password_field):
                     service_status = 'likely_available'
                     logger.info("Login functionality detected - likely available for voting")
-                elif 'JavaScript' in raw_html:
+                elif mentions_javascript:
                     service_status = 'requires_js'
                     logger.info("Page requires JavaScript - may be available but needs browser")
             else:
                 logger.warning("JRA not found in page content - unexpected page")
         
         # ページタイトルもチェック
-        page_title = soup.title.string if soup.title else ''
+        title_match = TITLE_RE.search(raw_html)
+        page_title = html.unescape(title_match.group(1)) if title_match else ''
         logger.info(f"Page title: {page_title}")
         
         if 'エラー' in page_title or 'Error' in page_title:
             service_status = 'error_page'
         
         # 時間情報を抽出
-        import re
-        time_patterns = [
-            r'発売開始[:：]\s*(\d{1,2}[:：]\d{2})',
-            r'(\d{1,2}[:：]\d{2})\s*[〜～]\s*(\d{1,2}[:：]\d{2})',
-            r'次回.*?(\d{1,2}[:：]\d{2})',
-            r'土曜.*?(\d{1,2}[:：]\d{2})',
-            r'日曜.*?(\d{1,2}[:：]\d{2})',
-        ]
-        
         time_info = []
-        for pattern in time_patterns:
-            matches = re.findall(pattern, page_text)
+        for matches in findall_each(HTTP_TIME_REGEX, HTTP_TIME_PATTERNS, page_text):
             if matches:
                 time_info.extend(matches)
         
         analysis_result = {
             'status': service_status,
-            'http_code': response.status_code,
+            'http_code': status_code,
             'available': service_status in ['available', 'likely_available', 'requires_js'],
             'time_info': time_info,
-            'page_title': soup.title.string if soup.title else '',
+            'page_title': page_title,
             'content_length': len(page_text)
         }
         
@@ -532,7 +995,7 @@ async def http_based_site_analysis():
         
         return analysis_result
         
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"HTTP request failed for central JRA: {e}")
         return {
             'status': 'connection_error',
@@ -548,6 +1011,14 @@ async def http_based_site_analysis():
         }
 
 
+# 受付時間ページへのリンクとみなすURLの一部
+RECEPTION_LINK_KEYS = ('hatsubai', 'soku', 'apat', 'hatsubaijikan')
+MAX_PARALLEL_FETCHES = 3
+# 金曜・平日開催の手がかり（単独の「金」は「金額」などに誤一致するため含めない）
+FRIDAY_KEYWORDS = KeywordSet(('金曜', 'Friday', '平日'))
+CHARSET_RE = re.compile(r'charset=([\w-]+)', re.I)
+
+
 async def check_reception_hours(page: Page):
     """受付時間の詳細情報を確認"""
     try:
@@ -574,70 +1045,59 @@ async def check_reception_hours(page: Page):
         else:
             logger.info(f"Current hour is {hour} - within potential voting hours")
         
-        # 受付時間に関するリンクを詳しく調べる
-        links = await page.query_selector_all('a')
+        # 受付時間に関するリンクを1回の evaluate で抽出
+        links = await page.evaluate(
+            "() => [...document.querySelectorAll('a')].map(a => ({text: a.textContent || '', href: a.href || ''}))"
+        )
+        targets = []
         for link in links:
-            text = await link.text_content() or ''
-            href = await link.get_attribute('href') or ''
-            if '受付時間' in text or 'hatsubai' in href or 'soku' in href or 'apat' in href or 'hatsubaijikan' in href:
+            text, href = link['text'], link['href']
+            if '受付時間' in text or any(key in href for key in RECEPTION_LINK_KEYS):
                 logger.info(f"Found time-related link: '{text.strip()}' -> {href}")
-                
-                # 特に重要なリンク（hatsubaijikan.html）を優先処理
+                if href not in targets:
+                    targets.append(href)
+        
+        # 候補ページはナビゲーションせずHTTPで並列取得（同時取得数は制限）
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_FETCHES)
+        
+        async def fetch_text(href: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    response = await page.request.get(href, timeout=TIMEOUT_MS)
+                    charset_match = CHARSET_RE.search(response.headers.get('content-type', ''))
+                    body = await response.body()
+                    return html_to_text(decode_html(body, charset_match.group(1) if charset_match else None))
+                except Exception as e:
+                    logger.debug(f"Failed to fetch {href}: {e}")
+                    return None
+        
+        hours_texts = await asyncio.gather(*[fetch_text(href) for href in targets])
+        
+        # 元のリンク順で最初に詳細情報が得られたページを採用
+        for href, hours_text in zip(targets, hours_texts):
+            if hours_text and len(hours_text) > 200:  # 元のページと異なる内容の場合
                 if 'hatsubaijikan' in href:
                     logger.info(f"Priority processing for reception hours page: {href}")
+                logger.info(f"Time info from {href} (first 2000 chars): {hours_text[:2000]}")
                 
-                # 直接URLで詳細ページを開く
-                try:
-                    await page.goto(href)
-                    await page.wait_for_timeout(5000)  # 長めに待機
-                    await take_screenshot(page, f"time_info_{href.split('/')[-1]}")
-                    
-                    # 詳細情報を取得
-                    hours_text = await page.text_content('body')
-                    if hours_text and len(hours_text) > 200:  # 元のページと異なる内容の場合
-                        logger.info(f"Time info from {href} (first 2000 chars): {hours_text[:2000]}")
-                        
-                        # より詳細な時間パターンを探す
-                        import re
-                        time_patterns = [
-                            (r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'Weekday hours'),
-                            (r'土.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'Saturday hours'),
-                            (r'日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'Sunday hours'),
-                            (r'(\d{1,2}[:：]\d{2})\s*～\s*(\d{1,2}[:：]\d{2})', 'General time range'),
-                            (r'(\d{1,2})時\s*～\s*(\d{1,2})時', 'Hour range'),
-                            (r'月.*?(\d{1,2}[:：]\d{2})', 'Monday time'),
-                            (r'火.*?(\d{1,2}[:：]\d{2})', 'Tuesday time'),
-                            (r'水.*?(\d{1,2}[:：]\d{2})', 'Wednesday time'),
-                            (r'木.*?(\d{1,2}[:：]\d{2})', 'Thursday time'),
-                            (r'金.*?(\d{1,2}[:：]\d{2})', 'Friday time'),
-                            (r'開催.*?(\d{1,2}[:：]\d{2})', 'Race day start time'),
-                            (r'発売.*?(\d{1,2}[:：]\d{2})', 'Ticket sales start time'),
-                        ]
-                        
-                        for pattern, desc in time_patterns:
-                            matches = re.findall(pattern, hours_text)
-                            if matches:
-                                logger.info(f"Found {desc}: {matches}")
-                        
-                        # 金曜日や平日の開催情報を特に探す
-                        friday_keywords = ['金曜', '金', 'Friday', '平日']
-                        for keyword in friday_keywords:
-                            if keyword in hours_text:
-                                logger.info(f"Found Friday/weekday reference: {keyword}")
-                                # 前後の文脈を取得
-                                import re
-                                context_pattern = f'.{{0,100}}{re.escape(keyword)}.{{0,100}}'
-                                context_matches = re.findall(context_pattern, hours_text)
-                                for context in context_matches[:2]:
-                                    logger.info(f"Context for {keyword}: {context.strip()}")
-                        
-                        return  # 詳細情報を見つけたら終了
-                    else:
-                        logger.debug(f"No detailed time info found at {href}")
-                        
-                except Exception as e:
-                    logger.debug(f"Failed to navigate to {href}: {e}")
-                    continue
+                # より詳細な時間パターンを探す
+                found = findall_each(RECEPTION_TIME_REGEX, [p for p, _ in RECEPTION_TIME_PATTERNS], hours_text)
+                for (_, desc), matches in zip(RECEPTION_TIME_PATTERNS, found):
+                    if matches:
+                        logger.info(f"Found {desc}: {matches}")
+                
+                # 金曜日や平日の開催情報を特に探す
+                found_keywords = FRIDAY_KEYWORDS.found(hours_text)
+                for keyword in FRIDAY_KEYWORDS.keywords:
+                    if keyword in found_keywords:
+                        logger.info(f"Found Friday/weekday reference: {keyword}")
+                        # 前後の文脈を取得
+                        for context in keyword_contexts(hours_text, keyword, 100, 100, limit=2):
+                            logger.info(f"Context for {keyword}: {context.strip()}")
+                
+                return  # 詳細情報を見つけたら終了
+            else:
+                logger.debug(f"No detailed time info found at {href}")
         
         logger.warning("Could not find detailed reception hours information")
         
@@ -645,9 +1105,72 @@ async def check_reception_hours(page: Page):
         logger.error(f"Failed to check reception hours: {e}")
 
 
-async def find_login_fields(page: Page):
+# ページ（ホスト＋パス）と項目名 → 前回成功したセレクタ（初回参照時にファイルから読み込む）
+_selector_cache = None
+_selector_cache_dirty = False
+
+# どのページにも一致しうる汎用の候補（記録すると次回以降に固有の候補より先に試されてしまうため記録しない）
+GENERIC_FALLBACKS = frozenset({
+    'input[type="text"]',
+    'input[type="password"]',
+    'document.getElementsByTagName("form")[0].submit()',
+})
+
+
+def _selector_cache_key(url: str, name: str) -> str:
+    """キャッシュのキー（クエリ・フラグメントは除いたページのURLと項目名）"""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}|{name}"
+
+
+def _load_selector_cache() -> dict:
+    global _selector_cache
+    if _selector_cache is None:
+        try:
+            with open(SELECTOR_CACHE_PATH, encoding='utf-8') as f:
+                _selector_cache = json.load(f)
+        except (OSError, ValueError):
+            _selector_cache = {}
+    return _selector_cache
+
+
+def prefer_cached_selector(url: str, name: str, selectors: list) -> list:
+    """同じページで前回成功したセレクタを先頭に並べ替える（無ければそのまま）"""
+    cached = _load_selector_cache().get(_selector_cache_key(url, name))
+    if cached in selectors:
+        return [cached] + [selector for selector in selectors if selector != cached]
+    return selectors
+
+
+def remember_selector(url: str, name: str, selector: str):
+    """成功したセレクタをページごとに記録（汎用の候補は記録しない。保存は save_selector_cache でまとめて行う）"""
+    global _selector_cache_dirty
+    if selector in GENERIC_FALLBACKS:
+        return
+    cache = _load_selector_cache()
+    key = _selector_cache_key(url, name)
+    if cache.get(key) != selector:
+        cache[key] = selector
+        _selector_cache_dirty = True
+
+
+def save_selector_cache():
+    """記録したセレクタをファイルへ書き出す"""
+    global _selector_cache_dirty
+    if not _selector_cache_dirty:
+        return
+    try:
+        Path(SELECTOR_CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        with open(SELECTOR_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(_selector_cache, f, ensure_ascii=False, indent=2)
+        _selector_cache_dirty = False
+    except OSError as e:
+        logger.warning(f"Failed to save selector cache: {e}")
+
+
+async def find_login_fields(page: Page, page_text: Optional[str] = None):
     """ログインフィールドを動的に検出"""
-    input_info = await analyze_page_structure(page)
+    input_info = await analyze_page_structure(page, page_text)
     
     # INET-IDフィールドを探す
     inet_selectors = [
@@ -660,17 +1183,6 @@ async def find_login_fields(page: Page):
         'input[type="text"]',  # 最初のtextフィールド
     ]
     
-    inet_field = None
-    for selector in inet_selectors:
-        try:
-            element = await page.query_selector(selector)
-            if element:
-                logger.info(f"Found INET field with selector: {selector}")
-                inet_field = selector
-                break
-        except:
-            continue
-    
     # パスワードフィールドを探す
     password_selectors = [
         'input[name="password"]',
@@ -680,36 +1192,70 @@ async def find_login_fields(page: Page):
         'input[type="password"]',
     ]
     
-    password_field = None
-    for selector in password_selectors:
-        try:
-            element = await page.query_selector(selector)
-            if element:
-                logger.info(f"Found password field with selector: {selector}")
-                password_field = selector
-                break
-        except:
-            continue
+    # 優先順に最初に存在するセレクタを1回の evaluate でまとめて判定
+    inet_field, password_field = await page.evaluate(
+        """([inetSelectors, passwordSelectors]) => [inetSelectors, passwordSelectors].map(
+            selectors => selectors.find(selector => document.querySelector(selector)) || null
+        )""",
+        [prefer_cached_selector(page.url, 'inet_id', inet_selectors),
+         prefer_cached_selector(page.url, 'inet_password', password_selectors)]
+    )
+    if inet_field:
+        logger.info(f"Found INET field with selector: {inet_field}")
+        remember_selector(page.url, 'inet_id', inet_field)
+    if password_field:
+        logger.info(f"Found password field with selector: {password_field}")
+        remember_selector(page.url, 'inet_password', password_field)
     
     return inet_field, password_field
 
 
+async def fill_first_match(page: Page, name: str, selectors: list, value: Optional[str]) -> bool:
+    """
+    候補セレクタのうち優先順で最初に存在するものに入力（値が空なら何もしない）
+
+    まとめたロケータの .first は文書順になるため、出現を待つのにだけ使い、入力先は候補の順に選ぶ。
+    """
+    if not value:
+        return False
+    try:
+        await page.locator(', '.join(selectors)).first.wait_for(state="attached", timeout=5000)
+    except TimeoutError:
+        logger.debug(f"No {name} field matched: {selectors}")
+        return False
+    selector = await page.evaluate(
+        "selectors => selectors.find(selector => document.querySelector(selector)) || null", selectors
+    )
+    if not selector:
+        logger.debug(f"No {name} field matched: {selectors}")
+        return False
+    try:
+        await page.locator(selector).first.fill(value, timeout=5000)
+    except TimeoutError:
+        logger.debug(f"Failed to fill {name} field: {selector}")
+        return False
+    logger.info(f"Filled {name} field with selector: {selector}")
+    return True
+
+
 async def login_ipat_v2(page: Page, credentials: dict):
     """IPAT 2段階ログイン（中央JRAのみ・動的フィールド検出対応）"""
     try:
         logger.info("Starting IPAT login process for central JRA...")
         
+        # 入力フォームの段階はCSS不要なので、読み込みを待たずに済むよう止めておく
+        await block_stylesheets(page)
+        
         # 中央JRAサイトへアクセス
         if not await safe_navigate(page, IPAT_URL, TIMEOUT_MS):
             raise Exception("Failed to navigate to central JRA IPAT")
         
-        await page.wait_for_timeout(4000)  # Seleniumと同じ待機時間
-        
         # スクリーンショットを保存（初期ページ）
-        await take_screenshot(page, "ipat_central_jra_initial")
+        await take_milestone_screenshot(page, "ipat_central_jra_initial")
         
-        # 投票可能状況をチェック
-        voting_available = await check_voting_availability(page)
+        # 投票可能状況をチェック（本文は1回だけ取得して使い回す）
+        page_text = await page.text_content('body') or ''
+        voting_available = await check_voting_availability(page, page_text)
         
         if not voting_available:
             logger.warning("Central JRA IPAT is not available for voting (outside business hours)")
@@ -720,13 +1266,12 @@ async def login_ipat_v2(page: Page, credentials: dict):
         logger.info("✓ Central JRA IPAT appears to be available for voting")
         
         # スクリーンショットを保存（利用可能確認後）
-        await take_screenshot(page, "ipat_central_jra_ready")
+        await take_milestone_screenshot(page, "ipat_central_jra_ready")
         
         # ページ構造を解析
-        inet_field, password_field = await find_login_fields(page)
+        inet_field, password_field = await find_login_fields(page, page_text)
         
-        # 投票可能時間かチェック
-        voting_available = await check_voting_availability(page)
+        # 投票可能時間かチェック（ページは変わっていないので先の判定結果を使う）
         if not voting_available:
             logger.warning("Voting appears to be unavailable (outside business hours or maintenance)")
             # 受付時間の詳細情報を確認
@@ -736,26 +1281,20 @@ async def login_ipat_v2(page: Page, credentials: dict):
             try:
                 logger.info("Directly accessing reception hours detail page...")
                 await page.goto('https://jra.jp/dento/member/hatsubaijikan.html')
-                await page.wait_for_timeout(5000)
-                await take_screenshot(page, "hatsubaijikan_direct")
+                # 受付時間の表が描画されるまで待機（固定5秒待機の代わり）
+                try:
+                    await page.wait_for_selector('table', timeout=5000)
+                except TimeoutError:
+                    logger.debug("Reception hours table not found, continuing...")
+                await take_milestone_screenshot(page, "hatsubaijikan_direct")
                 
                 hours_text = await page.text_content('body')
                 if hours_text:
                     logger.info(f"Direct access - hatsubaijikan.html content (first 3000 chars): {hours_text[:3000]}")
                     
                     # 詳細な時間パターンを探す
-                    import re
-                    detailed_patterns = [
-                        (r'金曜.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'Friday detailed hours'),
-                        (r'平日.*?(\d{1,2}[:：]\d{2}).*?(\d{1,2}[:：]\d{2})', 'Weekday detailed hours'),
-                        (r'(\d{1,2}[:：]\d{2})\s*～\s*(\d{1,2}[:：]\d{2})', 'Time ranges'),
-                        (r'開始.*?(\d{1,2}[:：]\d{2})', 'Start times'),
-                        (r'終了.*?(\d{1,2}[:：]\d{2})', 'End times'),
-                        (r'発売.*?(\d{1,2}[:：]\d{2})', 'Sales times'),
-                    ]
-                    
-                    for pattern, desc in detailed_patterns:
-                        matches = re.findall(pattern, hours_text)
+                    found = findall_each(HATSUBAI_DETAIL_REGEX, [p for p, _ in HATSUBAI_DETAIL_PATTERNS], hours_text)
+                    for (_, desc), matches in zip(HATSUBAI_DETAIL_PATTERNS, found):
                         if matches:
                             logger.info(f"Found {desc}: {matches}")
                 
@@ -765,18 +1304,16 @@ async def login_ipat_v2(page: Page, credentials: dict):
         if not inet_field:
             logger.warning("INET field not found, checking if already on login page or need to navigate")
             # ログインリンクを探してクリック
-            login_links = await page.query_selector_all('a')
-            login_found = False
-            for link in login_links:
-                href = await link.get_attribute('href') or ''
-                text = await link.text_content() or ''
-                if 'ログイン' in text or 'LOGIN' in text.upper() or '投票' in text:
-                    logger.info(f"Clicking login link: {text.strip()}")
-                    await link.click()
-                    await page.wait_for_timeout(3000)
-                    inet_field, password_field = await find_login_fields(page)
-                    login_found = True
-                    break
+            login_link = page.locator('a').filter(has_text=re.compile(r'ログイン|LOGIN|投票', re.IGNORECASE)).first
+            login_found = await login_link.count() > 0
+            if login_found:
+                logger.info(f"Clicking login link: {(await login_link.text_content() or '').strip()}")
+                await login_link.click()
+                try:
+                    await page.wait_for_load_state('domcontentloaded', timeout=3000)
+                except TimeoutError:
+                    pass
+                inet_field, password_field = await find_login_fields(page)
             
             if not login_found:
                 logger.warning("No login link found on central JRA IPAT page")
@@ -799,22 +1336,21 @@ async def login_ipat_v2(page: Page, credentials: dict):
         # まず、「ログイン」ボタンを直接探す
         logger.info("Looking for Login button...")
         
-        # まず、すべてのクリック可能な要素をデバッグ
+        # まず、すべてのクリック可能な要素をデバッグ（DEBUG時のみ）
         all_clickable_selectors = ['button', 'input[type="button"]', 'input[type="submit"]', 'input[type="image"]', 'a', 'img', 'div[class*="button"]', 'span[class*="button"]']
-        for selector in all_clickable_selectors:
-            elements = await page.query_selector_all(selector)
-            if elements:
-                logger.info(f"Found {len(elements)} {selector} elements")
-                for i, elem in enumerate(elements[:5]):  # 最初の5つまで
-                    text = await elem.text_content() or ''
-                    value = await elem.get_attribute('value') or ''
-                    alt = await elem.get_attribute('alt') or ''
-                    src = await elem.get_attribute('src') or ''
-                    class_attr = await elem.get_attribute('class') or ''
-                    if text.strip() or value or alt:
-                        logger.info(f"{selector}[{i}]: text='{text.strip()}', value='{value}', alt='{alt}', class='{class_attr}'")
-                    if src:
-                        logger.info(f"{selector}[{i}]: src='{src}'")
+        if logger.isEnabledFor(logging.DEBUG):
+            for group in await describe_elements(page, all_clickable_selectors, limit=5):  # 最初の5つまで
+                selector = group['selector']
+                if group['count']:
+                    logger.debug(f"Found {group['count']} {selector} elements")
+                    for i, elem in enumerate(group['items']):
+                        text, value, alt, src, class_attr = (
+                            elem['text'], elem['value'], elem['alt'], elem['src'], elem['class']
+                        )
+                        if text.strip() or value or alt:
+                            logger.debug(f"{selector}[{i}]: text='{text.strip()}', value='{value}', alt='{alt}', class='{class_attr}'")
+                        if src:
+                            logger.debug(f"{selector}[{i}]: src='{src}'")
         
         # ボタンを探すセレクター
         button_selectors = [
@@ -835,29 +1371,27 @@ async def login_ipat_v2(page: Page, credentials: dict):
             'a'  # すべてのリンク
         ]
         
-        for selector in button_selectors:
+        next_clicked = await click_login_button(page)
+        for selector in ([] if next_clicked else button_selectors):
             try:
                 if 'has-text' in selector:
                     # has-textセレクタの特別処理
                     base_selector = selector.split(':')[0]
                     text_to_find = selector.split('"')[1]
-                    elements = await page.query_selector_all(base_selector)
-                    for element in elements:
-                        elem_text = await element.text_content() or ''
+                    for i, attrs in enumerate(await all_element_attrs(page, base_selector)):
+                        elem_text = attrs['text']
                         if text_to_find in elem_text:
                             logger.info(f"Found login button with text: {elem_text.strip()}")
-                            await element.click()
+                            await page.locator(base_selector).nth(i).click()
                             next_clicked = True
                             break
                 else:
-                    elements = await page.query_selector_all(selector)
-                    for element in elements:
-                        text = await element.text_content() or ''
-                        value = await element.get_attribute('value') or ''
-                        class_attr = await element.get_attribute('class') or ''
+                    for i, attrs in enumerate(await all_element_attrs(page, selector)):
+                        element = page.locator(selector).nth(i)
+                        text, value, class_attr = attrs['text'], attrs['value'], attrs['class']
                         
                         # ログインボタンの可能性をチェック
-                        if 'ログイン' in text or 'ログイン' in value or 'LOGIN' in text.upper() or 'LOGIN' in value.upper():
+                        if LOGIN_TEXT_PATTERN.search(text) or LOGIN_TEXT_PATTERN.search(value):
                             logger.info(f"Clicking login button: text='{text.strip()}', value='{value}'")
                             await element.click()
                             next_clicked = True
@@ -876,7 +1410,7 @@ async def login_ipat_v2(page: Page, credentials: dict):
                             except:
                                 pass
                         # onclick属性を持つ要素もチェック
-                        onclick = await element.get_attribute('onclick') or ''
+                        onclick = attrs['onclick']
                         if onclick:
                             logger.info(f"Found element with onclick: {onclick}")
                             await element.click()
@@ -896,9 +1430,9 @@ async def login_ipat_v2(page: Page, credentials: dict):
             form_submitted = False
             try:
                 # フォーム要素を探す
-                forms = await page.query_selector_all('form')
-                if forms:
-                    logger.info(f"Found {len(forms)} form(s) on page")
+                form_count = await page.locator('form').count()
+                if form_count:
+                    logger.info(f"Found {form_count} form(s) on page")
                     # 最初のフォームを送信
                     await page.evaluate('document.forms[0].submit()')
                     form_submitted = True
@@ -924,15 +1458,20 @@ async def login_ipat_v2(page: Page, credentials: dict):
                         'window.location.href = window.location.href.replace("pw01", "pw02")',
                     ]
                     
-                    for js_func in js_functions:
+                    # 前回フォームを送信できた関数があれば最初に試す
+                    for js_func in prefer_cached_selector(current_url, 'stage1_submit_js', js_functions):
                         try:
                             logger.info(f"Trying JavaScript function: {js_func}")
                             await page.evaluate(js_func)
-                            await page.wait_for_timeout(1000)
+                            try:
+                                await page.wait_for_url(lambda url: url != current_url, wait_until="commit", timeout=1000)
+                            except TimeoutError:
+                                pass
                             # ページが変わったかチェック
                             new_url = page.url
                             if new_url != current_url:
                                 logger.info(f"Page changed after {js_func}, form likely submitted")
+                                remember_selector(current_url, 'stage1_submit_js', js_func)
                                 form_submitted = True
                                 break
                         except Exception as js_error:
@@ -940,7 +1479,10 @@ async def login_ipat_v2(page: Page, credentials: dict):
                             continue
                 
                 if form_submitted:
-                    await page.wait_for_timeout(3000)
+                    try:
+                        await page.wait_for_load_state('domcontentloaded', timeout=3000)
+                    except TimeoutError:
+                        pass
                     next_clicked = True
                 
             except Exception as e:
@@ -950,7 +1492,13 @@ async def login_ipat_v2(page: Page, credentials: dict):
             if not next_clicked:
                 logger.info("JavaScript submission failed, trying Enter key...")
                 await page.keyboard.press('Enter')
-                await page.wait_for_timeout(2000)
+                try:
+                    await page.wait_for_url(
+                        lambda url: 'pw02' in url or 'login' in url or 'auth' in url,
+                        wait_until="commit", timeout=5000
+                    )
+                except TimeoutError:
+                    pass
                 
                 # ページ遷移を確認
                 current_url = page.url
@@ -970,15 +1518,12 @@ async def login_ipat_v2(page: Page, credentials: dict):
         
         # 複数の待機方法を試す
         try:
-            # 方法1: URLの変化を待つ（最大20秒）
-            for i in range(20):
-                await page.wait_for_timeout(1000)
-                current_url = page.url
-                if current_url != initial_url:
-                    logger.info(f"URL changed to: {current_url}")
-                    break
-                if i % 5 == 0:
-                    logger.info(f"Still waiting for URL change... ({i+1} seconds)")
+            # 方法1: URLの変化を待つ（最大20秒、1秒ごとのポーリングではなくイベントで検知）
+            try:
+                await page.wait_for_url(lambda url: url != initial_url, wait_until="commit", timeout=20000)
+                logger.info(f"URL changed to: {page.url}")
+            except TimeoutError:
+                logger.info("URL did not change within 20 seconds, continuing...")
             
             # 方法2: ネットワークが安定するまで待つ
             try:
@@ -997,15 +1542,15 @@ async def login_ipat_v2(page: Page, credentials: dict):
         except Exception as e:
             logger.warning(f"Transition wait error: {e}")
         
-        # 追加の安全待機
-        await page.wait_for_timeout(3000)
-        
         # === 第2段階: 3つの認証情報入力 ===
         logger.info("Stage 2: Entering authentication details...")
         
-        # 追加の待機とスクリーンショット
-        await page.wait_for_timeout(3000)
-        await take_screenshot(page, "stage2_page")
+        # 第2段階の入力欄が現れるまで待機（固定の安全待機の代わり）
+        try:
+            await page.wait_for_selector('input[type="password"]', timeout=TIMEOUT_MS)
+        except TimeoutError:
+            logger.info("Stage 2 password field did not appear in time, continuing...")
+        await take_milestone_screenshot(page, "stage2_page")
         
         # URLとタイトルをチェック
         current_url = page.url
@@ -1043,18 +1588,16 @@ async def login_ipat_v2(page: Page, credentials: dict):
         logger.info(f"Number of frames on page: {len(frames)}")
         if len(frames) > 1:
             logger.info("Multiple frames detected, checking each frame...")
+            # メインフレーム以外の入力欄の数はまとめて並行に数える
+            input_counts = await asyncio.gather(
+                *(frame.locator('input').count() for frame in frames[1:]), return_exceptions=True
+            )
             for i, frame in enumerate(frames):
-                try:
-                    frame_url = frame.url
-                    logger.info(f"Frame {i}: {frame_url}")
-                    # メインフレーム以外もチェック
-                    if i > 0:
-                        frame_inputs = await frame.query_selector_all('input')
-                        logger.info(f"Frame {i} has {len(frame_inputs)} input elements")
-                except:
-                    pass
+                logger.info(f"Frame {i}: {frame.url}")
+                if i > 0 and not isinstance(input_counts[i - 1], Exception):
+                    logger.info(f"Frame {i} has {input_counts[i - 1]} input elements")
         
-        # 加入者番号フィールドを動的に検出
+        # 加入者番号・暗証番号・P-ARS番号のフィールドを動的に検出
         user_id_selectors = [
             'input[name="i"]',
             'input[name="user_id"]',
@@ -1063,26 +1606,6 @@ async def login_ipat_v2(page: Page, credentials: dict):
             'input[placeholder*="加入者"]',
             'input[placeholder*="ユーザー"]'
         ]
-        
-        user_id_filled = False
-        for selector in user_id_selectors:
-            if await wait_and_fill(page, selector, credentials['user_id'], timeout=5000):
-                logger.info(f"Filled user ID with selector: {selector}")
-                user_id_filled = True
-                break
-        
-        if not user_id_filled:
-            # フォールバック: 最初のtextフィールドを使用
-            text_inputs = await page.query_selector_all('input[type="text"], input:not([type])')
-            if text_inputs and len(text_inputs) > 0:
-                await text_inputs[0].fill(credentials['user_id'])
-                logger.info("Filled user ID in first text input as fallback")
-                user_id_filled = True
-        
-        if not user_id_filled:
-            raise Exception("Failed to fill user ID")
-        
-        # 暗証番号フィールドを動的に検出
         password_selectors = [
             'input[name="p"]',
             'input[name="password"]',
@@ -1091,47 +1614,47 @@ async def login_ipat_v2(page: Page, credentials: dict):
             'input[placeholder*="暗証"]',
             'input[placeholder*="パスワード"]'
         ]
+        pars_selectors = [
+            'input[name="r"]',
+            'input[name="pars"]',
+            'input[name="PARS"]',
+            'input[placeholder*="P-ARS"]',
+            'input[placeholder*="pars"]'
+        ]
         
-        password_filled = False
-        for selector in password_selectors:
-            if await wait_and_fill(page, selector, credentials['password'], timeout=5000):
-                logger.info(f"Filled password with selector: {selector}")
-                password_filled = True
-                break
+        # fill はフォーカスした要素に入力するため、並行に入力すると別の欄に入りうるので1つずつ入力する
+        user_id_filled = await fill_first_match(page, 'user_id', user_id_selectors, credentials['user_id'])
+        password_filled = await fill_first_match(page, 'password', password_selectors, credentials['password'])
+        pars_filled = await fill_first_match(page, 'pars', pars_selectors, credentials.get('pars'))
+        
+        if not user_id_filled:
+            # フォールバック: 最初のtextフィールドを使用
+            text_inputs = page.locator('input[type="text"], input:not([type])')
+            if await text_inputs.count() > 0:
+                await text_inputs.first.fill(credentials['user_id'])
+                logger.info("Filled user ID in first text input as fallback")
+                user_id_filled = True
+        
+        if not user_id_filled:
+            raise Exception("Failed to fill user ID")
         
         if not password_filled:
             # フォールバック: 最初のpasswordフィールドを使用
-            password_inputs = await page.query_selector_all('input[type="password"]')
-            if password_inputs and len(password_inputs) > 0:
-                await password_inputs[0].fill(credentials['password'])
+            password_inputs = page.locator('input[type="password"]')
+            if await password_inputs.count() > 0:
+                await password_inputs.first.fill(credentials['password'])
                 logger.info("Filled password in first password input as fallback")
                 password_filled = True
         
         if not password_filled:
             raise Exception("Failed to fill password")
         
-        # P-ARS番号フィールドを動的に検出
         if credentials.get('pars'):
-            pars_selectors = [
-                'input[name="r"]',
-                'input[name="pars"]',
-                'input[name="PARS"]',
-                'input[placeholder*="P-ARS"]',
-                'input[placeholder*="pars"]'
-            ]
-            
-            pars_filled = False
-            for selector in pars_selectors:
-                if await wait_and_fill(page, selector, credentials['pars'], timeout=5000):
-                    logger.info(f"Filled P-ARS with selector: {selector}")
-                    pars_filled = True
-                    break
-            
             if not pars_filled:
                 # フォールバック: 3番目のtextフィールドを使用
-                text_inputs = await page.query_selector_all('input[type="text"], input:not([type])')
-                if text_inputs and len(text_inputs) > 2:
-                    await text_inputs[2].fill(credentials['pars'])
+                text_inputs = page.locator('input[type="text"], input:not([type])')
+                if await text_inputs.count() > 2:
+                    await text_inputs.nth(2).fill(credentials['pars'])
                     logger.info("Filled P-ARS in third text input as fallback")
                     pars_filled = True
             
@@ -1141,32 +1664,36 @@ async def login_ipat_v2(page: Page, credentials: dict):
         # ログインボタンクリック（動的に検出）
         login_clicked = False
         
-        # まず、すべてのクリック可能な要素をデバッグ（第2段階用）
+        # まず、すべてのクリック可能な要素をデバッグ（第2段階用・DEBUG時のみ）
         logger.info("Looking for login button on second stage...")
         debug_selectors = ['button', 'input[type="button"]', 'input[type="submit"]', 'input[type="image"]', 'a', 'img']
-        for selector in debug_selectors:
-            elements = await page.query_selector_all(selector)
-            if elements:
-                logger.info(f"Found {len(elements)} {selector} elements on stage 2")
-                for i, elem in enumerate(elements[:3]):  # 最初の3つ
-                    text = await elem.text_content() or ''
-                    value = await elem.get_attribute('value') or ''
-                    alt = await elem.get_attribute('alt') or ''
-                    onclick = await elem.get_attribute('onclick') or ''
-                    href = await elem.get_attribute('href') or ''
-                    if text.strip() or value or alt or onclick:
-                        logger.info(f"{selector}[{i}]: text='{text.strip()}', value='{value}', alt='{alt}', onclick='{onclick}'")
+        if logger.isEnabledFor(logging.DEBUG):
+            for group in await describe_elements(page, debug_selectors, limit=3):  # 最初の3つ
+                selector = group['selector']
+                if group['count']:
+                    logger.debug(f"Found {group['count']} {selector} elements on stage 2")
+                    for i, elem in enumerate(group['items']):
+                        text, value, alt, onclick = elem['text'], elem['value'], elem['alt'], elem['onclick']
+                        if text.strip() or value or alt or onclick:
+                            logger.debug(f"{selector}[{i}]: text='{text.strip()}', value='{value}', alt='{alt}', onclick='{onclick}'")
+        
+        login_clicked = await click_login_button(page)
         
         # onclick属性を持つ要素を優先的に探す
-        all_elements = await page.query_selector_all('*')
-        for element in all_elements:
-            onclick = await element.get_attribute('onclick') or ''
-            if onclick and ('send' in onclick.lower() or 'submit' in onclick.lower() or 'login' in onclick.lower() or 
-                          'proc' in onclick.lower() or 'tomodernmenu' in onclick.lower() or 'menu' in onclick.lower()):
+        # （全要素のハンドルを取らず、ページ内で onclick を持つ要素だけを1回で調べる）
+        if not login_clicked:
+            match = await page.evaluate("""() => {
+                const elements = [...document.querySelectorAll('[onclick]')];
+                const index = elements.findIndex(
+                    el => /send|submit|login|proc|tomodernmenu|menu/i.test(el.getAttribute('onclick'))
+                );
+                return index < 0 ? null : [index, elements[index].getAttribute('onclick')];
+            }""")
+            if match:
+                index, onclick = match
                 logger.info(f"Found element with onclick for login: {onclick}")
-                await element.click()
+                await page.locator('[onclick]').nth(index).click()
                 login_clicked = True
-                break
         
         if not login_clicked:
             # 次に通常のボタンを探す
@@ -1181,18 +1708,12 @@ async def login_ipat_v2(page: Page, credentials: dict):
             
             for selector in login_selectors:
                 try:
-                    elements = await page.query_selector_all(selector)
-                    for element in elements:
-                        text = await element.text_content() or ''
-                        value = await element.get_attribute('value') or ''
-                        alt = await element.get_attribute('alt') or ''
-                        if ('ログイン' in text or 'LOGIN' in text.upper() or 
-                            'ログイン' in value or 'LOGIN' in value.upper() or
-                            'ログイン' in alt or 
-                            '送信' in text or 'submit' in text.lower() or
-                            '次へ' in text or 'next' in text.lower()):
+                    for i, attrs in enumerate(await all_element_attrs(page, selector)):
+                        text, value, alt = attrs['text'], attrs['value'], attrs['alt']
+                        if (LOGIN_SUBMIT_TEXT_PATTERN.search(text) or LOGIN_TEXT_PATTERN.search(value) or
+                            'ログイン' in alt):
                             logger.info(f"Clicking login button: text='{text.strip()}', value='{value}', alt='{alt}'")
-                            await element.click()
+                            await page.locator(selector).nth(i).click()
                             login_clicked = True
                             break
                     if login_clicked:
@@ -1201,111 +1722,69 @@ async def login_ipat_v2(page: Page, credentials: dict):
                     continue
         
         if not login_clicked:
-            raise Exception("Failed to find login button on second stage")
-        
-        # === お知らせ確認画面の処理 ===
-        await page.wait_for_timeout(4000)
-        await take_screenshot(page, "after_login_attempt")
-        
-        # 確認画面をチェック
-        page_text = await page.text_content('body')
-        if page_text and 'P-ARS' in page_text:
-            logger.info("Login confirmation page detected, looking for OK button...")
-        
-        try:
-            # OKボタンを様々な方法で探す
-            ok_selectors = [
-                'button:has-text("OK")',
-                'button:has-text("O K")',  # スペース付きOK
-                'button:has-text("確認")',
-                'button:has-text("次へ")',
-                'input[type="button"][value*="OK"]',
-                'input[type="button"][value*="O K"]',
-                'input[type="submit"][value*="OK"]',
-                'input[type="submit"][value*="O K"]',
-                'a:has-text("OK")',
-                'a:has-text("O K")',
-                'button',  # 全てのbuttonをチェック
-                'input[type="button"]',
-                'input[type="submit"]'
-            ]
-            
-            ok_clicked = False
-            for selector in ok_selectors:
-                try:
-                    if 'has-text' in selector:
-                        # has-textセレクタの特別処理
-                        base_selector = selector.split(':')[0]
-                        text_to_find = selector.split('"')[1]
-                        elements = await page.query_selector_all(base_selector)
-                        for button in elements:
-                            text = await button.text_content() or ''
-                            if text_to_find in text:
-                                logger.info(f"Found OK button with text: {text.strip()}")
-                                # クリック前に要素の状態を確認
-                                is_visible = await button.is_visible()
-                                is_enabled = await button.is_enabled()
-                                logger.info(f"Button state - visible: {is_visible}, enabled: {is_enabled}")
-                                
-                                if is_visible and is_enabled:
-                                    # 複数のクリック方法を試す
-                                    try:
-                                        await button.click(force=True)  # 強制クリック
-                                    except:
-                                        # JavaScriptでクリック
-                                        await page.evaluate('(element) => element.click()', button)
-                                    ok_clicked = True
-                                    break
-                    else:
-                        elements = await page.query_selector_all(selector)
-                        for button in elements:
-                            text = await button.text_content() or ''
-                            value = await button.get_attribute('value') or ''
-                            # OK（スペース付きも含む）、確認、次へをチェック
-                            if ('OK' in text.upper() or 'O K' in text.upper() or 
-                                'OK' in value.upper() or 'O K' in value.upper() or
-                                '確認' in text or '次へ' in text or '進む' in text):
-                                logger.info(f"Found and clicking OK/confirmation button: text='{text.strip()}', value='{value.strip()}'")
-                                
-                                # クリック前に要素の状態を確認
-                                is_visible = await button.is_visible()
-                                is_enabled = await button.is_enabled()
-                                logger.info(f"Button state - visible: {is_visible}, enabled: {is_enabled}")
-                                
-                                if is_visible and is_enabled:
-                                    # 複数のクリック方法を試す
-                                    try:
-                                        await button.click(force=True)  # 強制クリック
-                                    except:
-                                        # JavaScriptでクリック
-                                        await page.evaluate('(element) => element.click()', button)
-                                    ok_clicked = True
-                                    break
-                    if ok_clicked:
-                        break
-                except Exception as e:
-                    logger.debug(f"Error checking selector {selector}: {e}")
-                    continue
+            raise Exception("Failed to find login button on second stage")
+        
+        # お知らせ・メニュー画面は表示状態で判定するのでCSSを戻す
+        await unblock_stylesheets(page)
+        
+        # === お知らせ確認画面の処理 ===
+        # OKダイアログか次の画面のどちらかが表示されるまで待機
+        await wait_for_any(page, [
+            'button:has-text("OK")',
+            'input[type="button"][value*="OK"]',
+            'input[type="submit"][value*="OK"]',
+            *MENU_READY_SELECTORS
+        ], timeout=TIMEOUT_MS)
+        await take_milestone_screenshot(page, "after_login_attempt")
+        
+        # 確認画面をチェック
+        page_text = await page.text_content('body')
+        if page_text and 'P-ARS' in page_text:
+            logger.info("Login confirmation page detected, looking for OK button...")
+        
+        ok_clicked = False
+        try:
+            # OKボタンを探す（ボタンはアクセシブル名で、リンク等は表示テキストで、それぞれ1回のロケータ）
+            ok_clicked = await click_first_match(
+                page.get_by_role("button", name=OK_TEXT_PATTERN), timeout=2000
+            )
+            if ok_clicked:
+                logger.info("Found and clicked OK button via role locator")
+            else:
+                ok_button = page.locator('button, input[type="button"], input[type="submit"], a').filter(
+                    has_text=OK_TEXT_PATTERN
+                ).first
+                if await ok_button.count():
+                    logger.info(f"Found and clicking OK/confirmation element: {(await ok_button.text_content() or '').strip()}")
+                    try:
+                        await ok_button.click(force=True)  # 強制クリック
+                    except Exception:
+                        # JavaScriptでクリック
+                        await ok_button.evaluate('(element) => element.click()')
+                    ok_clicked = True
             
             if ok_clicked:
-                await page.wait_for_timeout(3000)
-                await take_screenshot(page, "after_ok_click")
+                await page.wait_for_load_state("domcontentloaded")
+                await take_milestone_screenshot(page, "after_ok_click")
             else:
                 logger.warning("Could not find OK button on confirmation page")
         except Exception as e:
             logger.debug(f"Error processing confirmation page: {e}")
         
-        # ログイン成功の確認
-        await page.wait_for_timeout(3000)
+        # ログイン成功の確認（常時通信のあるページでは networkidle にならないので、メニューの表示を待つ）
+        await page.wait_for_load_state("domcontentloaded")
+        if await wait_for_any(page, MENU_READY_SELECTORS, timeout=10000) is None:
+            logger.info("Vote menu did not appear after login, checking page content...")
         final_title = await page.title()
         current_url = page.url
         logger.info(f"Login completed. Final page title: {final_title}")
         logger.info(f"Current URL: {current_url}")
         
-        await take_screenshot(page, "login_final_result")
+        await take_milestone_screenshot(page, "login_final_result")
         
-        # ページ内容をデバッグ
-        page_text = await page.text_content('body')
+        # ページ内容をデバッグ（OKで画面が変わっていなければ確認画面で取得した本文を使い回す）
+        if ok_clicked or not page_text:
+            page_text = await page.text_content('body')
         if page_text:
             logger.info(f"Page content after login (first 500 chars): {page_text[:500]}")
         
@@ -1313,49 +1792,49 @@ async def login_ipat_v2(page: Page, credentials: dict):
         if '加入者情報' in (page_text or '') or '次回から暗証番号' in (page_text or '') or 'P-ARS' in (page_text or ''):
             logger.info("Still on login/confirmation page, looking for menu navigation...")
             
-            # まず、すべてのクリック可能要素をデバッグ
+            # まず、すべてのクリック可能要素をデバッグ（DEBUG時のみ）
             clickable_selectors = ['a', 'img', 'button', 'input[type="button"]', 'input[type="submit"]', 'input[type="image"]']
-            for selector in clickable_selectors:
-                elements = await page.query_selector_all(selector)
-                if elements:
-                    logger.debug(f"Found {len(elements)} {selector} elements on page")
-                    for i, elem in enumerate(elements[:5]):
-                        text = await elem.text_content() or ''
-                        alt = await elem.get_attribute('alt') or ''
-                        href = await elem.get_attribute('href') or ''
-                        onclick = await elem.get_attribute('onclick') or ''
-                        if text.strip() or alt:
-                            logger.debug(f"{selector}[{i}]: text='{text.strip()}', alt='{alt}', href='{href[:50] if href else ''}', onclick='{onclick[:50] if onclick else ''}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                for group in await describe_elements(page, clickable_selectors, limit=5):
+                    selector = group['selector']
+                    if group['count']:
+                        logger.debug(f"Found {group['count']} {selector} elements on page")
+                        for i, elem in enumerate(group['items']):
+                            text, alt, href, onclick = elem['text'], elem['alt'], elem['href'], elem['onclick']
+                            if text.strip() or alt:
+                                logger.debug(f"{selector}[{i}]: text='{text.strip()}', alt='{alt}', href='{href[:50]}', onclick='{onclick[:50]}'")
             
-            # メニューへのリンクを探す
-            menu_found = False
-            for selector in clickable_selectors:
-                elements = await page.query_selector_all(selector)
-                for link in elements:
-                    text = await link.text_content() or ''
-                    alt = await link.get_attribute('alt') or ''
-                    href = await link.get_attribute('href') or ''
-                    onclick = await link.get_attribute('onclick') or ''
-                    
-                    # メニュー関連のキーワードをチェック
-                    menu_keywords = ['メニュー', 'menu', 'メイン', 'main', 'トップ', 'top', '投票', '購入']
-                    if any(keyword in combined.lower() for combined in [text, alt, onclick] for keyword in menu_keywords):
-                        logger.info(f"Found menu element: text='{text.strip()}', alt='{alt}', onclick='{onclick[:50] if onclick else ''}'")
-                        await link.click()
-                        menu_found = True
-                        await page.wait_for_timeout(3000)
-                        break
-                    
-                    # 特定のURLパターンをチェック
-                    if href and any(pattern in href for pattern in ['menu', 'main', 'top', 'home']):
-                        logger.info(f"Found menu link by URL: {href}")
-                        await link.click()
-                        menu_found = True
-                        await page.wait_for_timeout(3000)
-                        break
-                
-                if menu_found:
-                    break
+            # メニューへのリンクを探す（判定はページ内で1回にまとめ、クリックだけロケータで行う）
+            menu_keywords = ['メニュー', 'menu', 'メイン', 'main', 'トップ', 'top', '投票', '購入']
+            menu_url_patterns = ['menu', 'main', 'top', 'home']
+            match = await page.evaluate("""([selectors, keywords, urlPatterns]) => {
+                for (const selector of selectors) {
+                    const elements = [...document.querySelectorAll(selector)];
+                    for (let index = 0; index < elements.length; index++) {
+                        const el = elements[index];
+                        const text = el.textContent || '';
+                        const alt = el.getAttribute('alt') || '';
+                        const href = el.getAttribute('href') || '';
+                        const onclick = el.getAttribute('onclick') || '';
+                        if ([text, alt, onclick].some(s => keywords.some(k => s.toLowerCase().includes(k)))) {
+                            return {selector, index, reason: 'keyword', text: text.trim(), alt, href, onclick};
+                        }
+                        if (href && urlPatterns.some(p => href.includes(p))) {
+                            return {selector, index, reason: 'url', text: text.trim(), alt, href, onclick};
+                        }
+                    }
+                }
+                return null;
+            }""", [clickable_selectors, menu_keywords, menu_url_patterns])
+            
+            menu_found = match is not None
+            if menu_found:
+                if match['reason'] == 'keyword':
+                    logger.info(f"Found menu element: text='{match['text']}', alt='{match['alt']}', onclick='{match['onclick'][:50]}'")
+                else:
+                    logger.info(f"Found menu link by URL: {match['href']}")
+                await page.locator(match['selector']).nth(match['index']).click()
+                await wait_for_any(page, MENU_READY_SELECTORS, timeout=3000)
             
             if not menu_found:
                 logger.warning("Could not find menu navigation link")
@@ -1369,20 +1848,48 @@ async def login_ipat_v2(page: Page, credentials: dict):
         else:
             logger.warning(f"Login may have failed. Page title: {final_title}")
             # エラーメッセージをチェック
-            error_elements = await page.query_selector_all('.error, .alert, .warning, [class*="error"], [class*="alert"]')
-            for elem in error_elements:
-                error_text = await elem.text_content() or ''
+            error_texts = await page.locator('.error, .alert, .warning, [class*="error"], [class*="alert"]').all_text_contents()
+            for error_text in error_texts:
                 if error_text.strip():
                     logger.error(f"Found error message: {error_text.strip()}")
         
     except TimeoutError:
         logger.error("Login timeout - check credentials or network connection")
-        await take_screenshot(page, "login_timeout_v2")
+        await take_screenshot(page, "login_timeout_v2", fmt='jpeg')
         raise
     except Exception as e:
         logger.error(f"Login failed: {e}")
-        await take_screenshot(page, "login_error_v2")
+        await take_screenshot(page, "login_error_v2", fmt='jpeg')
         raise
+    finally:
+        await unblock_stylesheets(page)
+
+
+async def resume_ipat_session(page: Page) -> bool:
+    """保存済みセッションのままメニュー画面を開けるか確認（開けなければ通常ログインする）"""
+    try:
+        await page.goto(IPAT_HOME_URL, wait_until="domcontentloaded", timeout=TIMEOUT_MS)
+    except Exception as e:
+        logger.info(f"Saved session could not open the menu: {e}")
+        return False
+    # ログイン画面に戻された場合はメニューの待機を打ち切って通常ログインへ
+    matched = await wait_for_any(page, MENU_READY_SELECTORS + ['input[name="inetid"]'], timeout=5000)
+    return matched in MENU_READY_SELECTORS
+
+
+async def save_session_state(context):
+    """ログイン済みセッションを SESSION_STATE_PATH へ保存（本人以外は読めない権限で書き込む）"""
+    try:
+        state = await context.storage_state()
+        Path(SESSION_STATE_PATH).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(SESSION_STATE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        # 以前の実行で別の権限で作られたファイルも本人のみに絞る
+        os.chmod(SESSION_STATE_PATH, 0o600)
+        logger.info(f"Saved session state to {SESSION_STATE_PATH}")
+    except Exception as e:
+        logger.warning(f"Failed to save session state: {e}")
 
 
 async def navigate_to_account_info(page: Page):
@@ -1392,18 +1899,14 @@ async def navigate_to_account_info(page: Page):
         
         # 口座情報へのリンクを探す
         selectors = ['a', 'button', 'img', 'input[type="button"]', 'input[type="submit"]']
-        keywords = ['口座', '残高', '照会', '明細', '入金', '出金', 'account', 'balance']
         
         for selector in selectors:
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                href = await element.get_attribute('href') or ''
+            for i, attrs in enumerate(await all_element_attrs(page, selector)):
+                text, alt = attrs['text'], attrs['alt']
                 
-                if any(keyword in combined.lower() for combined in [text, alt] for keyword in keywords):
+                if ACCOUNT_INFO_PATTERN.search(text) or ACCOUNT_INFO_PATTERN.search(alt):
                     logger.info(f"Found account info link: text='{text.strip()}', alt='{alt}'")
-                    await element.click()
+                    await page.locator(selector).nth(i).click()
                     await page.wait_for_timeout(3000)
                     return True
         
@@ -1415,12 +1918,59 @@ async def navigate_to_account_info(page: Page):
         return False
 
 
+class BalanceCache:
+    """1回の実行内での残高キャッシュ（入金時に無効化、購入時に減算）"""
+
+    def __init__(self):
+        self.value: Optional[int] = None
+
+    async def get(self, page: Page) -> int:
+        """キャッシュが無ければページから取得"""
+        if self.value is None:
+            self.value = await get_balance(page)
+        return self.value
+
+    def invalidate(self):
+        """次回の取得でページから読み直す"""
+        self.value = None
+
+    def debit(self, amount: int):
+        """購入額をキャッシュから差し引く（残高不明の0はそのまま）"""
+        if self.value:
+            self.value = max(self.value - amount, 0)
+
+
+class TokenBucket:
+    """一定レートを超えた分だけ待機させるトークンバケット（全ワーカーで共有）"""
+
+    def __init__(self, rate_per_sec: float, capacity: int = 1):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """トークンを1つ取得（枯渇している時だけ補充まで待つ）"""
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+
 async def get_balance(page: Page) -> int:
     """残高を取得（動的検出対応）"""
     try:
         logger.info("Getting account balance...")
         await page.wait_for_timeout(4000)
-        await take_screenshot(page, "balance_check")
+        await take_milestone_screenshot(page, "balance_check")
         
         # まず現在のページで残高を探す
         balance = await find_balance_on_page(page)
@@ -1431,7 +1981,7 @@ async def get_balance(page: Page) -> int:
         logger.info("Balance not found on current page, trying to navigate to account info...")
         if await navigate_to_account_info(page):
             await page.wait_for_timeout(3000)
-            await take_screenshot(page, "account_info_page")
+            await take_milestone_screenshot(page, "account_info_page")
             balance = await find_balance_on_page(page)
             if balance is not None:
                 return balance
@@ -1448,51 +1998,31 @@ async def find_balance_on_page(page: Page):
     """現在のページで残高を探す"""
     try:
         
-        # ページの全テキストをデバッグ
-        page_text = await page.text_content('body')
-        if page_text:
-            logger.debug(f"Page text for balance search (first 1000 chars): {page_text[:1000]}")
-        
-        # 様々な要素で残高を探す
-        balance_selectors = [
-            'td',
-            'span',
-            'div',
-            'p',
-            'strong',
-            'b',
-            '.balance',
-            '.amount',
-            '[class*="balance"]',
-            '[class*="amount"]',
-            '[class*="money"]',
-            '[class*="zandaka"]',  # 残高
-            '[class*="kingaku"]'   # 金額
-        ]
+        # ページの全テキストを1回だけ取得して、残高キーワードの直後の金額を探す
+        page_text = await page.inner_text('body')
+        logger.debug(f"Page text for balance search (first 1000 chars): {page_text[:1000]}")
         
-        # 残高を表すキーワード
-        balance_keywords = ['残高', '現在高', '口座残高', '利用可能金額']
-        
-        for selector in balance_selectors:
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                # 数字と円を含むテキストを探す
-                if text and "円" in text and any(c.isdigit() for c in text):
-                    # 残高キーワードを含むかチェック
-                    if any(keyword in text for keyword in balance_keywords):
-                        logger.info(f"Found balance text with keyword: {text.strip()[:100]}")
-                    try:
-                        # 数字を抽出
-                        import re
-                        numbers = re.findall(r'[0-9,]+', text.replace("円", ""))
-                        if numbers:
-                            balance = int(numbers[-1].replace(",", ""))  # 最後の数字を使用
-                            if balance >= 0:  # 0以上の値を有効に
-                                logger.info(f"Current balance: {balance} yen (found in: '{text.strip()[:50]}')")
-                                return balance
-                    except (ValueError, IndexError):
-                        continue
+        match = BALANCE_TEXT_PATTERN.search(page_text)
+        if match:
+            balance = int(match.group(1).replace(",", ""))
+            logger.info(f"Current balance: {balance} yen (found in: '{match.group(0)[:50]}')")
+            return balance
+        
+        # キーワードが無い場合は金額を含む最初のtd、次に残高用クラスの要素をそれぞれ1回の呼び出しで取得
+        amount_text = re.compile(r"\d[\d,]*\s*円")
+        for selector in ('td', BALANCE_CLASS_SELECTOR):
+            balance_element = page.locator(selector, has_text=amount_text).first
+            if await balance_element.count() == 0:
+                continue
+            text = await balance_element.inner_text()
+            numbers = AMOUNT_NUMBER_PATTERN.findall(text.replace("円", ""))
+            if numbers:
+                try:
+                    balance = int(numbers[-1].replace(",", ""))  # 最後の数字を使用
+                    logger.info(f"Current balance: {balance} yen (found in: '{text.strip()[:50]}')")
+                    return balance
+                except ValueError:
+                    pass
         
         # メニューページにいるか確認
         current_url = page.url
@@ -1511,10 +2041,10 @@ async def navigate_to_vote(page: Page):
     try:
         logger.info("Navigating to vote page...")
         
-        # ページ内容をデバッグ
-        page_text = await page.text_content('body')
-        if page_text:
-            logger.debug(f"Current page content (first 500 chars): {page_text[:500]}")
+        # ページ内容をデバッグ（本文全体の転送が重いのでDEBUG時のみ取得）
+        if logger.isEnabledFor(logging.DEBUG):
+            page_text = await page.text_content('body')
+            logger.debug(f"Current page content (first 500 chars): {(page_text or '')[:500]}")
         
         # まずメインメニューにいるか確認
         current_url = page.url
@@ -1525,82 +2055,84 @@ async def navigate_to_vote(page: Page):
         vote_found = False
         selectors = ['button', 'a', 'img', 'input[type="button"]', 'input[type="submit"]', 'area', 'div[onclick]']
         
-        # 投票関連のキーワードを拡充
-        vote_keywords = ['通常投票', '投票', '馬券', '購入', 'BET', '単勝', '複勝', 'ワイド', '馬連', '馬単', '三連単', '三連複']
+        # まずブラウザ側のマッチングで探す（通常投票を優先）
+        for pattern in [NORMAL_VOTE_PATTERN, VOTE_KEYWORD_PATTERN]:
+            if await click_first_match(button_or_link(page, pattern)):
+                logger.info(f"Found vote element via role locator: {pattern.pattern}")
+                await page.wait_for_load_state("domcontentloaded")
+                vote_found = True
+                break
         
-        for selector in selectors:
-            elements = await page.query_selector_all(selector)
-            logger.debug(f"Checking {len(elements)} {selector} elements for vote navigation")
-            
-            for i, element in enumerate(elements):
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                value = await element.get_attribute('value') or ''
-                onclick = await element.get_attribute('onclick') or ''
-                href = await element.get_attribute('href') or ''
-                
-                # 投票関連のキーワードをチェック
-                if any(keyword in combined for combined in [text, alt, value] for keyword in vote_keywords):
-                    logger.info(f"Found vote element ({selector}[{i}]): text='{text.strip()}', alt='{alt}', value='{value}'")
-                    try:
-                        is_visible = await element.is_visible()
-                        is_enabled = await element.is_enabled()
-                        if is_visible and is_enabled:
-                            await element.click()
-                            await page.wait_for_timeout(4000)
-                            vote_found = True
-                            break
-                        else:
-                            logger.debug(f"Element not clickable - visible: {is_visible}, enabled: {is_enabled}")
-                    except Exception as click_error:
-                        logger.debug(f"Failed to click element: {click_error}")
-                        continue
-                
-                # onclick属性もチェック
-                if onclick and any(keyword in onclick.lower() for keyword in ['vote', 'bet', 'touhyou', 'keiba']):
-                    logger.info(f"Found vote element with onclick: {onclick[:100]}")
-                    try:
-                        await element.click()
-                        await page.wait_for_timeout(4000)
-                        vote_found = True
-                        break
-                    except Exception as click_error:
-                        logger.debug(f"Failed to click onclick element: {click_error}")
-                        continue
-                
-                # hrefでURLパターンをチェック
-                if href and any(pattern in href.lower() for pattern in ['vote', 'bet', 'touhyou', 'uma']):
-                    logger.info(f"Found vote link by URL: {href}")
-                    try:
-                        await element.click()
-                        await page.wait_for_timeout(4000)
-                        vote_found = True
-                        break
-                    except Exception as click_error:
-                        logger.debug(f"Failed to click href element: {click_error}")
+        # 見つからなければ候補の判定をページ内で1回にまとめ、クリックだけロケータで行う
+        candidates = [] if vote_found else await page.evaluate("""([selectors, keywordSource]) => {
+            const keyword = new RegExp(keywordSource);
+            const candidates = [];
+            for (const selector of selectors) {
+                document.querySelectorAll(selector).forEach((el, index) => {
+                    const text = (el.textContent || '').trim();
+                    const alt = el.getAttribute('alt') || '';
+                    const value = el.getAttribute('value') || '';
+                    const onclick = el.getAttribute('onclick') || '';
+                    const href = el.getAttribute('href') || '';
+                    const info = {selector, index, text, alt, value, onclick, href};
+                    // 投票関連のキーワード → onclick → href の順にチェック
+                    if ([text, alt, value].some(s => keyword.test(s))) {
+                        candidates.push({...info, reason: 'keyword'});
+                    }
+                    if (['vote', 'bet', 'touhyou', 'keiba'].some(k => onclick.toLowerCase().includes(k))) {
+                        candidates.push({...info, reason: 'onclick'});
+                    }
+                    if (['vote', 'bet', 'touhyou', 'uma'].some(k => href.toLowerCase().includes(k))) {
+                        candidates.push({...info, reason: 'href'});
+                    }
+                });
+            }
+            return candidates;
+        }""", [selectors, VOTE_KEYWORD_PATTERN.pattern])
+        
+        for candidate in candidates:
+            element = page.locator(candidate['selector']).nth(candidate['index'])
+            reason = candidate['reason']
+            if reason == 'keyword':
+                logger.info(f"Found vote element ({candidate['selector']}[{candidate['index']}]): text='{candidate['text']}', alt='{candidate['alt']}', value='{candidate['value']}'")
+            elif reason == 'onclick':
+                logger.info(f"Found vote element with onclick: {candidate['onclick'][:100]}")
+            else:
+                logger.info(f"Found vote link by URL: {candidate['href']}")
+            try:
+                if reason == 'keyword':
+                    is_visible = await element.is_visible()
+                    is_enabled = await element.is_enabled()
+                    if not (is_visible and is_enabled):
+                        logger.debug(f"Element not clickable - visible: {is_visible}, enabled: {is_enabled}")
                         continue
-            
-            if vote_found:
+                await element.click()
+                await page.wait_for_load_state("domcontentloaded")
+                vote_found = True
                 break
+            except Exception as click_error:
+                logger.debug(f"Failed to click {reason} element: {click_error}")
         
         if vote_found:
-            # 投票ページに遷移できたか確認
-            await page.wait_for_timeout(2000)
+            # 投票ページに遷移できたか確認（networkidle にならないページもあるので、待ちきれなくても続ける）
+            try:
+                await page.wait_for_load_state("networkidle", timeout=10000)
+            except TimeoutError:
+                logger.info("Network idle timeout on vote page, continuing...")
             new_url = page.url
             new_title = await page.title()
             logger.info(f"Vote page navigation - URL: {new_url}, Title: {new_title}")
-            await take_screenshot(page, "vote_page_accessed")
+            await take_milestone_screenshot(page, "vote_page_accessed")
             return True
         else:
             logger.error("Could not find vote button or link")
-            await take_screenshot(page, "vote_navigation_failed")
+            take_screenshot_in_background(page, "vote_navigation_failed")
             
             # デバッグ情報: 利用可能な要素をリスト
             logger.debug("Available clickable elements:")
             for selector in selectors[:3]:  # 主要なセレクタのみ
-                elements = await page.query_selector_all(selector)
-                for i, elem in enumerate(elements[:5]):  # 最初の5つまで
-                    text = await elem.text_content() or ''
+                texts = await page.locator(selector).all_text_contents()
+                for i, text in enumerate(texts[:5]):  # 最初の5つまで
                     if text.strip():
                         logger.debug(f"{selector}[{i}]: '{text.strip()[:50]}'")
             
@@ -1608,7 +2140,7 @@ async def navigate_to_vote(page: Page):
         
     except Exception as e:
         logger.error(f"Failed to navigate to vote: {e}")
-        await take_screenshot(page, "vote_navigation_error")
+        take_screenshot_in_background(page, "vote_navigation_error")
         return False
 
 
@@ -1616,105 +2148,34 @@ async def select_race(page: Page, racecourse: str, race_number: int):
     """競馬場とレースを選択"""
     try:
         logger.info(f"Selecting race: {racecourse} R{race_number}")
-        await take_screenshot(page, "before_race_selection")
-        
-        # 競馬場の別名を含めたマッピング
-        racecourse_mapping = {
-            '東京': ['東京', '府中', 'サラブレッド'],
-            '中山': ['中山', 'ナカヤマ'],
-            '京都': ['京都', 'キョウト'],
-            '阪神': ['阪神', 'ハンシン'],
-            '小倉': ['小倉', 'コクラ'],
-            '中京': ['中京', 'チュウキョウ'],
-            '新潟': ['新潟', 'ニイガタ'],
-            '小倉': ['小倉', 'コクラ'],
-            '鹿児島': ['鹿児島', 'カゴシマ'],
-            '函館': ['函館', 'ハコダテ']
-        }
-        
-        possible_names = racecourse_mapping.get(racecourse, [racecourse])
-        racecourse_selected = False
-        
-        # 競馬場選択 - ボタン、リンク、セレクトボックスをチェック
-        selectors = ['button', 'a', 'option', 'input', 'select', 'div[onclick]']
-        
-        for selector in selectors:
-            if racecourse_selected:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            logger.debug(f"Checking {len(elements)} {selector} elements for racecourse selection")
-            
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                # 競馬場名のマッチをチェック
-                if any(name in combined for combined in [text, value] for name in possible_names):
-                    logger.info(f"Found racecourse element: text='{text.strip()}', value='{value}'")
-                    try:
-                        if selector == 'option':
-                            # selectボックスの場合
-                            select_element = await element.query_selector('xpath=ancestor::select')
-                            if select_element:
-                                await select_element.select_option(value=value)
-                        else:
-                            await element.click()
-                        
-                        logger.info(f"Selected racecourse: {racecourse}")
-                        racecourse_selected = True
-                        await page.wait_for_timeout(2000)
-                        break
-                    except Exception as click_error:
-                        logger.debug(f"Failed to select racecourse element: {click_error}")
-                        continue
-        
-        if not racecourse_selected:
+        await take_milestone_screenshot(page, "before_race_selection")
+        
+        # 競馬場選択
+        racecourse_pattern = RACECOURSE_PATTERNS.get(racecourse) or re.compile(re.escape(racecourse))
+        racecourse_selected = await click_by_pattern(page, racecourse_pattern)
+        if racecourse_selected:
+            logger.info(f"Selected racecourse: {racecourse}")
+            # レース一覧の描画を待機
+            try:
+                await page.wait_for_selector(f"text={race_number}R", state="visible", timeout=TIMEOUT_MS)
+            except TimeoutError:
+                logger.warning(f"Race list did not show R{race_number} in time")
+        else:
             logger.warning(f"Could not find racecourse selector for: {racecourse}")
         
         # レース番号選択
-        race_text_patterns = [f"{race_number}R", f"R{race_number}", f"{race_number}レース", str(race_number)]
-        race_selected = False
-        
-        for selector in selectors:
-            if race_selected:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            logger.debug(f"Checking {len(elements)} {selector} elements for race selection")
-            
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                # レース番号のマッチをチェック
-                for pattern in race_text_patterns:
-                    if pattern == text.strip() or pattern in text or pattern == value:
-                        logger.info(f"Found race element: text='{text.strip()}', value='{value}', pattern='{pattern}'")
-                        try:
-                            if selector == 'option':
-                                select_element = await element.query_selector('xpath=ancestor::select')
-                                if select_element:
-                                    await select_element.select_option(value=value)
-                            else:
-                                await element.click()
-                            
-                            logger.info(f"Selected race: R{race_number}")
-                            race_selected = True
-                            await page.wait_for_timeout(2000)
-                            break
-                        except Exception as click_error:
-                            logger.debug(f"Failed to select race element: {click_error}")
-                            continue
-                
-                if race_selected:
-                    break
-        
-        if not race_selected:
+        race_selected = await click_by_pattern(page, race_number_pattern(race_number))
+        if race_selected:
+            logger.info(f"Selected race: R{race_number}")
+        else:
             logger.warning(f"Could not find race selector for: R{race_number}")
         
-        await page.wait_for_timeout(4000)
-        await take_screenshot(page, "after_race_selection")
+        # 馬番選択エリアの描画を待機
+        try:
+            await page.wait_for_selector('label', state="visible", timeout=TIMEOUT_MS)
+        except TimeoutError:
+            logger.warning("Horse selection area did not appear in time")
+        await take_milestone_screenshot(page, "after_race_selection")
         
         # 選択が成功したか確認
         if racecourse_selected and race_selected:
@@ -1726,7 +2187,7 @@ async def select_race(page: Page, racecourse: str, race_number: int):
         
     except Exception as e:
         logger.error(f"Failed to select race: {e}")
-        await take_screenshot(page, "race_selection_error")
+        await take_screenshot(page, "race_selection_error", fmt='jpeg')
         return False
 
 
@@ -1735,9 +2196,9 @@ async def select_horse_and_bet(page: Page, horse_number: int, horse_name: str, b
     """馬を選択して投票"""
     try:
         logger.info(f"Selecting horse #{horse_number} {horse_name} with bet {bet_amount}")
-        await take_screenshot(page, "before_horse_selection")
+        await take_milestone_screenshot(page, "before_horse_selection")
         
-        await page.wait_for_timeout(4000)
+        await wait_for_any(page, ['label', 'input[type="radio"]', 'input[type="checkbox"]'], timeout=TIMEOUT_MS)
         
         # ページの馬番号選択要素を探す
         horse_selected = False
@@ -1746,112 +2207,64 @@ async def select_horse_and_bet(page: Page, horse_number: int, horse_name: str, b
         horse_patterns = [str(horse_number), f"{horse_number}番", f"#{horse_number}"]
         selectors_for_horse = ['label', 'button', 'input[type="radio"]', 'input[type="checkbox"]', 'a', 'div[onclick]', 'span[onclick]']
         
-        # 大きい番号の場合はスクロール
-        if horse_number >= 9:
-            logger.info("Scrolling for larger horse numbers...")
-            await page.evaluate("window.scrollTo(0, 300)")
-            await page.wait_for_timeout(2000)
-            if horse_number >= 13:
-                await page.evaluate("window.scrollTo(0, 600)")
-                await page.wait_for_timeout(2000)
-        
-        for selector in selectors_for_horse:
-            if horse_selected:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            logger.debug(f"Checking {len(elements)} {selector} elements for horse selection")
-            
-            for i, element in enumerate(elements):
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                name = await element.get_attribute('name') or ''
-                
-                # 馬番号のマッチをチェック
-                for pattern in horse_patterns:
-                    if (pattern == text.strip() or pattern in text or 
-                        pattern == value or pattern in value or
-                        (name and pattern in name)):
-                        logger.info(f"Found horse element: text='{text.strip()}', value='{value}', name='{name}', pattern='{pattern}'")
-                        try:
-                            if selector == 'input[type="radio"]' or selector == 'input[type="checkbox"]':
-                                await element.check()
-                            else:
-                                await element.click()
-                            
-                            logger.info(f"Selected horse number {horse_number}")
-                            horse_selected = True
-                            await page.wait_for_timeout(2000)
-                            break
-                        except Exception as click_error:
-                            logger.debug(f"Failed to select horse element: {click_error}")
-                            continue
+        match = await find_by_keywords(page, selectors_for_horse, horse_patterns, fields=('text', 'value', 'name'))
+        if match:
+            logger.info(f"Found horse element: text='{match['text'].strip()}', value='{match['value']}', name='{match['name']}'")
+            try:
+                element = matched_locator(page, match)
+                if match['selector'] in ('input[type="radio"]', 'input[type="checkbox"]'):
+                    await element.check()
+                else:
+                    await element.click()
                 
-                if horse_selected:
-                    break
+                logger.info(f"Selected horse number {horse_number}")
+                horse_selected = True
+            except Exception as click_error:
+                logger.debug(f"Failed to select horse element: {click_error}")
         
-        # フォールバック: インデックスベースで選択
+        # フォールバック: ラベルを直接指定して選択（click()が自動でスクロールする）
         if not horse_selected:
-            logger.warning("Using fallback: index-based horse selection")
-            labels = await page.query_selector_all('label')
-            if len(labels) > horse_number + 8:
-                await labels[horse_number + 8].click()
+            logger.warning("Using fallback: locator-based horse selection")
+            horse_label = page.locator(
+                f'label[data-horse-number="{horse_number}"], label:has-text("{horse_number}番")'
+            )
+            # 属性・テキストで見つからなければ従来のインデックス（馬番 + 8）を使う
+            if await horse_label.count() == 0:
+                horse_label = page.locator('label').nth(horse_number + 8)
+            try:
+                await horse_label.first.click(timeout=5000)
                 logger.info(f"Selected horse number {horse_number} (fallback method)")
                 horse_selected = True
+            except TimeoutError:
+                logger.warning(f"Fallback horse label not found for #{horse_number}")
         
         if not horse_selected:
             raise Exception(f"Failed to select horse #{horse_number}")
         
-        await page.wait_for_timeout(2000)
-        await take_screenshot(page, "after_horse_selection")
-        
-        # セットボタンを探してクリック
-        set_button_clicked = False
-        button_selectors = ['button', 'input[type="button"]', 'input[type="submit"]', 'a']
+        await take_milestone_screenshot(page, "after_horse_selection")
         
-        for selector in button_selectors:
-            if set_button_clicked:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                if 'セット' in text or 'セット' in value or 'SET' in text.upper():
-                    logger.info(f"Found set button: text='{text.strip()}', value='{value}'")
-                    await element.click()
-                    set_button_clicked = True
-                    break
+        # セットボタンを探してクリック（ロケータが表示を待つので事前の待機は不要）
+        set_button_clicked = await click_first_match(
+            button_or_link(page, re.compile(r"セット|SET", re.I)), timeout=TIMEOUT_MS
+        )
+        if set_button_clicked:
+            logger.info("Clicked set button")
         
         if not set_button_clicked:
             logger.warning("Set button not found, continuing...")
         
-        await page.wait_for_timeout(2000)
-        
         # 入力終了ボタンを探してクリック
-        input_end_clicked = False
-        
-        for selector in button_selectors:
-            if input_end_clicked:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                if '入力終了' in text or '入力終了' in value or '終了' in text:
-                    logger.info(f"Found input end button: text='{text.strip()}', value='{value}'")
-                    await element.click()
-                    input_end_clicked = True
-                    break
+        input_end_clicked = await click_first_match(
+            button_or_link(page, re.compile("入力終了|終了")), timeout=TIMEOUT_MS
+        )
+        if input_end_clicked:
+            logger.info("Clicked input end button")
         
         if not input_end_clicked:
             logger.warning("Input end button not found, continuing...")
         
-        await page.wait_for_timeout(4000)
-        await take_screenshot(page, "before_amount_input")
+        await wait_for_any(page, ['input[type="number"]', 'input[type="text"]'], timeout=TIMEOUT_MS)
+        await take_milestone_screenshot(page, "before_amount_input")
         
         # 金額入力 - より動的な方法で探す
         amount_input_success = False
@@ -1867,97 +2280,64 @@ async def select_horse_and_bet(page: Page, horse_number: int, horse_name: str, b
         
         bet_units = bet_amount // 100  # 100円単位
         
-        for selector in amount_selectors:
-            if amount_input_success:
-                break
-                
-            inputs = await page.query_selector_all(selector)
-            for input_field in inputs:
-                placeholder = await input_field.get_attribute('placeholder') or ''
-                name = await input_field.get_attribute('name') or ''
-                
-                # 金額関連のフィールドかチェック
-                if any(keyword in combined.lower() for combined in [placeholder, name] 
-                       for keyword in ['金額', 'amount', '票数', '円']):
-                    try:
-                        await input_field.fill(str(bet_amount))
-                        logger.info(f"Filled amount field: {bet_amount} yen")
-                        amount_input_success = True
-                        break
-                    except:
-                        continue
+        # 金額関連のフィールドを探す
+        match = await find_by_keywords(page, amount_selectors, ['金額', 'amount', '票数', '円'],
+                                       fields=('placeholder', 'name'), ignore_case=True)
+        if match:
+            try:
+                await matched_locator(page, match).fill(str(bet_amount))
+                logger.info(f"Filled amount field: {bet_amount} yen")
+                amount_input_success = True
+            except Exception as fill_error:
+                logger.debug(f"Failed to fill amount field: {fill_error}")
         
         # フォールバック: インデックスベース
         if not amount_input_success:
             logger.warning("Using fallback: index-based amount input")
-            inputs = await page.query_selector_all('input')
-            if len(inputs) > 11:
-                try:
-                    await inputs[9].fill(str(bet_units))
-                    await inputs[10].fill(str(bet_units))
-                    await inputs[11].fill(str(bet_amount))
+            # 3つの入力欄を1回のevaluateでまとめて設定（input/changeイベントも発火）
+            try:
+                amount_input_success = await page.evaluate("""({n9, n10, n11}) => {
+                    const inputs = document.querySelectorAll('input');
+                    if (inputs.length <= 11) return false;
+                    for (const [idx, val] of [[9, n9], [10, n10], [11, n11]]) {
+                        inputs[idx].value = val;
+                        inputs[idx].dispatchEvent(new Event('input', {bubbles: true}));
+                        inputs[idx].dispatchEvent(new Event('change', {bubbles: true}));
+                    }
+                    return true;
+                }""", {"n9": str(bet_units), "n10": str(bet_units), "n11": str(bet_amount)})
+                if amount_input_success:
                     logger.info(f"Filled amount fields (fallback): {bet_amount} yen")
-                    amount_input_success = True
-                except Exception as fallback_error:
-                    logger.error(f"Fallback amount input failed: {fallback_error}")
-        
-        await page.wait_for_timeout(4000)
-        await take_screenshot(page, "after_amount_input")
+            except Exception as fallback_error:
+                logger.error(f"Fallback amount input failed: {fallback_error}")
         
-        # 購入直前のSlack通知
-        if slack:
-            await slack.send_bet_notification(racecourse, race_number, horse_number, 
-                                            horse_name, bet_amount, status="開始")
+        await take_milestone_screenshot(page, "after_amount_input")
         
         # 購入ボタンを探してクリック
-        purchase_clicked = False
-        purchase_keywords = ['購入する', '購入', '投票する', '投票', 'BUY', 'BET']
-        
-        for selector in button_selectors:
-            if purchase_clicked:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined for combined in [text, value] for keyword in purchase_keywords):
-                    logger.info(f"Found purchase button: text='{text.strip()}', value='{value}'")
-                    await element.click()
-                    purchase_clicked = True
-                    break
+        purchase_clicked = await click_button_before_link(page, PURCHASE_BUTTON_PATTERN, timeout=TIMEOUT_MS)
+        if purchase_clicked:
+            logger.info("Clicked purchase button")
         
         if not purchase_clicked:
             raise Exception("Purchase button not found")
         
-        await page.wait_for_timeout(4000)
-        await take_screenshot(page, "after_purchase_click")
+        await wait_for_any(page, [
+            'button:has-text("OK")',
+            'input[value*="OK"]',
+            'text=受付',
+            'text=完了'
+        ], timeout=TIMEOUT_MS)
+        await take_milestone_screenshot(page, "after_purchase_click")
         
         # OK確認ボタンを探してクリック
-        success = False
-        ok_keywords = ['OK', 'O K', '確認', '完了', '結果']
-        
-        for selector in button_selectors:
-            if success:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined.upper() for combined in [text, value] for keyword in ok_keywords):
-                    logger.info(f"Found confirmation button: text='{text.strip()}', value='{value}'")
-                    await element.click()
-                    logger.info(f"Successfully placed bet for {horse_name}")
-                    success = True
-                    break
+        success = await click_button_before_link(page, CONFIRM_BUTTON_PATTERN)
+        if success:
+            logger.info(f"Successfully placed bet for {horse_name}")
         
-        await page.wait_for_timeout(2000)
-        await take_screenshot(page, "bet_completion")
+        await page.wait_for_load_state("domcontentloaded")
+        await take_milestone_screenshot(page, "bet_completion")
         
-        # 購入完了のSlack通知
+        # 購入結果のSlack通知（開始通知は送らず結果のみ1件）
         if slack and success:
             await slack.send_bet_notification(racecourse, race_number, horse_number, 
                                             horse_name, bet_amount, status="完了")
@@ -1973,20 +2353,22 @@ async def select_horse_and_bet(page: Page, horse_number: int, horse_name: str, b
         
     except Exception as e:
         logger.error(f"Failed to place bet: {e}")
-        await take_screenshot(page, f"bet_error_{horse_name}")
+        take_screenshot_in_background(page, f"bet_error_{horse_name}")
         if slack:
             await slack.send_error_notification(f"投票エラー: {horse_name}", str(e))
         return False
 
 
-async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optional[SlackNotifier] = None):
-    """銀行連携による自動入金（別ウィンドウ処理対応）"""
+async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optional[SlackNotifier] = None,
+                          balance_before: Optional[int] = None):
+    """銀行連携による自動入金（別ウィンドウ処理対応）。入金後の残高を返す（失敗時はNone）"""
     try:
         logger.info(f"Starting auto deposit: {amount} yen")
-        await take_screenshot(page, "before_deposit")
+        await take_milestone_screenshot(page, "before_deposit")
         
-        # 入金前の残高を取得
-        balance_before = await get_balance(page)
+        # 入金前の残高を取得（呼び出し元で取得済みなら再利用）
+        if balance_before is None:
+            balance_before = await get_balance(page)
         logger.info(f"Balance before deposit: {balance_before} yen")
         
         # 入出金ボタンを探してクリック
@@ -1994,68 +2376,52 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
         deposit_keywords = ['入出金', '入金', '入金指示', '銀行連携', 'DEPOSIT']
         selectors = ['button', 'a', 'input[type="button"]', 'input[type="submit"]', 'img', 'div[onclick]']
         
-        for selector in selectors:
-            if deposit_found:
-                break
-                
-            elements = await page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined for combined in [text, alt, value] for keyword in deposit_keywords):
-                    logger.info(f"Found deposit element: text='{text.strip()}', alt='{alt}', value='{value}'")
-                    await element.click()
-                    deposit_found = True
-                    break
+        match = await find_by_keywords(page, selectors, deposit_keywords)
+        if match:
+            logger.info(f"Found deposit element: text='{match['text'].strip()}', alt='{match['alt']}', value='{match['value']}'")
+            deposit_found = True
         
         if not deposit_found:
             raise Exception("Deposit button not found")
         
-        await page.wait_for_timeout(4000)
-        
-        # 新しいウィンドウ/タブを待つか、同じページ内で遷移するかをチェック
-        await page.wait_for_timeout(3000)
-        
-        # 新しいページが開かれたかチェック
-        pages = page.context.pages
-        if len(pages) > 1:
-            # 新しいページが開かれた場合
-            new_page = pages[-1]  # 最新のページ
-            await new_page.wait_for_load_state()
+        # クリックで開く新しいウィンドウ/タブを待つ（開かなければ同じページ内で遷移したとみなす）
+        deposit_button = matched_locator(page, match)
+        await deposit_button.wait_for(timeout=TIMEOUT_MS)
+        try:
+            async with page.context.expect_page(timeout=7000) as new_page_info:
+                await deposit_button.click()
+            new_page = await new_page_info.value
+            await new_page.wait_for_load_state('domcontentloaded')
             logger.info("New deposit page opened")
-        else:
+        except TimeoutError:
             # 同じページ内で遷移した場合
             new_page = page
+            await page.wait_for_load_state()
             logger.info("Deposit page opened in same window")
         
-        await take_screenshot(new_page, "deposit_page_opened")
+        await take_milestone_screenshot(new_page, "deposit_page_opened")
         
         # 入金指示リンクをクリック
         instruction_found = False
         instruction_keywords = ['入金指示', '入金開始', '入金手続き', '入金する']
         
-        for selector in selectors:
-            if instruction_found:
-                break
-                
-            elements = await new_page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined for combined in [text, alt, value] for keyword in instruction_keywords):
-                    logger.info(f"Found deposit instruction element: text='{text.strip()}', alt='{alt}', value='{value}'")
-                    await element.click()
-                    instruction_found = True
-                    break
+        match = await find_by_keywords(new_page, selectors, instruction_keywords)
+        if match:
+            logger.info(f"Found deposit instruction element: text='{match['text'].strip()}', alt='{match['alt']}', value='{match['value']}'")
+            await matched_locator(new_page, match).click()
+            instruction_found = True
         
         if not instruction_found:
             logger.warning("Deposit instruction link not found, continuing...")
         
-        await new_page.wait_for_timeout(4000)
+        # 入金額入力欄の表示を待つ
+        try:
+            await new_page.wait_for_selector(
+                'input[name="NYUKIN"], input[name="nyukin"], input[name="amount"], input[name="kingaku"]',
+                timeout=TIMEOUT_MS,
+            )
+        except TimeoutError:
+            logger.warning("Deposit amount input did not appear, trying fallbacks...")
         
         # 入金額入力
         amount_filled = False
@@ -2072,8 +2438,8 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
             try:
                 element = await new_page.query_selector(selector)
                 if element:
-                    placeholder = await element.get_attribute('placeholder') or ''
-                    name = await element.get_attribute('name') or ''
+                    attrs = await element_attrs(element)
+                    placeholder, name = attrs['placeholder'], attrs['name']
                     
                     if any(keyword in combined.lower() for combined in [placeholder, name, selector]
                            for keyword in ['金額', 'amount', 'nyukin', '入金']):
@@ -2091,28 +2457,20 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
         next_found = False
         next_keywords = ['次へ', '続ける', '進む', 'NEXT', '確認']
         
-        for selector in selectors:
-            if next_found:
-                break
-                
-            elements = await new_page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined for combined in [text, alt, value] for keyword in next_keywords):
-                    logger.info(f"Found next button: text='{text.strip()}', alt='{alt}', value='{value}'")
-                    await element.click()
-                    next_found = True
-                    break
+        match = await find_by_keywords(new_page, selectors, next_keywords)
+        if match:
+            logger.info(f"Found next button: text='{match['text'].strip()}', alt='{match['alt']}', value='{match['value']}'")
+            await matched_locator(new_page, match).click()
+            next_found = True
         
         if not next_found:
             logger.warning("Next button not found, continuing...")
         
-        await new_page.wait_for_timeout(4000)
-        
         # パスワード入力（暗証番号を使用）
+        try:
+            await new_page.wait_for_selector('input[type="password"]', timeout=TIMEOUT_MS)
+        except TimeoutError:
+            logger.warning("Password input did not appear")
         password_filled = False
         password_selectors = [
             'input[name="PASS_WORD"]',
@@ -2139,32 +2497,22 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
         execute_found = False
         execute_keywords = ['実行', '確定', '完了', 'EXECUTE', 'SUBMIT']
         
-        for selector in selectors:
-            if execute_found:
-                break
-                
-            elements = await new_page.query_selector_all(selector)
-            for element in elements:
-                text = await element.text_content() or ''
-                alt = await element.get_attribute('alt') or ''
-                value = await element.get_attribute('value') or ''
-                
-                if any(keyword in combined for combined in [text, alt, value] for keyword in execute_keywords):
-                    logger.info(f"Found execute button: text='{text.strip()}', alt='{alt}', value='{value}'")
-                    await element.click()
-                    execute_found = True
-                    break
+        match = await find_by_keywords(new_page, selectors, execute_keywords)
+        if match:
+            logger.info(f"Found execute button: text='{match['text'].strip()}', alt='{match['alt']}', value='{match['value']}'")
+            # 確認ダイアログ（登録済みのハンドラで承認される）を待つ
+            try:
+                async with new_page.expect_event('dialog', timeout=TIMEOUT_MS):
+                    await matched_locator(new_page, match).click()
+            except TimeoutError:
+                logger.warning("No confirmation dialog appeared after execute click")
+            execute_found = True
         
         if not execute_found:
             logger.warning("Execute button not found, deposit may not be completed")
         
-        await new_page.wait_for_timeout(4000)
-        
-        # アラートの処理
-        new_page.on('dialog', lambda dialog: dialog.accept())
-        
-        await new_page.wait_for_timeout(3000)
-        await take_screenshot(new_page, "after_deposit_execution")
+        await new_page.wait_for_load_state()
+        await take_milestone_screenshot(new_page, "after_deposit_execution")
         
         logger.info(f"Successfully deposited {amount} yen")
         
@@ -2173,7 +2521,11 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
             await new_page.close()
         
         # 入金後の残高を取得
-        await page.wait_for_timeout(5000)  # 入金処理の完了を待つ
+        # 入金処理の完了を待つ（入金は実行済みなので、待ちきれなくても残高は読む）
+        try:
+            await page.wait_for_load_state('networkidle', timeout=10000)
+        except TimeoutError:
+            logger.info("Network idle timeout after deposit, reading balance anyway...")
         balance_after = await get_balance(page)
         logger.info(f"Balance after deposit: {balance_after} yen")
         
@@ -2181,11 +2533,11 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
         if slack:
             await slack.send_deposit_notification(amount, balance_before, balance_after)
         
-        return True
+        return balance_after
         
     except Exception as e:
         logger.error(f"Deposit failed: {e}")
-        await take_screenshot(page, "deposit_error")
+        take_screenshot_in_background(page, "deposit_error")
         
         # エラーが発生した場合、新しいページが開いていれば閉じる
         try:
@@ -2198,18 +2550,77 @@ async def auto_deposit_v2(page: Page, amount: int, password: str, slack: Optiona
         
         if slack:
             await slack.send_error_notification("入金エラー", str(e))
-        return False
+        return None
+
+
+# tickets.csv の列名 → 別名（旧フォーマット）と、列が無い場合の既定値
+TICKET_COLUMN_ALIASES = {'race_course': '競馬場', 'race_number': 'Race', 'horse_number': 'Number', 'horse_name': '馬名'}
+TICKET_DEFAULTS = {'race_course': '', 'race_number': 0, 'horse_number': 0, 'horse_name': '', 'amount': 100}
+
+
+def normalize_tickets(tickets_df: pd.DataFrame) -> pd.DataFrame:
+    """列名の解決を読み込み時に1回だけ行い、投票に使う列だけにそろえる"""
+    tickets_df = tickets_df.rename(columns={
+        alias: column for column, alias in TICKET_COLUMN_ALIASES.items()
+        if column not in tickets_df.columns and alias in tickets_df.columns
+    })
+    for column, default in TICKET_DEFAULTS.items():
+        if column not in tickets_df.columns:
+            tickets_df[column] = default
+    tickets_df = tickets_df[list(TICKET_DEFAULTS)].copy()
+    
+    # 数値列の変換は行ごとではなく列単位で1回だけ行う（金額の空欄は既定値）
+    tickets_df['amount'] = pd.to_numeric(tickets_df['amount'], errors='coerce').fillna(TICKET_DEFAULTS['amount'])
+    for column in ('race_number', 'horse_number'):
+        tickets_df[column] = pd.to_numeric(tickets_df[column], errors='coerce')
+    invalid = tickets_df[['race_number', 'horse_number']].isna().any(axis=1)
+    if invalid.any():
+        logger.warning(f"⚠️ Skipping {int(invalid.sum())} tickets with invalid race/horse numbers: rows {list(tickets_df.index[invalid])}")
+        tickets_df = tickets_df[~invalid]
+    return tickets_df.astype({'race_number': int, 'horse_number': int, 'amount': int})
+
 
+# tickets.csv として受け付けるエンコーディング（先頭から順に判定）
+TICKET_CSV_ENCODINGS = ['utf-8-sig', 'cp932', 'shift_jis']
 
-async def place_bet_from_csv(page: Page, ticket: pd.Series, slack: Optional[SlackNotifier] = None):
-    """CSVからの投票処理"""
+
+def read_tickets_csv(tickets_path: Path) -> Optional[pd.DataFrame]:
+    """ファイルを1回だけ読み、デコードできたエンコーディングで1回だけCSVを解析する"""
+    raw = tickets_path.read_bytes()
+    for encoding in TICKET_CSV_ENCODINGS:
+        try:
+            text = raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        logger.info(f"✓ CSV decoded with {encoding} encoding")
+        return normalize_tickets(pd.read_csv(io.StringIO(text)))
+    return None
+
+
+CONTINUE_VOTE_PATTERN = re.compile("続けて投票")
+
+
+async def resume_same_race(page: Page, horse_number: int) -> bool:
+    """直前の投票と同じレースなら「続けて投票」で馬番選択に戻る（戻れなければFalse）"""
+    await click_first_match(button_or_link(page, CONTINUE_VOTE_PATTERN), timeout=2000)
+    return await wait_for_any(page, [f'label:text-is("{horse_number}")'], timeout=3000) is not None
+
+
+async def place_bet_from_csv(page: Page, ticket, slack: Optional[SlackNotifier] = None, same_race: bool = False):
+    """CSVからの投票処理（ticket は normalize_tickets 後の itertuples の要素、same_race は直前に同じレースへ投票済みか）"""
     try:
-        # CSVのフォーマットに合わせて調整
-        racecourse = ticket.get('race_course', ticket.get('競馬場', ''))
-        race_number = int(ticket.get('race_number', ticket.get('Race', 0)))
-        horse_number = int(ticket.get('horse_number', ticket.get('Number', 0)))
-        horse_name = ticket.get('horse_name', ticket.get('馬名', ''))
-        bet_amount = int(ticket.get('amount', 100))
+        racecourse = ticket.race_course
+        race_number = ticket.race_number
+        horse_number = ticket.horse_number
+        horse_name = ticket.horse_name
+        bet_amount = ticket.amount
+        
+        if same_race and await resume_same_race(page, horse_number):
+            logger.info(f"♻️ Same race as previous ticket, skipping race selection: {racecourse} R{race_number}")
+            if not await select_horse_and_bet(page, horse_number, horse_name, bet_amount,
+                                              racecourse, race_number, slack):
+                raise Exception("Failed to place bet")
+            return True
         
         # 投票画面へ移動
         if not await navigate_to_vote(page):
@@ -2241,6 +2652,37 @@ async def place_bet_from_csv(page: Page, ticket: pd.Series, slack: Optional[Slac
         return False
 
 
+async def open_worker_pages(page: Page, count: int, credentials: dict) -> list:
+    """ログイン済みセッションを共有するワーカー用ページを追加で開く（セッションが使えなければ個別にログイン）"""
+    browser = page.context.browser
+    storage_state = await page.context.storage_state()
+    worker_pages = []
+    for _ in range(count):
+        context = None
+        try:
+            context = await browser.new_context(
+                accept_downloads=True,
+                viewport=BROWSER_VIEWPORT,
+                storage_state=storage_state
+            )
+            await block_unneeded_resources(context)
+            context.on('page', accept_dialogs)
+            worker_page = await context.new_page()
+            if not await resume_ipat_session(worker_page):
+                await retry_async(login_ipat_v2, worker_page, credentials)
+            worker_pages.append(worker_page)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to open worker context: {e}")
+            # ログインに失敗したコンテキストを残すとブラウザ終了まで開いたままになる
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as close_error:
+                    logger.debug(f"Failed to close worker context: {close_error}")
+            break
+    return worker_pages
+
+
 async def main():
     """メイン処理"""
     slack_bets = None
@@ -2256,6 +2698,7 @@ async def main():
         if slack_info['token']:
             if slack_info['bets_channel_id']:
                 slack_bets = SlackNotifier(slack_info['token'], slack_info['bets_channel_id'])
+                slack_bets.start_batching()
                 logger.info("Slack bets notifier initialized")
             
             if slack_info['alerts_channel_id']:
@@ -2282,19 +2725,21 @@ async def main():
             tickets_path = Path('tickets/tickets.csv')
             if tickets_path.exists():
                 logger.info("Reading tickets.csv...")
-                tickets_df = pd.read_csv(tickets_path)
+                tickets_df = read_tickets_csv(tickets_path)
+                if tickets_df is None:
+                    raise Exception("Could not read tickets.csv with any encoding")
                 logger.info(f"Found {len(tickets_df)} tickets to process")
                 
-                for idx, ticket in tickets_df.iterrows():
+                bet_bucket = TokenBucket(BET_RATE_PER_SEC)
+                for idx, ticket in enumerate(tickets_df.itertuples(index=False)):
                     try:
-                        logger.info(f"DRY RUN: Would place bet - {ticket.to_dict()}")
+                        # レート制限対策（上限を超えた時だけ待機）
+                        await bet_bucket.acquire()
+                        logger.info(f"DRY RUN: Would place bet - {ticket._asdict()}")
                         successful_bets += 1
-                        bet_amount = int(ticket.get('amount', 100))
+                        bet_amount = ticket.amount
                         total_amount += bet_amount
                         total_bets += 1
-                        
-                        # レート制限対策で待機
-                        await asyncio.sleep(1)
                     except Exception as e:
                         logger.error(f"Failed to process ticket {idx+1}: {e}")
                         if slack_alerts:
@@ -2323,7 +2768,7 @@ async def main():
                 
                 # セッション開始をSlackに通知
                 if slack_bets:
-                    await slack_bets.send_session_start_notification()
+                    await slack_bets.send_session_start_notification(start_time)
                 
                 # まずHTTPベースで分析を実行
                 logger.info("📡 STEP 0: Pre-flight site analysis...")
@@ -2335,17 +2780,30 @@ async def main():
                         headless=HEADLESS_MODE,
                         args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage']
                     )
+                    has_saved_session = bool(SESSION_STATE_PATH) and Path(SESSION_STATE_PATH).exists()
                     context = await browser.new_context(
                         accept_downloads=True,
-                        viewport={'width': 1280, 'height': 720}
+                        viewport=BROWSER_VIEWPORT,
+                        storage_state=SESSION_STATE_PATH if has_saved_session else None
                     )
+                    await block_unneeded_resources(context)
+                    # 確認ダイアログのハンドラはページ作成時に登録する（入金ウィンドウ等のポップアップも含む）
+                    context.on('page', accept_dialogs)
+                    if LOG_FORM_POSTS:
+                        # 入金ウィンドウ（別ページ）のフォーム送信も記録する
+                        context.on('request', log_form_post)
                     page = await context.new_page()
                     
                     # STEP 1: ログイン
                     logger.info("🔐 STEP 1: IPAT LOGIN (Two-stage authentication)...")
                     login_start = datetime.now()
                     try:
-                        await retry_async(login_ipat_v2, page, credentials)
+                        if has_saved_session and await resume_ipat_session(page):
+                            logger.info("♻️ Reused saved IPAT session, skipping login")
+                        else:
+                            await retry_async(login_ipat_v2, page, credentials)
+                            if SESSION_STATE_PATH:
+                                await save_session_state(context)
                         login_duration = (datetime.now() - login_start).total_seconds()
                         logger.info(f"✓ Login successful in {login_duration:.1f}s")
                         if slack_bets:
@@ -2358,9 +2816,10 @@ async def main():
                     
                     # STEP 2: 残高確認
                     logger.info("💰 STEP 2: BALANCE CHECK...")
+                    balance_cache = BalanceCache()
                     balance_start = datetime.now()
                     try:
-                        balance = await get_balance(page)
+                        balance = await balance_cache.get(page)
                         balance_duration = (datetime.now() - balance_start).total_seconds()
                         if balance is not None:
                             logger.info(f"✓ Current balance: {balance:,} yen (checked in {balance_duration:.1f}s)")
@@ -2390,11 +2849,20 @@ async def main():
                             await slack_bets.send_deposit_start_notification(deposit_needed, balance)
                         
                         try:
-                            await retry_async(auto_deposit_v2, page, deposit_needed, 
-                                            credentials['password'], slack_bets)
+                            balance_after = await retry_async(auto_deposit_v2, page, deposit_needed, 
+                                                              credentials['password'], slack_bets,
+                                                              balance_before=balance)
+                            if balance_after is None:
+                                raise Exception("Deposit did not complete")
                             deposit_duration = (datetime.now() - deposit_start).total_seconds()
                             logger.info(f"✓ Deposit completed in {deposit_duration:.1f}s")
-                            balance = deposit_amount  # 更新
+                            # 入金処理内で読み直した残高をそのまま使う（読めなかった場合のみ次回ページから取得）
+                            if balance_after:
+                                balance = balance_after
+                                balance_cache.value = balance_after
+                            else:
+                                balance = deposit_amount  # 概算
+                                balance_cache.invalidate()
                             
                             # 入金後の残高確認通知
                             if slack_bets:
@@ -2406,7 +2874,7 @@ async def main():
                     else:
                         logger.info(f"✓ Sufficient balance: {balance:,} yen")
                         if slack_bets:
-                            await slack_bets.send_message(f"✅ 十分な残高があります: ¥{balance:,}")
+                            await slack_bets.queue_message(f"✅ 十分な残高があります: ¥{balance:,}")
                     
                     # STEP 4: チケット処理・投票実行
                     logger.info("🎫 STEP 4: BETTING EXECUTION...")
@@ -2415,16 +2883,7 @@ async def main():
                     
                     if tickets_path.exists():
                         logger.info(f"📄 Reading tickets from: {tickets_path}")
-                        # 複数のエンコーディングを試す
-                        encodings = ['utf-8', 'cp932', 'shift_jis', 'utf-8-sig']
-                        tickets_df = None
-                        for encoding in encodings:
-                            try:
-                                tickets_df = pd.read_csv(tickets_path, encoding=encoding)
-                                logger.info(f"✓ CSV read successfully with {encoding} encoding")
-                                break
-                            except UnicodeDecodeError:
-                                continue
+                        tickets_df = read_tickets_csv(tickets_path)
                         
                         if tickets_df is None:
                             logger.error("❌ Failed to read CSV with any encoding")
@@ -2436,55 +2895,86 @@ async def main():
                         logger.info(f"🎯 Processing {total_tickets} betting tickets...")
                         
                         if slack_bets:
-                            await slack_bets.send_message(f"🎫 {total_tickets}枚のチケット処理開始")
+                            await slack_bets.queue_message(f"🎫 {total_tickets}枚のチケット処理開始")
                         
-                        for idx, ticket in tickets_df.iterrows():
-                            ticket_start = datetime.now()
-                            bet_amount = int(ticket.get('amount', 100))
-                            
-                            # 各チケット処理前に残高チェック
-                            logger.info(f"🎫 Processing ticket {idx+1}/{total_tickets}: {ticket.get('race_course', '')} R{ticket.get('race_number', '')} #{ticket.get('horse_number', '')} ({bet_amount:,}円)")
-                            
-                            # 残高チェック
-                            current_balance = await get_balance(page)
-                            if current_balance and current_balance < bet_amount:
-                                logger.warning(f"⚠️ Insufficient balance: {current_balance:,} < {bet_amount:,} yen")
-                                if slack_alerts:
-                                    await slack_alerts.send_error_notification(
-                                        "残高不足", f"チケット#{idx+1}: 残高{current_balance:,}円 < 必要{bet_amount:,}円"
-                                    )
-                                continue
-                            
-                            try:
-                                success = await place_bet_from_csv(page, ticket, slack_bets)
-                                ticket_duration = (datetime.now() - ticket_start).total_seconds()
+                        # チケットをキューに入れ、各ワーカーが取り出して投票する
+                        queue: asyncio.Queue = asyncio.Queue()
+                        for idx, ticket in enumerate(tickets_df.itertuples(index=False)):
+                            queue.put_nowait((idx, ticket))
+                        bet_bucket = TokenBucket(BET_RATE_PER_SEC)
+                        
+                        async def worker(worker_page: Page):
+                            nonlocal successful_bets, total_amount, total_bets
+                            last_race = None  # 直前に投票が成功したレース（連続する同一レースは選択を省く）
+                            while True:
+                                try:
+                                    idx, ticket = queue.get_nowait()
+                                except asyncio.QueueEmpty:
+                                    return
+                                await bet_bucket.acquire()
+                                ticket_start = datetime.now()
+                                bet_amount = ticket.amount
+                                
+                                # 各チケット処理前に残高チェック
+                                logger.info(f"🎫 Processing ticket {idx+1}/{total_tickets}: {ticket.race_course} R{ticket.race_number} #{ticket.horse_number} ({bet_amount:,}円)")
                                 
-                                if success:
-                                    successful_bets += 1
-                                    total_amount += bet_amount
-                                    logger.info(f"✓ Ticket {idx+1} successful in {ticket_duration:.1f}s")
-                                else:
-                                    logger.warning(f"⚠️ Ticket {idx+1} failed in {ticket_duration:.1f}s")
+                                # 残高チェック
+                                current_balance = await balance_cache.get(worker_page)
+                                if current_balance and current_balance < bet_amount:
+                                    logger.warning(f"⚠️ Insufficient balance: {current_balance:,} < {bet_amount:,} yen")
+                                    if slack_alerts:
+                                        await slack_alerts.send_error_notification(
+                                            "残高不足", f"チケット#{idx+1}: 残高{current_balance:,}円 < 必要{bet_amount:,}円"
+                                        )
+                                    continue
                                 
-                                total_bets += 1
+                                try:
+                                    race_key = (ticket.race_course, ticket.race_number)
+                                    success = await place_bet_from_csv(worker_page, ticket, slack_bets,
+                                                                       same_race=race_key == last_race)
+                                    last_race = race_key if success else None
+                                    ticket_duration = (datetime.now() - ticket_start).total_seconds()
                                 
-                                # プログレス表示
-                                progress = (idx + 1) / total_tickets * 100
-                                logger.info(f"📊 Progress: {idx+1}/{total_tickets} ({progress:.1f}%)")
+                                    if success:
+                                        successful_bets += 1
+                                        total_amount += bet_amount
+                                        balance_cache.debit(bet_amount)
+                                        logger.info(f"✓ Ticket {idx+1} successful in {ticket_duration:.1f}s")
+                                    else:
+                                        logger.warning(f"⚠️ Ticket {idx+1} failed in {ticket_duration:.1f}s")
                                 
-                                # レート制限対策で待機
-                                await asyncio.sleep(5)
+                                    total_bets += 1
                                 
-                            except Exception as e:
-                                ticket_duration = (datetime.now() - ticket_start).total_seconds()
-                                logger.error(f"❌ Ticket {idx+1} error in {ticket_duration:.1f}s: {e}")
-                                await take_screenshot(page, f"ticket_error_{idx+1}")
+                                    # プログレス表示
+                                    progress = (idx + 1) / total_tickets * 100
+                                    logger.info(f"📊 Progress: {idx+1}/{total_tickets} ({progress:.1f}%)")
                                 
-                                if slack_alerts:
-                                    await slack_alerts.send_error_notification(
-                                        f"チケット処理エラー (#{idx+1})", str(e)
-                                    )
-                                continue
+                                    # 固定の待機ではなく、次のチケットに進める状態になるのを待つ
+                                    await worker_page.wait_for_load_state("domcontentloaded")
+                                
+                                except Exception as e:
+                                    last_race = None
+                                    ticket_duration = (datetime.now() - ticket_start).total_seconds()
+                                    logger.error(f"❌ Ticket {idx+1} error in {ticket_duration:.1f}s: {e}")
+                                    take_screenshot_in_background(worker_page, f"ticket_error_{idx+1}")
+                                
+                                    if slack_alerts:
+                                        await slack_alerts.send_error_notification(
+                                            f"チケット処理エラー (#{idx+1})", str(e)
+                                        )
+                                    continue
+                        
+                        worker_pages = [page]
+                        concurrency = max(1, min(PURCHASE_CONCURRENCY, total_tickets))
+                        if concurrency > 1:
+                            logger.info(f"🔀 Betting with {concurrency} parallel workers")
+                            worker_pages += await open_worker_pages(page, concurrency - 1, credentials)
+                        try:
+                            await asyncio.gather(*[worker(worker_page) for worker_page in worker_pages])
+                        finally:
+                            await wait_for_background_screenshots()
+                            for worker_page in worker_pages[1:]:
+                                await worker_page.context.close()
                         
                         betting_duration = (datetime.now() - betting_start).total_seconds()
                         logger.info(f"✓ Betting phase completed in {betting_duration:.1f}s")
@@ -2492,13 +2982,16 @@ async def main():
                     else:
                         logger.warning("⚠️ No tickets.csv found, skipping betting phase")
                         if slack_bets:
-                            await slack_bets.send_message("⚠️ tickets.csvが見つかりません。投票をスキップします。")
+                            await slack_bets.queue_message("⚠️ tickets.csvが見つかりません。投票をスキップします。")
                     
                     # STEP 5: 最終残高確認
                     logger.info("💰 STEP 5: FINAL BALANCE CHECK...")
                     final_balance_start = datetime.now()
                     try:
-                        final_balance = await get_balance(page)
+                        # 投票した場合のみページから読み直す（投票していなければ初回または入金後の残高のまま）
+                        if total_bets > 0:
+                            balance_cache.invalidate()
+                        final_balance = await balance_cache.get(page)
                         final_balance_duration = (datetime.now() - final_balance_start).total_seconds()
                         
                         if final_balance is not None:
@@ -2546,7 +3039,9 @@ async def main():
                     logger.info(f"⏰ Session ended at: {session_end.strftime('%Y-%m-%d %H:%M:%S')}")
                     logger.info("=" * 60)
                     
-                    # Slack通知
+                    # Slack通知（投票通知を送り切ってからサマリーを送る）
+                    if slack_bets:
+                        await slack_bets.stop_batching()
                     if slack_bets and total_bets > 0:
                         summary_message = (
                             f"🏁 **AKATSUKI BOT V2 セッション完了**\n\n"
@@ -2567,6 +3062,7 @@ async def main():
                         )
                     
                     logger.info("🔐 Closing browser...")
+                    await wait_for_background_screenshots()
                     await browser.close()
                     logger.info("✓ Browser closed successfully")
             
@@ -2649,7 +3145,15 @@ async def main():
         
         logger.error("⚠️ Main process terminated due to fatal error")
         raise
+    finally:
+        # キューに残っている投票通知・送信中のエラー通知を送り切ってセッションを閉じる
+        for notifier in (slack_bets, slack_alerts):
+            if notifier:
+                await notifier.close()
+        await close_http_session()
+        save_selector_cache()
 
 
 if __name__ == "__main__":
+    disable_unused_log_record_fields()
     asyncio.run(main())
\ No newline at end of file
@@ -3,7 +3,10 @@
 IPAT自動投票Bot - Seleniumコードベースのシンプル実装
 """
 import os
+import re
+import time
 import asyncio
+import contextlib
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
@@ -22,6 +25,7 @@ from constants import Timeouts, UIIndices, URLs, Config
 
 # ユーティリティのインポート
 from page_navigator import PageNavigator
+from utils import block_unneeded_resources, BROWSER_VIEWPORT, PagePool, disable_unused_log_record_fields, fetch_secret
 
 # S3購入履歴サービス（冪等性確保）
 try:
@@ -46,6 +50,94 @@ logger = logging.getLogger(__name__)
 IPAT_URL = URLs.IPAT_BASE
 IPAT_HOME_URL = URLs.IPAT_HOME
 
+# 競馬場・レース選択で走査するクリック可能要素
+CLICKABLE_SELECTOR = 'button, a, div[ng-click], span[ng-click]'
+
+# テキスト検索でクリックするボタン類
+BUTTON_SELECTOR = 'button, input[type=button], a, div[ng-click]'
+
+# 入金ウィンドウでテキスト検索するクリック可能要素
+DEPOSIT_CLICKABLE_SELECTOR = 'a, button, input[type="button"], input[type="submit"]'
+
+# モーダル/ダイアログとみなす要素
+MODAL_SELECTOR = '.modal, [class*="dialog"], [role="dialog"]'
+
+# 投票画面（競馬場タブ）または投票ボタン後のモーダル
+VOTE_PAGE_READY_SELECTOR = '[class*="jyoTab"], [class*="field"], ' + MODAL_SELECTOR
+
+# 要素が表示されているか（offsetParent は position:fixed の要素で常に null になるため使わない）
+IS_VISIBLE_JS = """(e) => e.getClientRects().length > 0 && getComputedStyle(e).visibility !== 'hidden'"""
+
+# テキスト条件に一致する最初の要素を返す（click_button_by_text / wait_for_button_by_text 共通）
+# mode: 'equals'（いずれかと完全一致）、'contains'（全てを含む）、'any'（いずれかを含む）
+FIND_BUTTON_BY_TEXT_JS = """([sel, needles, mode, visibleOnly]) => {
+    const isVisible = """ + IS_VISIBLE_JS + """;
+    for (const el of document.querySelectorAll(sel)) {
+        if (visibleOnly && !isVisible(el)) continue;
+        const raw = (el.textContent || el.value || '').trim();
+        if (!raw) continue;
+        const t = mode === 'equals' ? raw : raw.replace(/\\s+/g, '');
+        const ok = mode === 'equals' ? needles.includes(t)
+            : mode === 'any' ? needles.some(n => t.includes(n))
+            : needles.every(n => t.includes(n));
+        if (ok) return el;
+    }
+    return null;
+}"""
+
+# 表示中のモーダルを数える
+COUNT_VISIBLE_MODALS_JS = """(sel) => Array.from(document.querySelectorAll(sel))
+    .filter(""" + IS_VISIBLE_JS + """)
+    .length"""
+
+# セット → 入力終了 → 票数・金額入力をページ内の1回の evaluate で行う
+# ボタン・入力欄は現れるまでページ内でポーリングし、値は Angular が検知できるよう input/change を発火する
+# 戻り値: 表示中のセット・入力終了ボタンを両方押せなかった、または入力欄が見つからなければ null、成功したら押したボタンの一覧
+FILL_BET_FORM_JS = """async ([indices, units, amount, timeout]) => {
+    const find = """ + FIND_BUTTON_BY_TEXT_JS + """;
+    const waitFor = async (fn) => {
+        const deadline = Date.now() + timeout;
+        for (;;) {
+            const found = fn();
+            if (found || Date.now() > deadline) return found;
+            await new Promise(resolve => setTimeout(resolve, 50));
+        }
+    };
+    const clicked = [];
+    for (const label of ['セット', '入力終了']) {
+        const button = await waitFor(() => find(['button', [label], 'equals', true]));
+        // ボタンを押せていない画面の入力欄に金額を書き込まないよう中止する
+        if (!button) return null;
+        button.click();
+        clicked.push(label);
+    }
+    const isVisible = """ + IS_VISIBLE_JS + """;
+    const visible = el => !!el && isVisible(el);
+    const fields = await waitFor(() => {
+        const inputs = document.querySelectorAll('input');
+        return visible(inputs[indices[2]]) ? indices.map(i => inputs[i]) : null;
+    });
+    if (!fields) return null;
+    const setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    [units, units, amount].forEach((value, i) => {
+        setter.call(fields[i], String(value));
+        fields[i].dispatchEvent(new Event('input', {bubbles: true}));
+        fields[i].dispatchEvent(new Event('change', {bubbles: true}));
+    });
+    return clicked;
+}"""
+
+# tickets.csvの列と型
+TICKET_COLUMNS = ['race_course', 'race_number', 'bet_type', 'horse_number', 'horse_name', 'amount']
+TICKET_DTYPES = {
+    'race_course': 'string',
+    'race_number': 'int32',
+    'bet_type': 'string',
+    'horse_number': 'int16',
+    'horse_name': 'string',
+    'amount': 'int32',
+}
+
 
 # ========================================
 # データ構造（冪等性対応）
@@ -60,6 +152,12 @@ class TicketStatus(Enum):
     PURCHASE_FAILED = "purchase_failed"          # 購入失敗
 
 
+class ScreenState(Enum):
+    """ブラウザの現在画面（チケット間の不要なページ遷移を省くため）"""
+    HOME = "home"          # メインページ（pw_890_i.cgi）
+    UNKNOWN = "unknown"    # 不明（購入失敗後など）
+
+
 class DepositFailedException(Exception):
     """入金失敗例外（銀行口座残高不足の可能性）"""
     def __init__(self, requested_amount: int, actual_balance: int, message: str = None):
@@ -79,11 +177,15 @@ class ExistingBet:
     horse_number: int        # 馬番 (e.g., 13)
     amount: int              # 金額 (e.g., 5000)
 
+    def match_key(self) -> tuple:
+        """突合用のキー（競馬場, レース番号, 券種, 馬番, 金額）"""
+        return (self.racecourse, self.race_number, self.bet_type, self.horse_number, self.amount)
+
     def __str__(self):
         return f"{self.racecourse} {self.race_number}R - {self.bet_type} {self.horse_number}番 {self.amount:,}円 (receipt: {self.receipt_number})"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Ticket:
     """tickets.csvから読み込んだ投票指示"""
     racecourse: str          # race_course column
@@ -93,21 +195,19 @@ class Ticket:
     horse_name: str          # horse_name column
     amount: int              # amount column
 
+    def match_key(self) -> tuple:
+        """突合用のキー（ExistingBet.match_keyと同じ構成）"""
+        return (self.racecourse, self.race_number, self.bet_type, self.horse_number, self.amount)
+
     def matches(self, existing_bet: ExistingBet) -> bool:
         """既存の投票と一致するかチェック"""
-        return (
-            self.racecourse == existing_bet.racecourse and
-            self.race_number == existing_bet.race_number and
-            self.bet_type == existing_bet.bet_type and
-            self.horse_number == existing_bet.horse_number and
-            self.amount == existing_bet.amount
-        )
+        return self.match_key() == existing_bet.match_key()
 
     def __str__(self):
         return f"{self.racecourse} {self.race_number}R - {self.horse_number}番 {self.horse_name} {self.amount:,}円"
 
 
-@dataclass
+@dataclass(slots=True)
 class ReconciliationResult:
     """突合結果"""
     ticket: Ticket
@@ -120,14 +220,31 @@ class ReconciliationResult:
 # ヘルパー関数
 # ========================================
 
+def read_tickets_csv(tickets_path: Path) -> pd.DataFrame:
+    """
+    tickets.csvを必要な列と型を指定して読み込む（pyarrowがあれば使用）
+
+    bet_type列が無い場合は "単勝" で補完する。
+    """
+    header = pd.read_csv(tickets_path, nrows=0).columns
+    usecols = [col for col in TICKET_COLUMNS if col in header]
+    dtype = {col: TICKET_DTYPES[col] for col in usecols}
+
+    try:
+        tickets_df = pd.read_csv(tickets_path, usecols=usecols, dtype=dtype, engine='pyarrow')
+    except ImportError:
+        tickets_df = pd.read_csv(tickets_path, usecols=usecols, dtype=dtype)
+
+    if 'bet_type' not in tickets_df.columns:
+        tickets_df = tickets_df.assign(bet_type='単勝')  # デフォルト: 単勝
+    return tickets_df
+
+
 async def get_all_secrets():
     """AWS Secrets Managerから認証情報を取得"""
     try:
-        client = boto3.client('secretsmanager', region_name=os.environ.get('AWS_DEFAULT_REGION', 'ap-northeast-1'))
         secret_id = os.environ['AWS_SECRET_NAME']
-
-        response = client.get_secret_value(SecretId=secret_id)
-        secrets = json.loads(response['SecretString'])
+        secrets = fetch_secret(secret_id)
 
         credentials = {
             'inet_id': secrets.get('jra_inet_id', ''),  # INET-ID（第1段階）- 使わない可能性あり
@@ -159,64 +276,142 @@ async def get_all_secrets():
         raise
 
 
-async def take_screenshot(page: Page, name: str):
-    """スクリーンショットを保存"""
+async def take_screenshot(page: Page, name: str, fmt: str = 'png'):
+    """スクリーンショットを保存（エラー時の診断用は fmt='jpeg' で軽いJPEG）"""
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"output/screenshots/{name}_{timestamp}.png"
+        extension = "jpg" if fmt == 'jpeg' else "png"
+        filename = f"output/screenshots/{name}_{timestamp}.{extension}"
         Path(filename).parent.mkdir(parents=True, exist_ok=True)
-        await page.screenshot(path=filename)
+        if fmt == 'jpeg':
+            await page.screenshot(path=filename, type='jpeg', quality=60)
+        else:
+            await page.screenshot(path=filename)
         logger.info(f"Screenshot saved: {filename}")
     except Exception as e:
         logger.warning(f"Failed to save screenshot: {e}")
 
 
+async def click_button_by_text(
+    scope,
+    *needles: str,
+    mode: str = 'contains',
+    selector: str = BUTTON_SELECTOR,
+    visible_only: bool = False
+) -> Optional[str]:
+    """
+    テキストでボタンを探してクリック（検索とクリックをページ内の1回のevaluateで実行）
+
+    Args:
+        scope: Playwright page または frame
+        *needles: 検索するテキスト
+        mode: 'equals'（いずれかと完全一致）、'contains'（全てを含む）、'any'（いずれかを含む）
+              'contains'/'any' では改行・空白を除去して比較する
+        selector: 検索対象要素のセレクタ
+        visible_only: 表示されている要素のみを対象にするか
+
+    Returns:
+        クリックした要素のテキスト（見つからなければNone）
+    """
+    return await scope.evaluate(
+        """(args) => {
+            const el = (""" + FIND_BUTTON_BY_TEXT_JS + """)(args);
+            if (!el) return null;
+            el.click();
+            return (el.textContent || el.value || '').trim();
+        }""",
+        [selector, list(needles), mode, visible_only]
+    )
+
+
+async def find_button_index_by_text(
+    scope,
+    *needles: str,
+    mode: str = 'contains',
+    selector: str = BUTTON_SELECTOR,
+    visible_only: bool = False
+) -> int:
+    """
+    click_button_by_text と同じ条件で要素を探し、scope.locator(selector) 内のインデックスを返す
+    （ポップアップを開くなど実クリックが必要な場合用）
+
+    Returns:
+        インデックス（見つからなければ -1）
+    """
+    return await scope.evaluate(
+        """(args) => {
+            const el = (""" + FIND_BUTTON_BY_TEXT_JS + """)(args);
+            return el ? [...document.querySelectorAll(args[0])].indexOf(el) : -1;
+        }""",
+        [selector, list(needles), mode, visible_only]
+    )
+
+
+async def wait_for_button_by_text(
+    scope,
+    *needles: str,
+    mode: str = 'contains',
+    selector: str = BUTTON_SELECTOR,
+    visible_only: bool = False,
+    timeout: int = Timeouts.NETWORKIDLE
+) -> bool:
+    """
+    click_button_by_text と同じ条件のボタンが現れるまで待機（固定待機の代わり）
+
+    Returns:
+        timeout内に現れたらTrue
+    """
+    try:
+        await scope.wait_for_function(
+            "(args) => !!(" + FIND_BUTTON_BY_TEXT_JS + ")(args)",
+            arg=[selector, list(needles), mode, visible_only],
+            timeout=timeout
+        )
+        return True
+    except Exception as e:
+        logger.debug(f"Button {needles} did not appear within {timeout}ms: {e}")
+        return False
+
+
 async def navigate_to_bet_history_page(page: Page, navigator: PageNavigator, date_type: str) -> bool:
     """投票履歴ページへ遷移"""
     try:
         # メインメニューに戻る
         await page.goto(IPAT_HOME_URL)
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
 
-        # 「投票履歴」ボタンをクリック
-        await page.wait_for_timeout(Timeouts.MEDIUM)
-
-        # ページのテキストを取得してデバッグ
-        body_text = await page.evaluate("document.body.innerText")
-        logger.info(f"Page text (first 500 chars): {body_text[:500]}")
-
-        # PageNavigatorを使用してボタンをクリック
-        履歴_found = "投票履歴" in body_text and await navigator.find_and_click_by_text(
+        # 「投票履歴」ボタンをクリック（メニューが描画されるまで待ってから探す）
+        履歴_found = await navigator.find_and_click_by_text(
             "投票履歴",
-            element_types=['button', 'a', 'div[role="button"]']
+            element_types=['button', 'a', 'div[role="button"]'],
+            timeout=Timeouts.NETWORKIDLE
         )
 
         if not 履歴_found:
+            # ページのテキストを取得してデバッグ
+            body_text = await page.evaluate("document.body.innerText")
+            logger.info(f"Page text (first 500 chars): {body_text[:500]}")
             logger.warning("⚠️ Could not find 投票履歴 button, will try alternative approach")
-            await take_screenshot(page, "投票履歴_not_found")
+            await take_screenshot(page, "投票履歴_not_found", fmt='jpeg')
             return False
 
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
-
-        # 「投票内容照会（当日分/前日分）」を選択
-        if date_type == "same_day":
-            logger.info("Selecting 当日分...")
-            await navigator.find_and_click_by_text(
-                "当日",
-                element_types=['button', 'a', 'div[role="button"]', 'label']
-            )
-        else:
-            logger.info("Selecting 前日分...")
-            await navigator.find_and_click_by_text(
-                "前日",
-                element_types=['button', 'a', 'div[role="button"]', 'label']
-            )
+        # 「投票内容照会（当日分/前日分）」を選択（投票履歴の画面が描画されるまで待ってから探す）
+        day_text = "当日" if date_type == "same_day" else "前日"
+        logger.info(f"Selecting {day_text}分...")
+        day_found = await navigator.find_and_click_by_text(
+            day_text,
+            element_types=['button', 'a', 'div[role="button"]', 'label'],
+            timeout=Timeouts.NETWORKIDLE
+        )
+        if not day_found:
+            logger.warning(f"⚠️ Could not find {day_text} button")
+            await take_screenshot(page, f"{day_text}_not_found", fmt='jpeg')
+            return False
 
         await page.wait_for_timeout(Timeouts.NAVIGATION)
         return True
     except Exception as e:
         logger.error(f"❌ Failed to navigate to bet history: {e}")
-        await take_screenshot(page, "bet_history_nav_error")
+        await take_screenshot(page, "bet_history_nav_error", fmt='jpeg')
         return False
 
 
@@ -497,7 +692,7 @@ async def fetch_existing_bets(page: Page, date_type: str = "same_day") -> List[E
 
     except Exception as e:
         logger.error(f"❌ Failed to fetch existing bets: {e}")
-        await take_screenshot(page, "fetch_existing_bets_error")
+        await take_screenshot(page, "fetch_existing_bets_error", fmt='jpeg')
         return []
 
 
@@ -521,15 +716,18 @@ def reconcile_tickets(
     logger.info("TICKET RECONCILIATION")
     logger.info("=" * 60)
 
+    # 既存投票をキーで索引化（同じキーが複数ある場合は最初の投票を使う）
+    existing_by_key = {}
+    for existing_bet in existing_bets:
+        existing_by_key.setdefault(existing_bet.match_key(), existing_bet)
+
+    already_purchased = 0
     for ticket in tickets:
         # Check if ticket already exists in placed bets
-        matching_bet = None
-        for existing_bet in existing_bets:
-            if ticket.matches(existing_bet):
-                matching_bet = existing_bet
-                break
+        matching_bet = existing_by_key.get(ticket.match_key())
 
         if matching_bet:
+            already_purchased += 1
             result = ReconciliationResult(
                 ticket=ticket,
                 status=TicketStatus.ALREADY_PURCHASED,
@@ -547,8 +745,7 @@ def reconcile_tickets(
         results.append(result)
 
     # Summary
-    already_purchased = sum(1 for r in results if r.status == TicketStatus.ALREADY_PURCHASED)
-    to_purchase = sum(1 for r in results if r.status == TicketStatus.NOT_PURCHASED)
+    to_purchase = len(results) - already_purchased
 
     logger.info("=" * 60)
     logger.info(f"SUMMARY: {already_purchased} already purchased, {to_purchase} to purchase")
@@ -600,7 +797,7 @@ async def verify_purchase_in_inquiry(
 
     except Exception as e:
         logger.error(f"❌ Inquiry verification failed: {e}")
-        await take_screenshot(page, "inquiry_verification_error")
+        await take_screenshot(page, "inquiry_verification_error", fmt='jpeg')
         return False, None
 
     finally:
@@ -640,7 +837,7 @@ async def get_current_balance(page: Page) -> int:
 
         # スクリーンショットを取得して確認
         logger.warning("⚠️ Could not find balance on page, taking screenshot for debugging")
-        await take_screenshot(page, "balance_not_found")
+        await take_screenshot(page, "balance_not_found", fmt='jpeg')
 
         # 見つからない場合は0を返す（安全側に倒す）
         logger.warning("⚠️ Could not find balance - assuming 0 for safety")
@@ -660,23 +857,22 @@ async def open_deposit_window(page: Page) -> Optional[Page]:
     """
     try:
         # "入出金"ボタンを探してクリック
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and "入出金" in text:
-                logger.info("✓ Found '入出金' button")
-
-                # 新しいウィンドウが開くのを待つ
-                async with page.expect_popup() as popup_info:
-                    await button.click()
-                deposit_page = await popup_info.value
-
-                await deposit_page.wait_for_timeout(Timeouts.LONG)
-                logger.info(f"✓ Deposit window opened: {deposit_page.url}")
-                return deposit_page
-
-        logger.error("❌ '入出金' button not found")
-        return None
+        index = await find_button_index_by_text(page, "入出金", selector='button')
+        if index < 0:
+            logger.error("❌ '入出金' button not found")
+            return None
+        logger.info("✓ Found '入出金' button")
+
+        # 新しいウィンドウが開くのを待つ（ポップアップを許可させるため実クリックで開く）
+        async with page.expect_popup() as popup_info:
+            await page.locator('button').nth(index).click()
+        deposit_page = await popup_info.value
+        # 実行時のconfirmダイアログを自動承認するハンドラーはウィンドウを開いた時点で設定する
+        deposit_page.on('dialog', lambda dialog: dialog.accept())
+
+        await deposit_page.wait_for_load_state('domcontentloaded')
+        logger.info(f"✓ Deposit window opened: {deposit_page.url}")
+        return deposit_page
 
     except Exception as e:
         logger.error(f"❌ Failed to open deposit window: {e}")
@@ -692,17 +888,13 @@ async def navigate_to_deposit_form(deposit_page: Page) -> bool:
     """
     try:
         # "入金指示"リンクをクリック
-        links = await deposit_page.query_selector_all('a')
-        for link in links:
-            text = await link.text_content()
-            if text and "入金指示" in text:
-                logger.info("✓ Found '入金指示' link")
-                await link.click()
-                await deposit_page.wait_for_timeout(Timeouts.LONG)
-                return True
+        if await click_button_by_text(deposit_page, "入金指示", selector='a') is None:
+            logger.error("❌ '入金指示' link not found")
+            return False
 
-        logger.error("❌ '入金指示' link not found")
-        return False
+        logger.info("✓ Clicked '入金指示' link")
+        await deposit_page.wait_for_selector('input[name="NYUKIN"]', timeout=Timeouts.NETWORKIDLE)
+        return True
 
     except Exception as e:
         logger.error(f"❌ Failed to navigate to deposit form: {e}")
@@ -722,22 +914,12 @@ async def complete_and_submit_deposit(deposit_page: Page, credentials: dict, dep
         logger.info(f"✓ Deposit amount entered: {deposit_amount}円")
 
         # "次へ"をクリック（ボタンまたはリンク）
-        clickables = await deposit_page.query_selector_all('a, button, input[type="button"], input[type="submit"]')
-        next_clicked = False
-        for element in clickables:
-            text = await element.text_content() if element else ""
-            value = await element.get_attribute('value') if element else ""
-            if (text and "次へ" in text) or (value and "次へ" in value):
-                logger.info("✓ Clicking '次へ' button")
-                await element.click()
-                next_clicked = True
-                break
-
-        if not next_clicked:
+        if await click_button_by_text(deposit_page, "次へ", selector=DEPOSIT_CLICKABLE_SELECTOR) is None:
             logger.error("❌ '次へ' button not found!")
             return False
+        logger.info("✓ Clicked '次へ' button")
 
-        await deposit_page.wait_for_timeout(Timeouts.LONG)
+        await deposit_page.wait_for_selector('input[name="PASS_WORD"]', timeout=Timeouts.NETWORKIDLE)
 
         # パスワード（暗証番号）を入力
         await deposit_page.fill('input[name="PASS_WORD"]', credentials['password'])
@@ -753,28 +935,26 @@ async def complete_and_submit_deposit(deposit_page: Page, credentials: dict, dep
             logger.warning(f"Failed to save HTML: {e}")
 
         # "実行"をクリック（ボタンまたはリンク）- JavaScriptクリックで確実に
-        clickables = await deposit_page.query_selector_all('a, button, input[type="button"], input[type="submit"]')
-        execution_element = None
-        for element in clickables:
-            text = await element.text_content() if element else ""
-            value = await element.get_attribute('value') if element else ""
-            if (text and "実行" in text) or (value and "実行" in value):
-                logger.info(f"✓ Found '実行' button/link: text='{text}', value='{value}'")
-                execution_element = element
-                break
+        execution_element = await deposit_page.evaluate(
+            """(args) => {
+                const el = (""" + FIND_BUTTON_BY_TEXT_JS + """)(args);
+                return el && {
+                    tag: el.tagName,
+                    text: el.textContent,
+                    value: el.getAttribute('value'),
+                    onclick: el.getAttribute('onclick')
+                };
+            }""",
+            [DEPOSIT_CLICKABLE_SELECTOR, ["実行"], 'contains', False]
+        )
 
         if not execution_element:
             logger.error("❌ '実行' button not found!")
             return False
 
         # 実行ボタンの詳細をログ出力
-        tag_name = await execution_element.evaluate("el => el.tagName")
-        onclick = await execution_element.get_attribute("onclick")
-        logger.info(f"✓ Element type: {tag_name}, onclick: {onclick}")
-
-        # confirmダイアログを自動承認するハンドラーを設定
-        deposit_page.on('dialog', lambda dialog: dialog.accept())
-        logger.info("✓ Dialog handler set to auto-accept")
+        logger.info(f"✓ Found '実行' button/link: text='{execution_element['text']}', value='{execution_element['value']}'")
+        logger.info(f"✓ Element type: {execution_element['tag']}, onclick: {execution_element['onclick']}")
 
         # deposit_pageのコンテキストでsubmitForm関数を直接実行（診断情報付き）
         logger.info("✓ Executing submitForm with diagnostics")
@@ -824,7 +1004,7 @@ async def complete_and_submit_deposit(deposit_page: Page, credentials: dict, dep
                 logger.error("- 銀行口座が登録されていない")
                 logger.error("- 入金額が不正")
                 logger.error("- その他のバリデーションエラー")
-                await take_screenshot(deposit_page, "checkInput_failed")
+                await take_screenshot(deposit_page, "checkInput_failed", fmt='jpeg')
                 return False
 
             logger.info(f"✓ checkInput passed (errFlg=0), proceeding with submission")
@@ -860,17 +1040,7 @@ async def complete_and_submit_deposit(deposit_page: Page, credentials: dict, dep
             logger.error(f"❌ Execution failed: {e}")
             return False
 
-        await deposit_page.wait_for_timeout(Timeouts.LONG)
-
-        # アラートを承認
-        try:
-            deposit_page.on('dialog', lambda dialog: dialog.accept())
-            await deposit_page.wait_for_timeout(Timeouts.MEDIUM)
-            logger.info("✓ Alert accepted")
-        except Exception as e:
-            logger.debug(f"No alert or already handled: {e}")
-
-        await deposit_page.wait_for_timeout(Timeouts.LONG)
+        # アラートは送信前に登録したハンドラで承認済み（送信後の遷移は networkidle で待機済み）
         await take_screenshot(deposit_page, "deposit_complete")
 
         return True
@@ -954,7 +1124,7 @@ async def verify_deposit_balance(page: Page, deposit_amount: int) -> bool:
             logger.error(f"   Expected: {deposit_amount:,}円, Got: {balance:,}円")
             logger.error("❌ 入金が反映されませんでした。銀行口座の残高不足の可能性があります。")
             logger.error("❌ 投票処理を中止します。")
-            await take_screenshot(page, "deposit_verification_timeout")
+            await take_screenshot(page, "deposit_verification_timeout", fmt='jpeg')
             # 入金失敗例外を投げる（Slack通知用の情報を含む）
             raise DepositFailedException(
                 requested_amount=deposit_amount,
@@ -969,7 +1139,7 @@ async def verify_deposit_balance(page: Page, deposit_amount: int) -> bool:
         raise
     except Exception as e:
         logger.error(f"❌ Failed to verify deposit balance: {e}")
-        await take_screenshot(page, "deposit_verification_error")
+        await take_screenshot(page, "deposit_verification_error", fmt='jpeg')
         raise DepositFailedException(
             requested_amount=deposit_amount,
             actual_balance=0,
@@ -1034,7 +1204,7 @@ async def deposit(page: Page, credentials: dict, amount: int = 20000):
         raise
     except Exception as e:
         logger.error(f"❌ Deposit failed: {e}")
-        await take_screenshot(page, "deposit_error")
+        await take_screenshot(page, "deposit_error", fmt='jpeg')
         raise DepositFailedException(
             requested_amount=amount,
             actual_balance=0,
@@ -1054,9 +1224,9 @@ async def perform_stage1_login(page: Page, credentials: dict):
         await page.fill('input[name="inetid"]', credentials['inet_id'])
         logger.info("✓ INET-ID entered")
 
-        # 次の画面への遷移
+        # 次の画面への遷移（固定待機ではなく第2段階の入力欄の表示を待つ）
         await page.click('.button')
-        await page.wait_for_timeout(Timeouts.LONG)
+        await page.wait_for_selector('input[name="i"]', timeout=Timeouts.NETWORKIDLE)
         logger.info("✓ Stage 1 button clicked")
         await take_screenshot(page, "after_stage1")
         return True
@@ -1126,14 +1296,9 @@ async def handle_ok_dialog(page: Page):
     """
     try:
         await page.wait_for_timeout(Timeouts.LONG)
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and "OK" in text:
-                await button.click()
-                logger.info("✓ OK button clicked")
-                await page.wait_for_timeout(Timeouts.LONG)
-                break
+        if await click_button_by_text(page, "OK", selector='button') is not None:
+            logger.info("✓ OK button clicked")
+            await page.wait_for_timeout(Timeouts.LONG)
     except Exception as e:
         logger.debug(f"No OK button found (normal): {e}")
 
@@ -1163,7 +1328,7 @@ async def verify_login_success(page: Page):
         logger.error("  3. システムエラー")
         logger.error("")
         logger.error("JRA IPATサポートセンターに連絡してアカウント状況を確認してください")
-        await take_screenshot(page, "login_failed")
+        await take_screenshot(page, "login_failed", fmt='jpeg')
         raise Exception("Login failed: Login form was displayed again after submission")
 
     logger.info("✓ ログインフォームは表示されていません - ログイン処理は正常に進んでいます")
@@ -1198,54 +1363,44 @@ async def verify_login_success(page: Page):
         f.write(html_content)
     logger.info("✓ HTML saved for debugging: output/login_after_page.html")
 
-    # ページの全テキストを確認
-    body_text = await page.evaluate("document.body.innerText")
+    # 残高表示（"円"を含む金額）が描画されるまで1回だけ待機
+    try:
+        await main_frame.wait_for_function(
+            "() => /\\d{1,3}(?:,\\d{3})*\\s*円/.test(document.body.innerText)",
+            timeout=Timeouts.NAVIGATION * 5
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Balance text did not appear: {e}")
+
+    # td要素のテキストとページ全体のテキストを並行して取得
+    td_texts, body_text = await asyncio.gather(
+        main_frame.eval_on_selector_all('td', "els => els.map(e => (e.textContent || '').trim())"),
+        page.evaluate("() => document.body.innerText")
+    )
     logger.info(f"Page text (first 500 chars): {body_text[:500]}")
 
-    max_retries = 5
     balance = None
-    for i in range(max_retries):
-        tds = await main_frame.query_selector_all('td')
-        logger.info(f"Found {len(tds)} td elements in frame")
-
-        # デバッグ: 最初の試行でtd要素のテキストをログ出力
-        if i == 0:
-            for idx, td in enumerate(tds[:15]):  # 最初の15個
-                text = await td.text_content()
-                logger.info(f"  TD[{idx}]: '{text.strip() if text else ''}'")
-
-        # td要素で残高を探す
-        for td in tds:
-            text = await td.text_content()
-            if text and "円" in text:
-                logger.info(f"✓ Balance found: {text.strip()}")
-                # 残高を数値として抽出
-                try:
-                    balance = int(text.replace(",", "").replace("円", "").strip())
-                    logger.info(f"💰 Current balance: {balance}円")
-                except:
-                    pass
-                break
-
-        # td要素で見つからない場合は、ページ全体のテキストから"円"を含む部分を探す
-        if balance is None and "円" in body_text:
-            logger.info("Trying to find balance in body text...")
-            import re
-            # 数字とカンマと円のパターンを探す
-            matches = re.findall(r'(\d{1,3}(?:,\d{3})*)\s*円', body_text)
-            if matches:
-                logger.info(f"Found {len(matches)} potential balance values: {matches}")
-                # 最初の値を残高として使用
-                try:
-                    balance = int(matches[0].replace(",", ""))
-                    logger.info(f"💰 Current balance (from text): {balance}円")
-                except:
-                    pass
-
-        if balance is not None:
+    # td要素で残高を探す
+    for text in td_texts:
+        if "円" in text:
+            try:
+                balance = int(text.replace(",", "").replace("円", "").strip())
+                logger.info(f"💰 Current balance: {balance}円")
+            except ValueError:
+                pass
             break
-        logger.info(f"Waiting for balance... ({i+1}/{max_retries})")
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
+
+    # td要素で見つからない場合は、ページ全体のテキストから探す
+    if balance is None:
+        import re
+        matches = re.findall(r'(\d{1,3}(?:,\d{3})*)\s*円', body_text)
+        if matches:
+            logger.info(f"Found {len(matches)} potential balance values: {matches}")
+            # 最初の値を残高として使用
+            balance = int(matches[0].replace(",", ""))
+            logger.info(f"💰 Current balance (from text): {balance}円")
+        else:
+            logger.warning("⚠️ Balance not found in page text")
 
     await page.wait_for_timeout(Timeouts.MEDIUM)
     await take_screenshot(page, "login_complete")
@@ -1267,9 +1422,9 @@ async def login_simple(page: Page, credentials: dict):
     try:
         logger.info("🔐 Starting simple IPAT login...")
 
-        # ログイン画面へ移動
-        await page.goto(IPAT_URL)
-        await page.wait_for_timeout(Timeouts.LONG)
+        # ログイン画面へ移動（INET-ID欄が表示されたら次へ進む）
+        await page.goto(IPAT_URL, wait_until='domcontentloaded')
+        await page.wait_for_selector('input[name="inetid"]', timeout=Timeouts.NETWORKIDLE)
 
         # 1. 第1段階ログイン (INET-ID)
         if not await perform_stage1_login(page, credentials):
@@ -1287,7 +1442,7 @@ async def login_simple(page: Page, credentials: dict):
 
     except Exception as e:
         logger.error(f"❌ Login failed: {e}")
-        await take_screenshot(page, "login_error")
+        await take_screenshot(page, "login_error", fmt='jpeg')
         raise
 
 
@@ -1314,48 +1469,64 @@ async def check_already_on_vote_page(page: Page) -> bool:
     return False
 
 
+async def count_visible_modals(page: Page) -> int:
+    """
+    表示されているモーダルの数をページ内の1回のevaluateで数える
+
+    Returns:
+        表示されているモーダルの数
+    """
+    return await page.evaluate(COUNT_VISIBLE_MODALS_JS, MODAL_SELECTOR)
+
+
+async def wait_for_modals_closed(page: Page, timeout: int = Timeouts.SELECTOR_WAIT):
+    """
+    表示中のモーダルが無くなるまで待機（固定待機の代わり）
+    """
+    try:
+        await page.wait_for_function(
+            "(sel) => (" + COUNT_VISIBLE_MODALS_JS + ")(sel) === 0",
+            arg=MODAL_SELECTOR,
+            timeout=timeout
+        )
+    except Exception as e:
+        logger.debug(f"Modals still visible after {timeout}ms: {e}")
+
+
+async def wait_for_vote_page(page: Page):
+    """
+    通常投票ボタンのクリック後、競馬場タブかモーダルが表示されるまで待機
+    """
+    try:
+        await page.wait_for_selector(VOTE_PAGE_READY_SELECTOR, state='visible', timeout=Timeouts.NETWORKIDLE)
+    except Exception as e:
+        logger.debug(f"Vote page did not appear within timeout: {e}")
+
+
 async def close_visible_modals(page: Page):
     """
     表示されているモーダルを閉じる
     """
-    modals = await page.query_selector_all('.modal, [class*="dialog"]')
-    visible_modals = []
-    for modal in modals:
-        if await modal.is_visible():
-            visible_modals.append(modal)
+    visible_count = await count_visible_modals(page)
 
-    if len(visible_modals) > 0:
-        logger.info(f"Found {len(visible_modals)} visible modals, trying to close...")
+    if visible_count > 0:
+        logger.info(f"Found {visible_count} visible modals, trying to close...")
         # OK/閉じるボタンを探してクリック
-        all_buttons = await page.query_selector_all('button, input[type="button"]')
-        for btn in all_buttons:
-            try:
-                if await btn.is_visible():
-                    text = await btn.text_content()
-                    if text and ("OK" in text or "閉じる" in text):
-                        await btn.click()
-                        logger.info(f"✓ Clicked close button: {text.strip()}")
-                        await page.wait_for_timeout(Timeouts.SHORT)
-                        break
-            except:
-                pass
+        text = await click_button_by_text(
+            page, "OK", "閉じる", mode='any',
+            selector='button, input[type="button"]', visible_only=True
+        )
+        if text:
+            logger.info(f"✓ Clicked close button: {text}")
+            await wait_for_modals_closed(page)
 
 
 async def click_vote_menu_link(page: Page):
     """
     投票メニューリンクをクリック（トップメニューから投票選択画面へ）
     """
-    all_links = await page.query_selector_all('a, button, div[ng-click]')
-    for link in all_links:
-        try:
-            text = await link.text_content()
-            if text and "投票メニュー" in text:
-                logger.info("✓ Clicking '投票メニュー' link to reset vote page")
-                await link.click()
-                await page.wait_for_timeout(Timeouts.MEDIUM)
-                break
-        except:
-            pass
+    if await click_button_by_text(page, "投票メニュー", selector='a, button, div[ng-click]'):
+        logger.info("✓ Clicked '投票メニュー' link to reset vote page")
 
 
 async def find_and_click_vote_button_in_main_page(page: Page) -> bool:
@@ -1365,52 +1536,35 @@ async def find_and_click_vote_button_in_main_page(page: Page) -> bool:
     Returns:
         ボタンが見つかってクリックできたらTrue
     """
-    # すべてのボタンをデバッグ出力
-    buttons = await page.query_selector_all('button')
-    logger.info(f"Found {len(buttons)} buttons on page")
-    for i, button in enumerate(buttons[:10]):  # 最初の10個を表示
-        text = await button.text_content()
-        logger.info(f"Button {i}: '{text.strip() if text else ''}'")
-
-    # "通常"と"投票"を含むボタンを探す
-    for button in buttons:
-        text = await button.text_content()
-        if text and "通常" in text and "投票" in text:
-            # JavaScriptクリックを使用（要素が他の要素に隠れていてもOK）
-            try:
-                await button.evaluate("el => el.click()")
-                logger.info(f"✓ Clicked vote button (JS click): {text.strip()}")
-            except Exception as e:
-                logger.warning(f"JS click failed, trying normal click: {e}")
-                await button.click()
-                logger.info(f"✓ Clicked vote button: {text.strip()}")
-            await page.wait_for_timeout(Timeouts.LONG)
+    # "通常"と"投票"を含むボタンを探す（JavaScriptクリックなので要素が隠れていてもOK）
+    text = await click_button_by_text(page, "通常", "投票", selector='button')
+    if not text:
+        return False
 
-            # 投票ボタンクリック後にモーダルが出る場合があるので再度チェック
-            try:
-                post_click_modals = await page.query_selector_all('.modal, [class*="dialog"], [role="dialog"]')
-                for modal in post_click_modals:
-                    if await modal.is_visible():
-                        # "このまま進む" や "OK" ボタンを探してクリック
-                        modal_buttons = await modal.query_selector_all('button, input[type="button"]')
-                        for mbtn in modal_buttons:
-                            try:
-                                mtext = await mbtn.text_content()
-                                if mtext and ("このまま進む" in mtext or "OK" in mtext or "進む" in mtext):
-                                    await mbtn.click()
-                                    logger.info(f"✓ Closed post-vote modal: {mtext.strip()}")
-                                    await page.wait_for_timeout(Timeouts.MEDIUM)
-                                    break
-                            except:
-                                pass
-                        break
-            except Exception as e:
-                logger.debug(f"No post-vote modals: {e}")
+    logger.info(f"✓ Clicked vote button (JS click): {text}")
+    await wait_for_vote_page(page)
 
-            await take_screenshot(page, "vote_page")
-            return True
+    # 投票ボタンクリック後にモーダルが出る場合があるので再度チェック
+    try:
+        if await count_visible_modals(page) > 0:
+            # "このまま進む" や "OK" ボタンを探してクリック
+            mtext = await click_button_by_text(
+                page, "このまま進む", "OK", "進む", mode='any',
+                selector=(
+                    '.modal button, .modal input[type="button"], '
+                    '[class*="dialog"] button, [class*="dialog"] input[type="button"], '
+                    '[role="dialog"] button, [role="dialog"] input[type="button"]'
+                ),
+                visible_only=True
+            )
+            if mtext:
+                logger.info(f"✓ Closed post-vote modal: {mtext}")
+                await wait_for_modals_closed(page)
+    except Exception as e:
+        logger.debug(f"No post-vote modals: {e}")
 
-    return False
+    await take_screenshot(page, "vote_page")
+    return True
 
 
 async def find_and_click_vote_button_in_frames(page: Page) -> bool:
@@ -1424,22 +1578,12 @@ async def find_and_click_vote_button_in_frames(page: Page) -> bool:
     logger.info(f"Checking {len(frames)} frames")
     for i, frame in enumerate(frames):
         try:
-            frame_buttons = await frame.query_selector_all('button')
-            logger.info(f"Frame {i} has {len(frame_buttons)} buttons")
-            for button in frame_buttons:
-                text = await button.text_content()
-                if text and "通常" in text and "投票" in text:
-                    # JavaScriptクリックを使用
-                    try:
-                        await button.evaluate("el => el.click()")
-                        logger.info(f"✓ Clicked vote button in frame {i} (JS click): {text.strip()}")
-                    except Exception as e:
-                        logger.warning(f"JS click failed in frame {i}, trying normal click: {e}")
-                        await button.click()
-                        logger.info(f"✓ Clicked vote button in frame {i}: {text.strip()}")
-                    await page.wait_for_timeout(Timeouts.LONG)
-                    await take_screenshot(page, "vote_page")
-                    return True
+            text = await click_button_by_text(frame, "通常", "投票", selector='button')
+            if text:
+                logger.info(f"✓ Clicked vote button in frame {i} (JS click): {text}")
+                await wait_for_vote_page(page)
+                await take_screenshot(page, "vote_page")
+                return True
         except Exception as e:
             logger.debug(f"Frame {i} error: {e}")
 
@@ -1456,8 +1600,8 @@ async def navigate_to_vote_simple(page: Page):
     try:
         logger.info("📋 Navigating to vote page...")
 
-        # ページが完全に読み込まれるまで待つ
-        await page.wait_for_timeout(Timeouts.MEDIUM)
+        # ページが読み込まれるまで待つ
+        await page.wait_for_load_state('domcontentloaded')
         await take_screenshot(page, "before_vote_navigation")
 
         # ページのHTMLをデバッグ出力
@@ -1474,7 +1618,8 @@ async def navigate_to_vote_simple(page: Page):
         # 3. 投票メニューリンクをクリック
         await click_vote_menu_link(page)
 
-        await page.wait_for_timeout(Timeouts.MEDIUM)
+        # 通常投票ボタンが現れるまで待つ
+        await wait_for_button_by_text(page, "通常", "投票", selector='button')
 
         # 4. メインページで通常投票ボタンを探してクリック
         if await find_and_click_vote_button_in_main_page(page):
@@ -1485,7 +1630,7 @@ async def navigate_to_vote_simple(page: Page):
             return True
 
         logger.error("❌ Vote button not found")
-        await take_screenshot(page, "vote_button_not_found")
+        await take_screenshot(page, "vote_button_not_found", fmt='jpeg')
         return False
 
     except Exception as e:
@@ -1493,130 +1638,116 @@ async def navigate_to_vote_simple(page: Page):
         return False
 
 
-async def find_and_click_racecourse_button(page: Page, racecourse: str) -> bool:
-    """
-    競馬場ボタンを検索してクリック
-
-    Args:
-        page: Playwright page
-        racecourse: 競馬場名（例: "東京", "福島"）
-
-    Returns:
-        クリックに成功したらTrue
+async def click_racecourse_and_race(page: Page, racecourse: str, race_number: int) -> int:
     """
-    # buttons, links, and clickable divs を全て検索
-    all_clickables = await page.query_selector_all('button, a, div[ng-click], span[ng-click]')
-    logger.info(f"Found {len(all_clickables)} clickable elements")
-
-    for i, element in enumerate(all_clickables):
-        text = await element.text_content()
-        if text:
-            text = text.strip()
-            # デバッグ: 最初の50個の要素をログ出力
-            if i < 50:
-                logger.info(f"  Element[{i}]: '{text[:50]}'")
-            # "福島（土）", "福島（金）" など、競馬場名で始まる要素を検索
-            if text.startswith(racecourse + "（"):
-                # JavaScriptクリックで確実にクリック（要素が隠れていてもOK）
-                try:
-                    await element.evaluate("el => el.click()")
-                    logger.info(f"✓ Selected racecourse (JS click): {text}")
-                except Exception as e:
-                    logger.warning(f"JS click failed, trying normal click: {e}")
-                    await element.scroll_into_view_if_needed()
-                    await page.wait_for_timeout(500)
-                    await element.click()
-                    logger.info(f"✓ Selected racecourse: {text}")
-                return True
-
-    logger.error(f"Racecourse button not found for: {racecourse}")
-    await take_screenshot(page, f"racecourse_not_found_{racecourse}")
-    return False
+    競馬場ボタンとレースボタンをページ内の1回のevaluateで検索・クリック
 
-
-async def find_and_click_race_button(page: Page, racecourse: str, race_number: int) -> tuple[bool, Optional[any]]:
-    """
-    レースボタンを検索してクリック
+    競馬場（"福島（土）" など競馬場名で始まる要素）をクリックした後、
+    その競馬場がアクティブになる（またはレース一覧が描画し直される）まで待ち、
+    競馬場の要素より後ろにある "10R (時刻)" のような要素をクリックする（前の競馬場の一覧を押さないように）。
+    要素が隠れていてもクリックできるよう、どちらもJavaScriptクリックを使う。
 
     Args:
         page: Playwright page
-        racecourse: 競馬場名
+        racecourse: 競馬場名（例: "東京", "福島"）
         race_number: レース番号
 
     Returns:
-        (成功したか, クリックしたレースボタン要素)
+        クリックしたレースボタンのインデックス（失敗時は -1）
     """
     race_text = f"{race_number}R"
-    all_race_elements = await page.query_selector_all('button, a, div[ng-click], span[ng-click]')
-    logger.info(f"Found {len(all_race_elements)} elements for race selection")
+    result = await page.evaluate(
+        """async ([sel, course, rt, timeout]) => {
+            const text = e => (e.textContent || '').trim();
+            const elements = () => Array.from(document.querySelectorAll(sel));
+            const isOn = e => /\bon\b/.test(e.className || '');
+            const before = elements();
+            const courseIdx = before.findIndex(e => text(e).startsWith(course));
+            if (courseIdx < 0) return {error: 'racecourse', texts: before.slice(0, 50).map(text)};
+            const courseEl = before[courseIdx];
+            // クリック前から表示されているレース一覧（前に選択していた競馬場の一覧かもしれない）
+            const staleRaces = new Set(before.filter(e => text(e).startsWith(rt)));
+            courseEl.click();
+
+            // クリックした競馬場がアクティブ（"on"クラス）になるか、レース一覧が描画し直されるまで待ち、
+            // 競馬場の要素より後ろにあるレースだけを対象にする
+            const deadline = Date.now() + timeout;
+            while (Date.now() < deadline) {
+                const els = elements();
+                const idx = els.findIndex(e => text(e).startsWith(course));
+                if (idx >= 0) {
+                    const active = isOn(els[idx]);
+                    const raceIdx = els.findIndex((e, i) => i > idx && text(e).startsWith(rt) && (active || !staleRaces.has(e)));
+                    if (raceIdx >= 0) {
+                        els[raceIdx].click();
+                        return {course: text(els[idx]), raceIdx};
+                    }
+                }
+                await new Promise(resolve => setTimeout(resolve, 50));
+            }
+            return {error: 'race', course: text(courseEl)};
+        }""",
+        [CLICKABLE_SELECTOR, racecourse + "（", race_text, Timeouts.NETWORKIDLE]
+    )
 
-    race_button = None
-    for i, element in enumerate(all_race_elements):
-        text = await element.text_content()
-        if text:
-            text = text.strip()
-            # デバッグ用に最初の20個のレース要素をログ出力
-            if i < 20 and ('R' in text or '(' in text):
-                logger.info(f"  Race element[{i}]: '{text[:100]}'")
-
-            # "10R (時刻)"のようなフォーマットに対応
-            if text.startswith(race_text):
-                race_button = element
-                logger.info(f"✓ Found race button at index {i}: '{text[:50]}'")
-                break
+    if result.get('error') == 'racecourse':
+        # デバッグ: 最初の50個の要素をログ出力
+        for i, text in enumerate(result['texts']):
+            logger.info(f"  Element[{i}]: '{text[:50]}'")
+        logger.error(f"Racecourse button not found for: {racecourse}")
+        await take_screenshot(page, f"racecourse_not_found_{racecourse}", fmt='jpeg')
+        return -1
 
-    if not race_button:
-        logger.error(f"Race button {race_text} not found")
-        await take_screenshot(page, f"race_button_not_found_{racecourse}_{race_number}")
-        return False, None
+    logger.info(f"✓ Selected racecourse (JS click): {result['course']}")
+    await take_screenshot(page, f"after_racecourse_selection_{racecourse}")
 
-    # JavaScriptクリックで確実にクリック
-    try:
-        await race_button.evaluate("el => el.click()")
-        logger.info(f"✓ Clicked race button (JS click): {race_text}")
-    except Exception as e:
-        logger.warning(f"JS click failed on race button, trying normal click: {e}")
-        await race_button.click()
-        logger.info(f"✓ Clicked race button: {race_text}")
+    if result.get('error') == 'race':
+        logger.error(f"Race button {race_text} not found")
+        await take_screenshot(page, f"race_button_not_found_{racecourse}_{race_number}", fmt='jpeg')
+        return -1
 
-    return True, race_button
+    logger.info(f"✓ Clicked race button (JS click): {race_text} at index {result['raceIdx']}")
+    return result['raceIdx']
 
 
-async def wait_for_race_button_activation(page: Page, race_button):
+async def wait_for_race_button_activation(page: Page, race_idx: int):
     """
     レースボタンがアクティブ化（"on"クラス追加）されるまで待機
 
     Args:
         page: Playwright page
-        race_button: レースボタン要素
+        race_idx: レースボタンのインデックス
     """
     logger.info("Waiting for Angular to update DOM...")
     try:
         # レースボタンが "on" クラスを持つまで待つ（最大10秒）
-        for i in range(20):  # 20回 x 500ms = 10秒
-            btn_class = await race_button.get_attribute('class')
-            if btn_class and 'on' in btn_class:
-                logger.info(f"✓ Race button activated (on class detected) after {i * 0.5}s")
-                break
-            await page.wait_for_timeout(500)
-        else:
-            logger.warning("Race button didn't get 'on' class within 10 seconds")
+        await page.wait_for_function(
+            """([sel, i]) => {
+                const el = document.querySelectorAll(sel)[i];
+                return !!el && /\\bon\\b/.test(el.className || '');
+            }""",
+            arg=[CLICKABLE_SELECTOR, race_idx],
+            timeout=Timeouts.NETWORKIDLE
+        )
+        logger.info("✓ Race button activated (on class detected)")
     except Exception as e:
-        logger.warning(f"Error waiting for 'on' class: {e}")
+        logger.warning(f"Race button didn't get 'on' class within 10 seconds: {e}")
 
 
-async def scroll_to_horse_selection_area(page: Page, racecourse: str, race_number: int):
+async def wait_for_horse_selection_area(page: Page, racecourse: str, race_number: int):
     """
-    馬番選択エリアまでスクロール
+    馬番選択エリアの表示を待機（クリック時に自動でスクロールされるため、ここではスクロールしない）
 
     Args:
         page: Playwright page
         racecourse: 競馬場名
         race_number: レース番号
     """
-    logger.info("Scrolling to horse selection area...")
-    await page.evaluate("window.scrollTo(0, 400);")
-    await page.wait_for_timeout(Timeouts.MEDIUM)
+    logger.info("Waiting for horse selection area...")
+    try:
+        await page.wait_for_selector('label', state='visible', timeout=Timeouts.SELECTOR_WAIT)
+    except Exception as e:
+        logger.debug(f"Horse labels not visible yet: {e}")
     await take_screenshot(page, f"horse_selection_{racecourse}_{race_number}")
 
 
@@ -1635,28 +1766,18 @@ async def select_race_simple(page: Page, racecourse: str, race_number: int):
     try:
         logger.info(f"🏇 Selecting {racecourse} R{race_number}...")
 
-        # 1. 競馬場ボタンを検索してクリック
-        if not await find_and_click_racecourse_button(page, racecourse):
+        # 1. 競馬場ボタン → レースボタンを検索してクリック
+        race_idx = await click_racecourse_and_race(page, racecourse, race_number)
+        if race_idx < 0:
             return False
 
-        # 2. Angularがレース一覧を読み込むまで待つ
-        logger.info("Waiting for race list to load...")
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
-        await take_screenshot(page, f"after_racecourse_selection_{racecourse}")
-
-        # 3. レースボタンを検索してクリック
-        success, race_button = await find_and_click_race_button(page, racecourse, race_number)
-        if not success:
-            return False
+        # 2. レースボタンのアクティブ化待機
+        await wait_for_race_button_activation(page, race_idx)
 
-        # 4. レースボタンのアクティブ化待機
-        await wait_for_race_button_activation(page, race_button)
-
-        await page.wait_for_timeout(Timeouts.MEDIUM)
         await take_screenshot(page, f"race_selected_{racecourse}_{race_number}")
 
-        # 5. 馬番選択エリアまでスクロール
-        await scroll_to_horse_selection_area(page, racecourse, race_number)
+        # 3. 馬番選択エリアの表示待機
+        await wait_for_horse_selection_area(page, racecourse, race_number)
 
         return True
 
@@ -1668,15 +1789,6 @@ async def select_race_simple(page: Page, racecourse: str, race_number: int):
 async def select_horse_on_page(page: Page, horse_number: int) -> bool:
     """ページ上で馬を選択"""
     try:
-        # スクロール（大きい番号の場合）
-        if horse_number >= 9:
-            logger.info("Scrolling for larger horse numbers...")
-            await page.evaluate("window.scrollTo(0, 300);")
-            await page.wait_for_timeout(Timeouts.MEDIUM)
-            if horse_number >= 13:
-                await page.evaluate("window.scrollTo(0, 300);")
-                await page.wait_for_timeout(Timeouts.MEDIUM)
-
         # 馬番から買う馬券を選択
         # デバッグ: HTMLとlabelの情報を保存
         try:
@@ -1687,36 +1799,30 @@ async def select_horse_on_page(page: Page, horse_number: int) -> bool:
         except Exception as e:
             logger.warning(f"Failed to save HTML: {e}")
 
-        labels = await page.query_selector_all('label')
-        logger.info(f"Found {len(labels)} labels on page")
+        labels = page.locator('label')
+        label_texts = await labels.all_text_contents()
+        logger.info(f"Found {len(label_texts)} labels on page")
 
         # 最初の30個のlabelのテキストを出力
-        for i in range(min(30, len(labels))):
-            text = await labels[i].text_content()
+        for i, text in enumerate(label_texts[:30]):
             logger.info(f"  Label[{i}]: {text.strip() if text else '(empty)'}")
 
-        # 固定オフセットではなく、より柔軟な方法を試す
-        # まず単勝エリアのlabelを探す
-        found = False
-        for i, label in enumerate(labels):
-            text = await label.text_content()
-            # 馬番が含まれるlabelを探す（例: "1", "2", "14"など）
-            if text and text.strip() == str(horse_number):
-                logger.info(f"Found label for horse #{horse_number} at index {i}")
-                await label.click()
-                logger.info(f"✓ Horse #{horse_number} selected")
-                found = True
-                break
-
-        if not found:
+        # テキストが馬番と完全一致する最初のlabel（例: "1", "2", "14"など）
+        # click()が対象を自動でスクロールして表示する
+        horse_label = labels.filter(has_text=re.compile(rf"^\s*{horse_number}\s*$")).first
+        if await horse_label.count():
+            await horse_label.click()
+            logger.info(f"✓ Horse #{horse_number} selected")
+        else:
             # フォールバック: 旧方式
-            if len(labels) > horse_number + 8:
-                await labels[horse_number + UIIndices.HORSE_LABEL_OFFSET].click()
+            if len(label_texts) > horse_number + UIIndices.HORSE_LABEL_OFFSET:
+                await labels.nth(horse_number + UIIndices.HORSE_LABEL_OFFSET).click()
                 logger.info(f"✓ Horse #{horse_number} selected (fallback method)")
             else:
-                raise Exception(f"Not enough labels found: {len(labels)} < {horse_number + 8}")
+                raise Exception(f"Not enough labels found: {len(label_texts)} < {horse_number + UIIndices.HORSE_LABEL_OFFSET}")
 
-        await page.wait_for_timeout(Timeouts.MEDIUM)
+        # 馬を選択すると「セット」ボタンが使えるようになる
+        await wait_for_button_by_text(page, "セット", mode='equals', selector='button')
         return True
     except Exception as e:
         logger.error(f"❌ Failed to select horse: {e}")
@@ -1726,41 +1832,22 @@ async def select_horse_on_page(page: Page, horse_number: int) -> bool:
 async def complete_bet_input_form(page: Page, bet_amount: int) -> bool:
     """馬券入力フォームを完成させる"""
     try:
-        # セットのクリック
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and text.strip() == "セット":
-                await button.click()
-                logger.info("✓ 'Set' button clicked")
-                break
-
-        await page.wait_for_timeout(Timeouts.MEDIUM)
-
-        # 入力終了のクリック
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and text.strip() == "入力終了":
-                await button.click()
-                logger.info("✓ 'Input End' button clicked")
-                break
-
-        await page.wait_for_timeout(Timeouts.LONG)
-        await take_screenshot(page, "before_amount_input")
-
-        # 購入直前の投票票数の入力
-        inputs = await page.query_selector_all('input')
         bet_units = bet_amount // 100
-
-        await inputs[UIIndices.BET_UNITS_INPUT_1].fill(str(bet_units))
-        await page.wait_for_timeout(Timeouts.SHORT)
-        await inputs[UIIndices.BET_UNITS_INPUT_2].fill(str(bet_units))
-        await page.wait_for_timeout(Timeouts.SHORT)
-        await inputs[UIIndices.BET_AMOUNT_INPUT].fill(str(bet_amount))
+        clicked = await page.evaluate(
+            FILL_BET_FORM_JS,
+            [
+                [UIIndices.BET_UNITS_INPUT_1, UIIndices.BET_UNITS_INPUT_2, UIIndices.BET_AMOUNT_INPUT],
+                bet_units,
+                bet_amount,
+                Timeouts.NETWORKIDLE,
+            ]
+        )
+        if clicked is None:
+            raise Exception("Set/input-end buttons or bet amount inputs not found")
+        logger.info(f"✓ Buttons clicked: {clicked}")
         logger.info(f"✓ Bet amount entered: {bet_amount} yen")
 
-        await page.wait_for_timeout(Timeouts.LONG)
+        await wait_for_button_by_text(page, "購入する", mode='equals', selector='button')
         await take_screenshot(page, "before_purchase")
         return True
     except Exception as e:
@@ -1772,15 +1859,11 @@ async def add_bet_to_cart(page: Page, horse_name: str, bet_amount: int) -> bool:
     """馬券をカートに追加（セット処理）"""
     try:
         # 購入ボタン（実際にはカートに追加）
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and text.strip() == "購入する":
-                await button.click()
-                logger.info("✓ 'Purchase' button clicked")
-                break
+        if await click_button_by_text(page, "購入する", mode='equals', selector='button', visible_only=True):
+            logger.info("✓ 'Purchase' button clicked")
 
-        await page.wait_for_timeout(Timeouts.LONG)
+        # 結果ダイアログ（OKボタン）が表示されるまで待つ
+        await wait_for_button_by_text(page, "OK", mode='equals', selector='button', visible_only=True)
 
         # ダイアログのメッセージを確認
         page_text = await page.text_content('body')
@@ -1809,35 +1892,24 @@ async def add_bet_to_cart(page: Page, horse_name: str, bet_amount: int) -> bool:
             # 成功キーワードがなく、エラーキーワードのみの場合はエラー
             logger.error(f"❌ Purchase failed! Error message detected: {matched_errors}")
             logger.error(f"Page content: {page_text[:1000]}")  # 最初の1000文字を出力
-            await take_screenshot(page, "purchase_failed")
+            await take_screenshot(page, "purchase_failed", fmt='jpeg')
             # エラーダイアログのOKをクリック
-            buttons = await page.query_selector_all('button')
-            for button in buttons:
-                text = await button.text_content()
-                if text and text.strip() == "OK":
-                    await button.click()
-                    break
+            await click_button_by_text(page, "OK", mode='equals', selector='button', visible_only=True)
             return False
 
         # OKボタンをクリック（「セットしました」ダイアログを閉じる）
-        ok_clicked = False
-        buttons = await page.query_selector_all('button')
-        for button in buttons:
-            text = await button.text_content()
-            if text and text.strip() == "OK":
-                await button.click()
-                logger.info("✓ 'Set confirmation' dialog closed")
-                ok_clicked = True
-                break
+        ok_clicked = await click_button_by_text(page, "OK", mode='equals', selector='button', visible_only=True)
+        if ok_clicked:
+            logger.info("✓ 'Set confirmation' dialog closed")
 
         if not ok_clicked:
             logger.error("❌ Set confirmation failed: OK button not found")
-            await take_screenshot(page, "set_no_ok_button")
+            await take_screenshot(page, "set_no_ok_button", fmt='jpeg')
             return False
 
         if not has_success:
             logger.warning("⚠️ Set status unclear - success message not found")
-            await take_screenshot(page, "set_unclear")
+            await take_screenshot(page, "set_unclear", fmt='jpeg')
             return False
 
         # ここまでで「セット」(カートに追加)が完了
@@ -1851,47 +1923,35 @@ async def add_bet_to_cart(page: Page, horse_name: str, bet_amount: int) -> bool:
 async def confirm_and_purchase_bet(page: Page) -> bool:
     """投票内容を確認して購入を実行"""
     try:
-        # 実際の「購入」処理を実行
-        await page.wait_for_timeout(Timeouts.MEDIUM)
+        # 実際の「購入」処理を実行（セット完了ダイアログが閉じて確認ボタンが出るまで待つ）
+        await wait_for_button_by_text(page, "投票", "内容", "確認", selector='button, a, div')
         await take_screenshot(page, "after_set")
 
         # 購入予定リストから「投票内容確認」ボタンを探してクリック
         logger.info("🛒 Looking for 'Confirm Vote Content' button...")
 
-        # より柔軟な検索：テキストに「投票」「内容」「確認」が全て含まれる要素を探す
-        # （改行やスペースに対応するため）
-        confirm_clicked = False
-
-        # まず、通常の方法で試す
-        confirm_buttons = await page.query_selector_all('button, a, div')
-        logger.info(f"Found {len(confirm_buttons)} potential button elements")
-
-        for btn in confirm_buttons:
-            try:
-                text = await btn.text_content()
-                if text:
-                    # 改行・スペースを削除して検索
-                    normalized_text = text.replace('\n', '').replace(' ', '').replace('\t', '')
-                    if "投票内容確認" in normalized_text or ("投票" in normalized_text and "内容" in normalized_text and "確認" in normalized_text):
-                        logger.info(f"✓ Found button with vote confirmation text: '{text[:100]}'")
-                        try:
-                            # JavaScriptクリックを使用
-                            await btn.evaluate("el => el.click()")
-                            logger.info(f"✓ Confirm button clicked successfully")
-                            confirm_clicked = True
-                            break
-                        except Exception as click_error:
-                            logger.warning(f"⚠️ Click failed, trying next match: {click_error}")
-            except Exception as e:
-                pass
+        # テキストに「投票」「内容」「確認」が全て含まれる要素を探す
+        # （改行やスペースは除去して比較される）
+        confirm_text = await click_button_by_text(
+            page, "投票", "内容", "確認", selector='button, a, div', visible_only=True
+        )
+        if confirm_text:
+            logger.info(f"✓ Confirm button clicked: '{confirm_text[:100]}'")
 
-        if not confirm_clicked:
+        if not confirm_text:
             logger.error("❌ Confirm vote content button not found")
-            await take_screenshot(page, "confirm_button_not_found")
+            await take_screenshot(page, "confirm_button_not_found", fmt='jpeg')
             return False
 
-        # 確認画面が表示されるまで待つ
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
+        # 確認画面（購入するボタン）か、購入済みの受付番号が表示されるまで待つ
+        try:
+            await page.wait_for_function(
+                "(args) => document.body.innerText.includes('受付番号') || !!(" + FIND_BUTTON_BY_TEXT_JS + ")(args)",
+                arg=['button, a, div[ng-click]', ["購入する"], 'contains', True],
+                timeout=Timeouts.NETWORKIDLE
+            )
+        except Exception as e:
+            logger.debug(f"Confirmation screen did not appear within timeout: {e}")
         await take_screenshot(page, "purchase_confirmation_screen")
 
         # すでに購入完了しているかチェック（受付番号が表示されている場合）
@@ -1904,32 +1964,18 @@ async def confirm_and_purchase_bet(page: Page) -> bool:
         # 確認画面で「購入する」ボタンを探してクリック
         logger.info("💳 Looking for final purchase button on confirmation screen...")
 
-        final_buttons = await page.query_selector_all('button, a, div[ng-click]')
-        final_purchase_clicked = False
-
-        for btn in final_buttons:
-            try:
-                text = await btn.text_content()
-                if text:
-                    normalized_text = text.replace('\n', '').replace(' ', '').replace('\t', '').strip()
-                    # "購入する" を検索（改行・スペース対応）
-                    if "購入する" in normalized_text:
-                        # ボタンが表示されているか確認
-                        if await btn.is_visible():
-                            # JavaScriptクリックを使用
-                            await btn.evaluate("el => el.click()")
-                            logger.info(f"✓ Final purchase button clicked: {normalized_text}")
-                            final_purchase_clicked = True
-                            # 購入完了画面への遷移を待つ
-                            await page.wait_for_timeout(Timeouts.NAVIGATION)
-                            await take_screenshot(page, "after_final_purchase_click")
-                            break
-            except:
-                pass
+        # "購入する" を検索（改行・スペース対応、表示されている要素のみ）
+        final_text = await click_button_by_text(
+            page, "購入する", selector='button, a, div[ng-click]', visible_only=True
+        )
+        if final_text:
+            logger.info(f"✓ Final purchase button clicked: {final_text}")
+            # 購入完了画面への遷移は verify_purchase_completion で待つ
+            await take_screenshot(page, "after_final_purchase_click")
 
-        if not final_purchase_clicked:
+        if not final_text:
             logger.error("❌ Final purchase button not found on confirmation screen")
-            await take_screenshot(page, "final_purchase_button_not_found")
+            await take_screenshot(page, "final_purchase_button_not_found", fmt='jpeg')
             return False
 
         return True
@@ -1941,8 +1987,13 @@ async def confirm_and_purchase_bet(page: Page) -> bool:
 async def verify_purchase_completion(page: Page, horse_name: str, bet_amount: int) -> bool:
     """購入完了を確認"""
     try:
-        # 購入確認ダイアログの処理
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
+        # 購入完了メッセージが表示されるまで待つ
+        try:
+            await page.wait_for_function(
+                "() => /購入しました|受付/.test(document.body.innerText)", timeout=Timeouts.NETWORKIDLE
+            )
+        except Exception as e:
+            logger.debug(f"Purchase completion message did not appear within timeout: {e}")
         await take_screenshot(page, "final_purchase_confirmation")
 
         # 購入完了のメッセージを確認
@@ -1954,17 +2005,8 @@ async def verify_purchase_completion(page: Page, horse_name: str, bet_amount: in
 
             # 完了ダイアログのOKをクリック（失敗しても購入は成功しているので無視）
             try:
-                final_buttons = await page.query_selector_all('button')
-                for btn in final_buttons:
-                    text = await btn.text_content()
-                    if text and text.strip() == "OK":
-                        if await btn.is_visible():
-                            try:
-                                await btn.click(timeout=5000)
-                                logger.info("✓ Purchase completion dialog closed")
-                            except Exception as click_err:
-                                logger.warning(f"⚠️ OK button click failed (ignored): {click_err}")
-                        break
+                if await click_button_by_text(page, "OK", mode='equals', selector='button', visible_only=True):
+                    logger.info("✓ Purchase completion dialog closed")
             except Exception as dialog_err:
                 logger.warning(f"⚠️ Dialog close failed (ignored): {dialog_err}")
 
@@ -1972,7 +2014,7 @@ async def verify_purchase_completion(page: Page, horse_name: str, bet_amount: in
         else:
             logger.error("❌ Purchase completion message not found")
             logger.error(f"Page text: {page_text_final[:500]}")
-            await take_screenshot(page, "purchase_completion_failed")
+            await take_screenshot(page, "purchase_completion_failed", fmt='jpeg')
             return False
     except Exception as e:
         logger.error(f"❌ Failed to verify purchase completion: {e}")
@@ -1986,8 +2028,7 @@ async def select_horse_and_bet_simple(page: Page, horse_number: int, horse_name:
 
         # 注: 残高チェックはメインページのensure_sufficient_balanceで行っているため、
         # 投票ページでの再チェックは不要（投票ページでは「購入限度額」が表示されないため誤判定の原因になる）
-
-        await page.wait_for_timeout(Timeouts.LONG)
+        # 馬番ラベルの表示は select_horse_on_page 内で待つ
 
         # 1. 馬を選択
         if not await select_horse_on_page(page, horse_number):
@@ -2013,7 +2054,7 @@ async def select_horse_and_bet_simple(page: Page, horse_number: int, horse_name:
 
     except Exception as e:
         logger.error(f"Failed to place bet: {e}")
-        await take_screenshot(page, "bet_error")
+        await take_screenshot(page, "bet_error", fmt='jpeg')
         return False
 
 
@@ -2055,66 +2096,45 @@ async def initialize_browser_and_session(p, credentials):
     """
     ブラウザとセッションを初期化
 
+    永続コンテキスト（output/profile）を使うため、Cookieやキャッシュは
+    ディスク上に残り、次回起動時にそのまま再利用される。
+
     Returns:
-        Tuple[Browser, BrowserContext, Page]: (browser, context, page)
-    """
-    browser = await p.chromium.launch(
+        Tuple[BrowserContext, BrowserContext, Page]: (browser, context, page)
+        永続コンテキストではBrowserオブジェクトが無いため、browserにはcontextを返す
+        （close()でブラウザごと終了する）
+    """
+    profile_dir = Path("output/profile")
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    if any(profile_dir.iterdir()):
+        logger.info("🔄 Reusing persistent browser profile...")
+    else:
+        logger.info("📝 No saved profile found, will login normally")
+
+    context = await p.chromium.launch_persistent_context(
+        user_data_dir=str(profile_dir),
         headless=True,
+        viewport=BROWSER_VIEWPORT,
         args=['--no-sandbox', '--disable-setuid-sandbox']
     )
+    await block_unneeded_resources(context)
 
-    # セッション情報の復元を試みる
-    session_path = "output/session.json"
-    session_exists = Path(session_path).exists()
-
-    if session_exists:
-        logger.info("🔄 Restoring session from saved state...")
-        try:
-            context = await browser.new_context(
-                storage_state=session_path,
-                viewport={'width': 1280, 'height': 720}
-            )
-            logger.info("✓ Session restored successfully")
-        except Exception as e:
-            logger.warning(f"Failed to restore session: {e}")
-            logger.info("Will proceed with fresh login...")
-            context = await browser.new_context(
-                viewport={'width': 1280, 'height': 720}
-            )
-            session_exists = False
-    else:
-        logger.info("📝 No saved session found, will login normally")
-        context = await browser.new_context(
-            viewport={'width': 1280, 'height': 720}
-        )
+    page = context.pages[0] if context.pages else await context.new_page()
 
-    page = await context.new_page()
+    # ログイン状態を確認（Cookieが有効ならログイン済みのページが表示される）
+    await page.goto(IPAT_URL)
+    await page.wait_for_timeout(Timeouts.NAVIGATION)
 
-    # セッションが無い場合のみログイン
-    if not session_exists:
+    # ログインフォーム（INET-ID/加入者番号の入力欄）が表示されている場合はセッション期限切れ
+    needs_login = await page.locator('input[name="inetid"], input[name="i"]').count() > 0
+    if needs_login:
+        logger.info("🔐 Session not available, logging in...")
         await login_simple(page, credentials)
-
-        # ログイン成功後、セッション情報を保存
-        logger.info("💾 Saving session state...")
-        Path(session_path).parent.mkdir(parents=True, exist_ok=True)
-        await context.storage_state(path=session_path)
-        logger.info(f"✓ Session saved to {session_path}")
+        logger.info("✓ Logged in (session is kept in the persistent profile)")
     else:
-        # セッションを使う場合でも、ログイン状態を確認
-        await page.goto(IPAT_URL)
-        await page.wait_for_timeout(Timeouts.NAVIGATION)
-        page_text = await page.evaluate("document.body.innerText")
+        logger.info("✓ Session is still valid")
 
-        # ログインフォームが表示されている場合はセッション期限切れ
-        if "INET-ID" in page_text or "加入者番号" in page_text:
-            logger.warning("⚠️ Session expired, logging in again...")
-            await login_simple(page, credentials)
-            await context.storage_state(path=session_path)
-            logger.info("✓ Session refreshed")
-        else:
-            logger.info("✓ Session is still valid")
-
-    return browser, context, page
+    return context, context, page
 
 
 async def load_and_reconcile_tickets(page: Page, tickets_path: Path, target_date: Optional[str] = None):
@@ -2134,22 +2154,26 @@ async def load_and_reconcile_tickets(page: Page, tickets_path: Path, target_date
     if target_date is None:
         target_date = datetime.now().strftime('%Y%m%d')
 
-    # CSVを読み込む
-    tickets_df = pd.read_csv(tickets_path)
-    logger.info(f"📄 Found {len(tickets_df)} tickets to process from {tickets_path.name}")
-
-    # tickets.csvをTicketオブジェクトに変換
-    tickets = []
-    for _, row in tickets_df.iterrows():
-        ticket = Ticket(
-            racecourse=row['race_course'],
-            race_number=int(row['race_number']),
-            bet_type=row.get('bet_type', '単勝'),  # デフォルト: 単勝
-            horse_number=int(row['horse_number']),
-            horse_name=row['horse_name'],
-            amount=int(row['amount'])
-        )
-        tickets.append(ticket)
+    def load_tickets() -> List[Ticket]:
+        # CSVを読み込み、Ticketオブジェクトに変換
+        tickets_df = read_tickets_csv(tickets_path)
+        logger.info(f"📄 Found {len(tickets_df)} tickets to process from {tickets_path.name}")
+        return [
+            Ticket(racecourse, int(race_number), bet_type, int(horse_number), horse_name, int(amount))
+            for racecourse, race_number, bet_type, horse_number, horse_name, amount
+            in tickets_df[TICKET_COLUMNS].itertuples(index=False, name=None)
+        ]
+
+    # CSV読み込み（別スレッド）と既存投票の取得（IPAT投票履歴チェック - バックアップ）を並行実行
+    fetch_task = asyncio.create_task(fetch_existing_bets(page, date_type="same_day"))
+    try:
+        tickets = await asyncio.to_thread(load_tickets)
+    except BaseException:
+        # 読み込みに失敗したら、呼び出し元がページを使う前に取得を止める
+        fetch_task.cancel()
+        await asyncio.gather(fetch_task, return_exceptions=True)
+        raise
+    existing_bets = await fetch_task
 
     logger.info(f"📄 Loaded {len(tickets)} tickets from CSV")
 
@@ -2158,12 +2182,9 @@ async def load_and_reconcile_tickets(page: Page, tickets_path: Path, target_date
     s3_to_check = []
     try:
         history_service = PurchaseHistoryService()
-        for ticket in tickets:
-            if history_service.is_already_purchased(ticket, target_date):
-                s3_skipped.append(ticket)
-                logger.info(f"✓ SKIP (S3 history): {ticket}")
-            else:
-                s3_to_check.append(ticket)
+        s3_skipped, s3_to_check = history_service.partition_purchased(tickets, target_date)
+        for ticket in s3_skipped:
+            logger.info(f"✓ SKIP (S3 history): {ticket}")
 
         if s3_skipped:
             logger.info(f"📋 S3 history check: {len(s3_skipped)} already purchased, {len(s3_to_check)} to verify with IPAT")
@@ -2172,9 +2193,6 @@ async def load_and_reconcile_tickets(page: Page, tickets_path: Path, target_date
         s3_to_check = tickets
         s3_skipped = []
 
-    # Step 2: 既存の投票を取得（IPAT投票履歴チェック - バックアップ）
-    existing_bets = await fetch_existing_bets(page, date_type="same_day")
-
     # 突合処理（S3でスキップされなかったチケットのみ）
     reconciliation_results = []
 
@@ -2236,15 +2254,18 @@ async def handle_dry_run_mode(page: Page, to_purchase: List[Ticket], reconciliat
     total_cost = sum(t.amount for t in to_purchase)
     logger.warning(f"\nTotal amount that would be spent: {total_cost:,}円")
 
-    # 残高確認（参考情報）
-    current_balance = await get_current_balance(page)
-    logger.warning(f"Current balance: {current_balance:,}円")
+    # 残高確認（参考情報のため、DRY_RUN_SHOW_BALANCE=true の場合のみ）
+    if os.environ.get('DRY_RUN_SHOW_BALANCE', 'false').lower() == 'true':
+        current_balance = await get_current_balance(page)
+        logger.warning(f"Current balance: {current_balance:,}円")
 
-    if current_balance < total_cost:
-        shortage = total_cost - current_balance
-        logger.warning(f"Would need to deposit: {shortage:,}円")
+        if current_balance < total_cost:
+            shortage = total_cost - current_balance
+            logger.warning(f"Would need to deposit: {shortage:,}円")
+        else:
+            logger.warning(f"Balance is sufficient (no deposit needed)")
     else:
-        logger.warning(f"Balance is sufficient (no deposit needed)")
+        logger.warning("Balance check skipped in DRY_RUN (set DRY_RUN_SHOW_BALANCE=true to enable)")
 
     logger.warning("=" * 60)
     logger.warning("🔸 DRY_RUN: Skipping actual bet placement")
@@ -2291,20 +2312,159 @@ async def ensure_sufficient_balance(page: Page, credentials: dict, to_purchase:
         return True
 
 
-async def process_tickets(page: Page, to_purchase: List[Ticket], target_date: Optional[str] = None, slack_service=None):
+async def purchase_ticket(
+    page: Page,
+    ticket: Ticket,
+    ticket_idx: int,
+    total: int,
+    target_date: str,
+    history_service=None,
+    slack_service=None,
+    screen: ScreenState = ScreenState.HOME
+) -> ScreenState:
+    """
+    1枚のチケットを購入（投票画面への移動から照会確認まで）
+
+    Args:
+        page: Playwright page
+        ticket: 購入するチケット
+        ticket_idx: チケットの通し番号（0始まり）
+        total: チケット総数
+        target_date: 対象日（YYYYMMDD形式）
+        history_service: PurchaseHistoryService インスタンス
+        slack_service: SlackService インスタンス（個別購入通知用）
+        screen: 処理開始時の画面
+
+    Returns:
+        処理終了時の画面
+    """
+    try:
+        logger.info(f"\n{'='*60}")
+        logger.info(f"🎫 Purchasing {ticket_idx+1}/{total}: {ticket}")
+        logger.info(f"{'='*60}")
+
+        # 現在の画面が不明な場合のみ戻る（照会確認後は既にメインページにいる）
+        if screen == ScreenState.UNKNOWN:
+            screen = await return_to_vote_start(page)
+
+        # 投票画面へ移動
+        t_start = time.perf_counter()
+        if not await navigate_to_vote_simple(page):
+            logger.error("Failed to navigate to vote page")
+            if history_service:
+                history_service.record_purchase_error(ticket, target_date, "Failed to navigate to vote page")
+            return ScreenState.UNKNOWN
+        t_nav = time.perf_counter()
+
+        # レース選択
+        if not await select_race_simple(page, ticket.racecourse, ticket.race_number):
+            logger.error("Failed to select race")
+            if history_service:
+                history_service.record_purchase_error(ticket, target_date, "Failed to select race")
+            return ScreenState.UNKNOWN
+        t_race = time.perf_counter()
+
+        # 馬選択と投票
+        bet_ok = await select_horse_and_bet_simple(page, ticket.horse_number, ticket.horse_name, ticket.amount)
+        t_bet = time.perf_counter()
+        logger.info(
+            f"⏱️ Ticket {ticket_idx+1} took {t_bet - t_start:.2f}s "
+            f"breakdown nav={t_nav - t_start:.2f} race={t_race - t_nav:.2f} bet={t_bet - t_race:.2f}"
+        )
+
+        if bet_ok:
+            logger.info(f"✅ Ticket {ticket_idx+1} screen confirmation OK")
+
+            # 照会メニューで実際の購入を確認（終了時はメインページに戻っている）
+            logger.info("🔍 Verifying purchase in inquiry menu...")
+            verified, matched_bet = await verify_purchase_in_inquiry(page, ticket, target_date)
+            # 照会に失敗した場合はどの画面にいるか分からないので、次のチケットの前にトップページへ戻る
+            screen = ScreenState.HOME if verified else ScreenState.UNKNOWN
+
+            if verified:
+                logger.info(f"✅ Ticket {ticket_idx+1} VERIFIED in inquiry")
+                # 照会確認済みをS3に記録
+                if history_service:
+                    history_service.record_purchase(ticket, target_date)
+                # bets-liveチャンネルに購入成功通知を送信
+                if slack_service:
+                    slack_service.send_bet_notification(
+                        ticket.racecourse,
+                        ticket.race_number,
+                        ticket.horse_number,
+                        ticket.horse_name,
+                        ticket.amount,
+                        success=True
+                    )
+            else:
+                logger.error(f"⚠️ Ticket {ticket_idx+1} UNVERIFIED - screen showed success but inquiry failed")
+                # 未確認をS3に記録
+                if history_service:
+                    history_service.record_unverified_purchase(ticket, target_date)
+                # 注意: ここではSlack通知は送らない（Lambda handler側で送信する）
+        else:
+            logger.error(f"❌ Ticket {ticket_idx+1} failed at screen level")
+            if history_service:
+                history_service.record_purchase_error(ticket, target_date, "select_horse_and_bet_simple returned False")
+            screen = ScreenState.UNKNOWN
+
+        # 次のチケットのため画面の読み込み完了を待つ
+        await page.wait_for_load_state("domcontentloaded")
+        return screen
+
+    except Exception as e:
+        logger.error(f"Error processing ticket {ticket_idx+1}: {e}")
+        if history_service:
+            history_service.record_purchase_error(ticket, target_date, str(e))
+        return ScreenState.UNKNOWN
+
+
+async def return_to_vote_start(page: Page) -> ScreenState:
+    """
+    次のチケットの投票を始められる画面に戻る
+
+    失敗したチケットの入力（セット済みの買い目など）を次の購入に持ち越さないよう、
+    画面内のボタンではなくトップページを読み込み直す。
+
+    Returns:
+        戻った先の画面
+    """
+    logger.info("🔄 Returning to top page...")
+    await page.goto(IPAT_HOME_URL)
+    await page.wait_for_timeout(Timeouts.NAVIGATION)
+    logger.info("✓ Returned to top page")
+    return ScreenState.HOME
+
+
+async def process_tickets(
+    page: Page,
+    to_purchase: List[Ticket],
+    target_date: Optional[str] = None,
+    slack_service=None,
+    concurrency: Optional[int] = None
+):
     """
     未購入チケットを処理
 
+    concurrencyが2以上の場合は、ログイン済みのstorage_stateを共有する
+    BrowserContextを追加で作成し、asyncio.Queueから各ワーカーが
+    チケットを取り出して並列に購入する。
+
     Args:
         page: Playwright page
         to_purchase: 購入すべきチケットのリスト
         target_date: 対象日（YYYYMMDD形式、Noneの場合は当日）
         slack_service: SlackService インスタンス（個別購入通知用）
+        concurrency: 並列ワーカー数（Noneの場合は環境変数 PURCHASE_CONCURRENCY）
     """
     # target_dateがない場合は当日を使用
     if target_date is None:
         target_date = datetime.now().strftime('%Y%m%d')
 
+    if concurrency is None:
+        concurrency = int(os.environ.get('PURCHASE_CONCURRENCY', Config.PURCHASE_CONCURRENCY))
+    concurrency = max(1, min(concurrency, len(to_purchase)))
+
     # S3履歴サービス（購入成功時に記録）
     history_service = None
     try:
@@ -2312,75 +2472,58 @@ async def process_tickets(page: Page, to_purchase: List[Ticket], target_date: Op
     except Exception as e:
         logger.warning(f"⚠️ S3 history service initialization failed: {e}")
 
+    # キューにチケットを投入
+    queue: asyncio.Queue = asyncio.Queue()
     for ticket_idx, ticket in enumerate(to_purchase):
-        try:
-            logger.info(f"\n{'='*60}")
-            logger.info(f"🎫 Purchasing {ticket_idx+1}/{len(to_purchase)}: {ticket}")
-            logger.info(f"{'='*60}")
-
-            # 各チケット処理の前にトップページに戻る（2つ目以降）
-            if ticket_idx > 0:
-                logger.info("🔄 Returning to top page...")
-                await page.goto(IPAT_HOME_URL)
-                await page.wait_for_timeout(Timeouts.NAVIGATION)
-                logger.info("✓ Returned to top page")
-
-            # 投票画面へ移動
-            if not await navigate_to_vote_simple(page):
-                logger.error("Failed to navigate to vote page")
-                if history_service:
-                    history_service.record_purchase_error(ticket, target_date, "Failed to navigate to vote page")
-                continue
+        queue.put_nowait((ticket_idx, ticket))
 
-            # レース選択
-            if not await select_race_simple(page, ticket.racecourse, ticket.race_number):
-                logger.error("Failed to select race")
-                if history_service:
-                    history_service.record_purchase_error(ticket, target_date, "Failed to select race")
-                continue
-
-            # 馬選択と投票
-            if await select_horse_and_bet_simple(page, ticket.horse_number, ticket.horse_name, ticket.amount):
-                logger.info(f"✅ Ticket {ticket_idx+1} screen confirmation OK")
-
-                # 照会メニューで実際の購入を確認
-                logger.info("🔍 Verifying purchase in inquiry menu...")
-                verified, matched_bet = await verify_purchase_in_inquiry(page, ticket, target_date)
-
-                if verified:
-                    logger.info(f"✅ Ticket {ticket_idx+1} VERIFIED in inquiry")
-                    # 照会確認済みをS3に記録
-                    if history_service:
-                        history_service.record_purchase(ticket, target_date)
-                    # bets-liveチャンネルに購入成功通知を送信
-                    if slack_service:
-                        slack_service.send_bet_notification(
-                            ticket.racecourse,
-                            ticket.race_number,
-                            ticket.horse_number,
-                            ticket.horse_name,
-                            ticket.amount,
-                            success=True
-                        )
-                else:
-                    logger.error(f"⚠️ Ticket {ticket_idx+1} UNVERIFIED - screen showed success but inquiry failed")
-                    # 未確認をS3に記録
-                    if history_service:
-                        history_service.record_unverified_purchase(ticket, target_date)
-                    # 注意: ここではSlack通知は送らない（Lambda handler側で送信する）
-            else:
-                logger.error(f"❌ Ticket {ticket_idx+1} failed at screen level")
-                if history_service:
-                    history_service.record_purchase_error(ticket, target_date, "select_horse_and_bet_simple returned False")
+    async def worker(worker_page: Page):
+        # 追加のワーカーページは空の状態から開始
+        screen = ScreenState.HOME if worker_page is page else ScreenState.UNKNOWN
+        while True:
+            try:
+                ticket_idx, ticket = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            screen = await purchase_ticket(
+                worker_page, ticket, ticket_idx, len(to_purchase), target_date,
+                history_service, slack_service, screen
+            )
 
-            # 次のチケットのため少し待機
-            await page.wait_for_timeout(3000)
+    # 追加のワーカー用にログイン済みセッションを共有するページを用意
+    page_pool = None
+    worker_pages = [page]
+    if concurrency > 1:
+        logger.info(f"🔀 Purchasing with {concurrency} parallel workers")
+        browser = page.context.browser
+        if browser is None:
+            # 永続コンテキストでは同じコンテキスト内にページを追加する
+            for _ in range(concurrency - 1):
+                try:
+                    worker_pages.append(await page.context.new_page())
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to create worker page: {e}")
+                    break
+        else:
+            # ワーカーごとに別コンテキスト（1コンテキスト1ページ）
+            page_pool = await PagePool.create(
+                browser, concurrency - 1,
+                storage_state=await page.context.storage_state(),
+                pages_per_context=1
+            )
+            worker_pages += page_pool.pages
 
-        except Exception as e:
-            logger.error(f"Error processing ticket {ticket_idx+1}: {e}")
-            if history_service:
-                history_service.record_purchase_error(ticket, target_date, str(e))
-            continue
+    # 失敗の記録はメモリ上に溜め、全チケット終了時（例外時も含む）にまとめてS3に保存（購入記録は即時保存）
+    history_batch = history_service.batch() if history_service else contextlib.nullcontext()
+    try:
+        with history_batch:
+            await asyncio.gather(*[worker(worker_page) for worker_page in worker_pages])
+    finally:
+        for worker_page in worker_pages[1:]:
+            if worker_page.context is page.context:
+                await worker_page.close()
+        if page_pool:
+            await page_pool.close()
 
     logger.info("\n🏁 All unpurchased tickets processed")
 
@@ -2439,5 +2582,34 @@ async def main():
         raise
 
 
+async def profiled_main():
+    """
+    main()を実行（PROFILE=1 の場合はpyinstrumentでプロファイル）
+
+    プロファイル結果は output/profile_YYYYMMDD_HHMMSS.html に保存する。
+    """
+    if os.environ.get('PROFILE') != '1':
+        return await main()
+
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        logger.warning("⚠️ PROFILE=1 but pyinstrument is not installed, running without profiling")
+        return await main()
+
+    profiler = Profiler(async_mode='enabled')
+    profiler.start()
+    try:
+        return await main()
+    finally:
+        profiler.stop()
+        profile_path = Path(f"output/profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html")
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profile_path.write_text(profiler.output_html(), encoding='utf-8')
+        logger.info(f"📊 Profile saved: {profile_path}")
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    disable_unused_log_record_fields()
+    # DEBUG=1 の場合はasyncioのデバッグモードで遅いコールバックを警告
+    asyncio.run(profiled_main(), debug=os.environ.get('DEBUG') == '1')
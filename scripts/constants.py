@@ -36,7 +36,7 @@ class UIIndices:
     BET_AMOUNT_INPUT = 11   # 金額入力フィールド
 
     # 馬番ラベルのオフセット
-    HORSE_LABEL_OFFSET = 8  # labels[horse_number + 8] で馬番ラベルにアクセス
+    HORSE_LABEL_OFFSET = 8  # labels[horse_number + 8] で馬番ラベルにアクセス（テキスト一致しない場合のみ）
 
 
 # ============================================================
@@ -65,3 +65,6 @@ class Config:
 
     # セッション保存先
     SESSION_STATE_PATH = "output/session_state.json"
+
+    # 並列購入のワーカー数（環境変数 PURCHASE_CONCURRENCY で上書き可能）
+    PURCHASE_CONCURRENCY = 1
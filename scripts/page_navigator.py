@@ -5,8 +5,9 @@ PageNavigator - Playwright Page操作の抽象化レイヤー
 """
 
 import logging
-from typing import List, Optional
-from playwright.async_api import Page, ElementHandle
+import re
+from typing import List, Optional, Union
+from playwright.async_api import Page, ElementHandle, Locator, TimeoutError as PlaywrightTimeoutError
 
 from constants import Timeouts
 
@@ -23,6 +24,12 @@ class PageNavigator:
         self.page = page
         self.logger = logger or logging.getLogger(__name__)
 
+    def _locator_with_text(self, selector: str, text: str, exact: bool) -> Locator:
+        """selector に一致し、テキスト条件を満たす要素のロケータ（マッチングはブラウザ側で行う、大文字小文字は区別する）"""
+        # has_text に文字列を渡すと大文字小文字を区別しない部分一致になるため、常に正規表現で渡す
+        pattern = re.compile(rf"^\s*{re.escape(text)}\s*$") if exact else re.compile(re.escape(text))
+        return self.page.locator(selector).filter(has_text=pattern).first
+
     async def find_and_click_button(
         self,
         text: str,
@@ -41,20 +48,13 @@ class PageNavigator:
             bool: クリック成功したらTrue
         """
         try:
-            # button要素を全て取得
-            buttons = await self.page.query_selector_all('button')
-
-            for button in buttons:
-                button_text = await button.text_content()
-                if button_text:
-                    button_text = button_text.strip()
-                    # 完全一致 or 部分一致でチェック
-                    if (exact and button_text == text) or (not exact and text in button_text):
-                        self.logger.info(f"✓ Clicking button: {text}")
-                        await button.click()
-                        await self.page.wait_for_timeout(Timeouts.SHORT)
-                        return True
+            # ロケータは表示・操作可能になるまで自動で待機する
+            button = self._locator_with_text('button', text, exact)
+            await button.click(timeout=timeout)
+            self.logger.info(f"✓ Clicked button: {text}")
+            return True
 
+        except PlaywrightTimeoutError:
             self.logger.warning(f"⚠️ Button not found: {text}")
             return False
 
@@ -81,19 +81,27 @@ class PageNavigator:
         Returns:
             bool: クリック成功したらTrue
         """
+        # まずいずれかのタイプの要素が現れるまで待つ（描画前に探して見落とさないように）
+        try:
+            await self._locator_with_text(', '.join(element_types), text, exact).wait_for(
+                state='attached', timeout=timeout
+            )
+        except PlaywrightTimeoutError:
+            self.logger.warning(f"⚠️ Element not found with text: {text}")
+            return False
+        except Exception as e:
+            self.logger.debug(f"Failed to wait for element with text '{text}': {e}")
+            return False
+
+        # 現れたら要素タイプの優先順にクリックする要素を選ぶ（一致しないタイプは待たずに次へ）
         for element_type in element_types:
             try:
-                elements = await self.page.query_selector_all(element_type)
-
-                for element in elements:
-                    element_text = await element.text_content()
-                    if element_text:
-                        element_text = element_text.strip()
-                        if (exact and element_text == text) or (not exact and text in element_text):
-                            self.logger.info(f"✓ Clicking {element_type}: {text}")
-                            await element.click()
-                            await self.page.wait_for_timeout(Timeouts.SHORT)
-                            return True
+                element = self._locator_with_text(element_type, text, exact)
+                if await element.count() == 0:
+                    continue
+                await element.click(timeout=timeout)
+                self.logger.info(f"✓ Clicking {element_type}: {text}")
+                return True
 
             except Exception as e:
                 self.logger.debug(f"Failed to find {element_type} with text '{text}': {e}")
@@ -178,16 +186,10 @@ class PageNavigator:
             ElementHandle: 見つかった要素（失敗時はNone）
         """
         try:
-            elements = await self.page.query_selector_all(selector)
-
-            for element in elements:
-                element_text = await element.text_content()
-                if element_text:
-                    element_text = element_text.strip()
-                    if (exact and element_text == text) or (not exact and text in element_text):
-                        return element
-
-            return None
+            element = self._locator_with_text(selector, text, exact)
+            if await element.count() == 0:
+                return None
+            return await element.element_handle()
 
         except Exception as e:
             self.logger.error(f"❌ Error querying {selector} with text '{text}': {e}")
@@ -195,17 +197,22 @@ class PageNavigator:
 
     async def click_element_with_retry(
         self,
-        element: ElementHandle,
+        element: Union[ElementHandle, Locator],
         retries: int = 3,
-        delay: int = Timeouts.SHORT
+        delay: int = Timeouts.SHORT,
+        max_delay: int = Timeouts.MEDIUM
     ) -> bool:
         """
         要素をリトライ付きでクリック（DOM陳腐化対策）
 
+        DOMが再構築されると古いElementHandleは何度クリックしても失敗するため、
+        Locatorを渡せばクリックのたびに要素を探し直す。待機時間は試行ごとに倍にする。
+
         Args:
-            element: クリックする要素
+            element: クリックする要素（ElementHandle または Locator）
             retries: リトライ回数
-            delay: リトライ間の待機時間（ミリ秒）
+            delay: 最初のリトライ前の待機時間（ミリ秒）
+            max_delay: 待機時間の上限（ミリ秒）
 
         Returns:
             bool: クリック成功したらTrue
@@ -213,12 +220,11 @@ class PageNavigator:
         for attempt in range(retries):
             try:
                 await element.click()
-                await self.page.wait_for_timeout(Timeouts.SHORT)
                 return True
             except Exception as e:
                 if attempt < retries - 1:
                     self.logger.warning(f"⚠️ Click failed (attempt {attempt + 1}/{retries}), retrying...")
-                    await self.page.wait_for_timeout(delay)
+                    await self.page.wait_for_timeout(min(delay * 2 ** attempt, max_delay))
                 else:
                     self.logger.error(f"❌ Click failed after {retries} attempts: {e}")
                     return False
@@ -236,15 +242,8 @@ class PageNavigator:
             List[str]: テキストのリスト
         """
         try:
-            elements = await self.page.query_selector_all(selector)
-            texts = []
-
-            for element in elements:
-                text = await element.text_content()
-                if text:
-                    texts.append(text.strip())
-
-            return texts
+            texts = await self.page.locator(selector).all_text_contents()
+            return [text.strip() for text in texts if text]
 
         except Exception as e:
             self.logger.error(f"❌ Error getting text content for {selector}: {e}")
@@ -5,19 +5,61 @@ Lambda経由でもローカル実行でも同じS3履歴チェックが適用さ
 IPAT投票履歴との二重チェックにより、冪等性を確保。
 """
 
+import gzip
 import json
 import logging
 import os
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from dataclasses import asdict, dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 import boto3
 from botocore.exceptions import ClientError
 
+try:
+    import orjson  # 高速なJSON変換（未インストール時は標準のjsonを使う）
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
+def _loads(body: bytes) -> Any:
+    """S3オブジェクトの本文（UTF-8バイト列）をJSONとして読み込む"""
+    if orjson:
+        return orjson.loads(body)
+    return json.loads(body.decode("utf-8"))
+
+
+def _dumps(data: Any) -> bytes:
+    """S3保存用にJSONを改行・インデント無しのUTF-8バイト列へ変換（日本語はエスケープしない）"""
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_line(data: Any) -> bytes:
+    """JSONL用に1行のJSON（改行付きUTF-8バイト列）へ変換"""
+    return _dumps(data) + b"\n"
+
+
+def _is_write_conflict(error: ClientError) -> bool:
+    """条件付きPUT（IfMatch / IfNoneMatch）が他の書き込みと競合したかどうか"""
+    return error.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+def _is_not_modified(error: ClientError) -> bool:
+    """条件付きGET（IfNoneMatch）で変更が無かった（304）かどうか"""
+    return (
+        error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304
+        or error.response.get("Error", {}).get("Code") in ("304", "NotModified")
+    )
+
+
 @dataclass
 class PurchaseRecord:
     """購入履歴レコード"""
@@ -45,11 +87,22 @@ class PurchaseHistoryService:
     # S3パスプレフィックス
     S3_PREFIX = "purchase-history"
 
-    def __init__(self, bucket_name: Optional[str] = None, region: str = "ap-northeast-1"):
+    # キャッシュする日付数の上限（超えたら最も使われていない日付から破棄）
+    MAX_CACHED_DATES = 30
+
+    # batch中でも即時保存するステータス（購入した可能性がある記録は中断時に失うと二重購入につながる）
+    DURABLE_STATUSES = ("PURCHASED", "UNVERIFIED")
+
+    # リージョンごとのS3クライアント（生成が重いのでインスタンス間・Lambdaのウォームスタート間で共有）
+    _clients: Dict[str, Any] = {}
+
+    def __init__(self, bucket_name: Optional[str] = None, region: str = "ap-northeast-1",
+                 cache_ttl: int = 300):
         """
         Args:
             bucket_name: S3バケット名（Noneの場合は環境変数またはデフォルト）
             region: AWSリージョン
+            cache_ttl: キャッシュした履歴をS3に確認せず使う秒数（過ぎたら条件付きGETで再確認）
         """
         self.bucket_name = (
             bucket_name
@@ -57,19 +110,47 @@ class PurchaseHistoryService:
             or os.environ.get("OUTPUT_BUCKET")
             or self.DEFAULT_BUCKET
         )
-        self.s3_client = boto3.client("s3", region_name=region)
-        self._cache: Dict[str, Dict[str, Any]] = {}  # target_date -> history
+        self.region = region
+        self._s3_client = None  # 最初にS3へアクセスするときに取得
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # target_date -> history（使用順）
+        self._cache_ttl = cache_ttl
+        self._loaded_at: Dict[str, float] = {}  # target_date -> S3から読み込んだ（確認した）時刻
+        self._purchased_keys: Dict[str, Set[Tuple]] = {}  # target_date -> 購入済み（PURCHASED）の5項目キー
+        self._status_counts: Dict[str, Counter] = {}  # target_date -> ステータスごとの件数
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}  # target_date -> 未保存の記録
+        self._shard_keys: Dict[str, List[str]] = {}  # target_date -> 読み込んだ追記分のS3キー
+        self._etags: Dict[str, str] = {}  # target_date -> 読み込んだ tickets.json のETag
+        self._autoflush = True  # Falseの間（batch中）は DURABLE_STATUSES 以外の記録をS3に保存しない
 
         logger.info(f"PurchaseHistoryService initialized with bucket: {self.bucket_name}")
 
+    @classmethod
+    def _get_s3_client(cls, region: str) -> Any:
+        """リージョンのS3クライアントを取得（無ければ生成して共有）"""
+        if region not in cls._clients:
+            cls._clients[region] = boto3.client("s3", region_name=region)
+        return cls._clients[region]
+
+    @property
+    def s3_client(self) -> Any:
+        """S3クライアント（使うまで生成しない）"""
+        if self._s3_client is None:
+            self._s3_client = self._get_s3_client(self.region)
+        return self._s3_client
+
     def _get_s3_key(self, target_date: str) -> str:
         """S3キーを生成（YYYYMMDD形式）"""
         # purchase-history/YYYYMMDD/tickets.json
         return f"{self.S3_PREFIX}/{target_date}/tickets.json"
 
+    def _get_shard_prefix(self, target_date: str) -> str:
+        """追記分（JSONL）のS3キープレフィックスを生成"""
+        # purchase-history/YYYYMMDD/pending/{timestamp}-{uuid}.jsonl
+        return f"{self.S3_PREFIX}/{target_date}/pending/"
+
     def load_history(self, target_date: str, use_cache: bool = True) -> Dict[str, Any]:
         """
-        S3から購入履歴を読み込み
+        S3から購入履歴を読み込み（tickets.json に追記分のJSONLを連結）
 
         Args:
             target_date: 対象日（YYYYMMDD形式）
@@ -78,57 +159,257 @@ class PurchaseHistoryService:
         Returns:
             購入履歴（存在しない場合は空の構造）
         """
-        if use_cache and target_date in self._cache:
+        cached = self._get_fresh_cache(target_date, use_cache)
+        if cached is not None:
+            return cached
+        return self._store_history(target_date, self._fetch_history(target_date))
+
+    def _get_fresh_cache(self, target_date: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+        """S3に確認せず使えるキャッシュがあれば返す"""
+        # 未保存の記録がある場合はS3から読み直すと失われるため常にキャッシュを返す
+        if target_date in self._cache and (
+            target_date in self._pending
+            or (use_cache and time.monotonic() - self._loaded_at.get(target_date, float("-inf")) <= self._cache_ttl)
+        ):
             logger.debug(f"Using cached history for {target_date}")
+            self._cache.move_to_end(target_date)
             return self._cache[target_date]
+        return None
 
+    def _fetch_history(self, target_date: str) -> Tuple[Dict[str, Any], Optional[str], List[str], List[str], List[Dict[str, Any]]]:
+        """
+        S3から tickets.json と新しい追記分を取得（キャッシュの更新は _store_history で行う）
+
+        Returns:
+            (元にする履歴, tickets.json のETag, 読み込み済みの追記分のキー, 新しい追記分のキー, 新しい追記分の記録)
+        """
         key = self._get_s3_key(target_date)
+        cached = self._cache.get(target_date)
+        etag = self._etags.get(target_date) if cached is not None else None
+        known_shard_keys = self._shard_keys.get(target_date, []) if cached is not None else []
 
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
-            history = json.loads(response["Body"].read().decode("utf-8"))
-            logger.info(f"Loaded purchase history from s3://{self.bucket_name}/{key}: {len(history.get('tickets', []))} records")
-            self._cache[target_date] = history
-            return history
-
+            # 読み込み済みなら変更があった時だけ本文を受け取る
+            conditional = {"IfNoneMatch": etag} if etag else {}
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key, **conditional)
+            body = response["Body"].read()
+            # gzip圧縮で保存した履歴は展開する（圧縮前に保存された履歴はそのまま読む）
+            if response.get("ContentEncoding") == "gzip":
+                body = gzip.decompress(body)
+            history = _loads(body)
+            etag = response["ETag"]
+            known_shard_keys = []
         except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                logger.info(f"No purchase history found for {target_date}, starting fresh")
-                empty_history = {
+            if _is_not_modified(e):
+                # tickets.json は前回から変わっていないので、読み込み済みの記録に新しい追記分だけ足す
+                logger.debug(f"Purchase history unchanged since last load: s3://{self.bucket_name}/{key}")
+                history = cached
+            elif e.response["Error"]["Code"] == "NoSuchKey" and cached is not None and etag is None:
+                # 前回も tickets.json が無かった場合も同様に新しい追記分だけ足す
+                history = cached
+            elif e.response["Error"]["Code"] == "NoSuchKey":
+                history = {
                     "target_date": target_date,
                     "tickets": [],
                     "last_updated": None
                 }
-                self._cache[target_date] = empty_history
-                return empty_history
-            logger.error(f"Failed to load purchase history: {e}")
+                etag = None
+                known_shard_keys = []
+            else:
+                logger.error(f"Failed to load purchase history: {e}")
+                raise
+
+        try:
+            shard_keys, shard_records = self._load_shards(target_date, set(known_shard_keys))
+        except ClientError as e:
+            logger.error(f"Failed to load purchase history shards: {e}")
             raise
+        return history, etag, known_shard_keys, shard_keys, shard_records
+
+    def _store_history(self, target_date: str, fetched: Tuple) -> Dict[str, Any]:
+        """_fetch_history の結果をキャッシュに反映"""
+        history, etag, known_shard_keys, shard_keys, shard_records = fetched
+        history["tickets"].extend(shard_records)
+
+        if history["tickets"]:
+            logger.info(
+                f"Loaded purchase history from s3://{self.bucket_name}/{self._get_s3_key(target_date)}: "
+                f"{len(history['tickets'])} records ({len(shard_keys)} new appended files)"
+            )
+        else:
+            logger.info(f"No purchase history found for {target_date}, starting fresh")
+        if etag:
+            self._etags[target_date] = etag
+        else:
+            self._etags.pop(target_date, None)
+        self._cache[target_date] = history
+        self._cache.move_to_end(target_date)
+        self._loaded_at[target_date] = time.monotonic()
+        self._shard_keys[target_date] = known_shard_keys + shard_keys
+        self._purchased_keys[target_date] = {
+            self._record_key(record)
+            for record in history["tickets"]
+            if record.get("status") == "PURCHASED"
+        }
+        self._status_counts[target_date] = Counter(record.get("status") for record in history["tickets"])
+        self._evict_least_recently_used()
+        return history
+
+    def _evict_least_recently_used(self) -> None:
+        """キャッシュが上限を超えたら最も使われていない日付から破棄（未保存の記録がある日付は残す）"""
+        for target_date in list(self._cache):
+            if len(self._cache) <= self.MAX_CACHED_DATES:
+                return
+            if target_date not in self._pending:
+                self._evict(target_date)
+
+    def _evict(self, target_date: str) -> None:
+        """指定日のキャッシュと付随する情報を破棄"""
+        self._cache.pop(target_date, None)
+        self._loaded_at.pop(target_date, None)
+        self._purchased_keys.pop(target_date, None)
+        self._shard_keys.pop(target_date, None)
+        self._status_counts.pop(target_date, None)
+        self._etags.pop(target_date, None)
+
+    def _load_shards(self, target_date: str, known_keys: Set[str] = frozenset()) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """追記分のJSONLを書き込み順に読み込む（追記分は書き換えないため known_keys は読み直さない）"""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        shard_keys = sorted(
+            obj["Key"]
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._get_shard_prefix(target_date))
+            for obj in page.get("Contents", [])
+            if obj["Key"] not in known_keys
+        )
+        records = []
+        for shard_key in shard_keys:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=shard_key)
+            records.extend(_loads(line) for line in response["Body"].read().splitlines() if line.strip())
+        return shard_keys, records
 
-    def save_history(self, target_date: str, history: Dict[str, Any]) -> None:
+    def save_history(self, target_date: str, history: Dict[str, Any]) -> bool:
         """
-        購入履歴をS3に保存
+        購入履歴全体をS3の tickets.json に保存し、読み込み済みの追記分を削除（追記分の集約用）
+
+        読み込み後に他の実行が tickets.json を書き換えていた場合は保存せず、追記分も残す。
 
         Args:
             target_date: 対象日（YYYYMMDD形式）
             history: 購入履歴
+
+        Returns:
+            保存したらTrue（他の書き込みと競合した場合はFalse）
         """
         key = self._get_s3_key(target_date)
         history["last_updated"] = datetime.now(timezone.utc).isoformat()
+        # 読み込んだ版のままの時だけ上書きする（無かった場合は誰も作成していない時だけ作成）
+        etag = self._etags.get(target_date)
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
 
         try:
-            self.s3_client.put_object(
+            response = self.s3_client.put_object(
                 Bucket=self.bucket_name,
                 Key=key,
-                Body=json.dumps(history, ensure_ascii=False, indent=2),
-                ContentType="application/json"
+                Body=gzip.compress(_dumps(history)),
+                ContentType="application/json",
+                ContentEncoding="gzip",
+                **condition
             )
+            self._etags[target_date] = response["ETag"]
             logger.info(f"Saved purchase history to s3://{self.bucket_name}/{key}")
             self._cache[target_date] = history
+            self._pending.pop(target_date, None)
+
+            # tickets.json に取り込んだ追記分を削除（読み込み後に他の実行が追記した分は残る）
+            shard_keys = self._shard_keys.pop(target_date, [])
+            for i in range(0, len(shard_keys), 1000):
+                self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": shard_key} for shard_key in shard_keys[i:i + 1000]]}
+                )
+            return True
 
         except ClientError as e:
+            if _is_write_conflict(e):
+                # 他の実行が先に集約した。次の読み込みでS3から読み直す
+                logger.info(f"Purchase history was updated concurrently, skipping save: s3://{self.bucket_name}/{key}")
+                if target_date not in self._pending:
+                    self._evict(target_date)
+                return False
             logger.error(f"Failed to save purchase history: {e}")
             raise
 
+    def compact(self) -> None:
+        """
+        追記分（JSONL）を tickets.json に集約して削除（読み込みのたびに追記分を読む量が増え続けないように）
+
+        集約の直前にS3から読み直し、その後に追記された分は次回の集約まで残す。
+        """
+        self.flush()
+        for target_date in [target_date for target_date, keys in self._shard_keys.items() if keys]:
+            history = self.load_history(target_date, use_cache=False)
+            if self.save_history(target_date, history):
+                logger.info(f"Compacted purchase history for {target_date}: {len(history['tickets'])} records")
+
+    def flush(self) -> None:
+        """
+        未保存の記録をS3に追記
+
+        S3は追記できないため、未保存の記録だけを1つのJSONLファイルとして新しいキーに保存する。
+        履歴全体を書き直さないので、保存量は履歴の件数によらず新しい記録の件数に比例する。
+        """
+        for target_date in sorted(self._pending):
+            records = self._pending[target_date]
+            timestamp = datetime.now(timezone.utc)
+            key = f"{self._get_shard_prefix(target_date)}{timestamp.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex}.jsonl"
+            try:
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Body=b"".join(_dumps_line(record) for record in records),
+                    ContentType="application/x-ndjson"
+                )
+            except ClientError as e:
+                logger.error(f"Failed to save purchase history: {e}")
+                raise
+            logger.info(f"Appended {len(records)} purchase records to s3://{self.bucket_name}/{key}")
+            self._cache[target_date]["last_updated"] = timestamp.isoformat()
+            self._shard_keys.setdefault(target_date, []).append(key)
+            del self._pending[target_date]
+
+    @contextmanager
+    def batch(self) -> Iterator["PurchaseHistoryService"]:
+        """
+        ブロック内の失敗記録をまとめて追記（終了時・例外時に1回だけPUT）
+
+        購入済み・未確認（DURABLE_STATUSES）の記録はブロック内でも即時に保存する。
+        ブロック内でも is_already_purchased はメモリ上の記録を参照する。
+        終了時には追記分を tickets.json に集約する（集約に失敗しても記録は追記分に残っている）。
+        """
+        previous = self._autoflush
+        self._autoflush = False
+        try:
+            yield self
+        finally:
+            self._autoflush = previous
+            if previous:
+                self.flush()
+                try:
+                    self.compact()
+                except ClientError as e:
+                    logger.warning(f"Failed to compact purchase history, appended records are kept: {e}")
+
+    def _append_record(self, target_date: str, record: Dict[str, Any]) -> None:
+        """レコードを履歴に追加（batch中でなければ、または購入した可能性がある記録なら即時保存）"""
+        history = self.load_history(target_date)
+        history["tickets"].append(record)
+        if record["status"] == "PURCHASED":
+            self._purchased_keys[target_date].add(self._record_key(record))
+        self._status_counts[target_date][record["status"]] += 1
+        self._pending.setdefault(target_date, []).append(record)
+        if self._autoflush or record["status"] in self.DURABLE_STATUSES:
+            self.flush()
+
     def is_already_purchased(self, ticket: Any, target_date: str) -> bool:
         """
         S3履歴で購入済みかチェック
@@ -140,39 +421,54 @@ class PurchaseHistoryService:
         Returns:
             購入済みならTrue
         """
-        history = self.load_history(target_date)
-        tickets = history.get("tickets", [])
-
-        for record in tickets:
-            # 購入成功（PURCHASED）のレコードのみチェック
-            # UNVERIFIED（画面成功・照会失敗）はIPATの履歴チェックに任せる
-            # FAILEDは明確に失敗なのでスキップ
-            if record.get("status") != "PURCHASED":
-                continue
+        self.load_history(target_date)
 
-            if self._matches(ticket, record):
-                logger.info(f"S3 history match found: {ticket.racecourse} {ticket.race_number}R {ticket.horse_number}番")
-                return True
+        # 購入成功（PURCHASED）のレコードのみチェック
+        # UNVERIFIED（画面成功・照会失敗）はIPATの履歴チェックに任せる
+        # FAILEDは明確に失敗なのでスキップ
+        if self._ticket_key(ticket) in self._purchased_keys[target_date]:
+            logger.info(f"S3 history match found: {ticket.racecourse} {ticket.race_number}R {ticket.horse_number}番")
+            return True
 
         return False
 
-    def _matches(self, ticket: Any, record: Dict[str, Any]) -> bool:
+    def partition_purchased(self, tickets: List[Any], target_date: str) -> Tuple[List[Any], List[Any]]:
         """
-        5項目一致判定（既存のTicket.matchesと同じロジック）
+        S3履歴で購入済みのチケットとそれ以外に分ける（is_already_purchased の一括版）
 
         Args:
-            ticket: Ticketオブジェクト
-            record: 購入履歴レコード
+            tickets: Ticketオブジェクトのリスト
+            target_date: 対象日（YYYYMMDD形式）
 
         Returns:
-            一致すればTrue
+            (購入済みのチケット, 未購入のチケット)
         """
+        self.load_history(target_date)
+        purchased_keys = self._purchased_keys[target_date]
+
+        purchased, unpurchased = [], []
+        for ticket, key in zip(tickets, map(self._ticket_key, tickets)):
+            (purchased if key in purchased_keys else unpurchased).append(ticket)
+        return purchased, unpurchased
+
+    def filter_unpurchased(self, tickets: List[Any], target_date: str) -> List[Any]:
+        """S3履歴で購入済みでないチケットだけを返す"""
+        return self.partition_purchased(tickets, target_date)[1]
+
+    @staticmethod
+    def _ticket_key(ticket: Any) -> Tuple:
+        """5項目一致判定用のキー（既存のTicket.matchesと同じ項目）"""
+        return (ticket.racecourse, ticket.race_number, ticket.horse_number, ticket.bet_type, ticket.amount)
+
+    @staticmethod
+    def _record_key(record: Dict[str, Any]) -> Tuple:
+        """購入履歴レコードの5項目一致判定用のキー"""
         return (
-            ticket.racecourse == record.get("race_course") and
-            ticket.race_number == record.get("race_number") and
-            ticket.horse_number == record.get("horse_number") and
-            ticket.bet_type == record.get("bet_type") and
-            ticket.amount == record.get("amount")
+            record.get("race_course"),
+            record.get("race_number"),
+            record.get("horse_number"),
+            record.get("bet_type"),
+            record.get("amount"),
         )
 
     def record_purchase(self, ticket: Any, target_date: str) -> None:
@@ -183,8 +479,6 @@ class PurchaseHistoryService:
             ticket: 購入したTicketオブジェクト
             target_date: 対象日（YYYYMMDD形式）
         """
-        history = self.load_history(target_date)
-
         record = {
             "race_course": ticket.racecourse,
             "race_number": ticket.race_number,
@@ -195,8 +489,7 @@ class PurchaseHistoryService:
             "purchased_at": datetime.now(timezone.utc).isoformat()
         }
 
-        history["tickets"].append(record)
-        self.save_history(target_date, history)
+        self._append_record(target_date, record)
 
         logger.info(f"Recorded purchase: {ticket.racecourse} {ticket.race_number}R {ticket.horse_number}番 {ticket.amount}円")
 
@@ -209,8 +502,6 @@ class PurchaseHistoryService:
             target_date: 対象日（YYYYMMDD形式）
             error_message: エラーメッセージ
         """
-        history = self.load_history(target_date)
-
         record = {
             "race_course": ticket.racecourse,
             "race_number": ticket.race_number,
@@ -222,8 +513,7 @@ class PurchaseHistoryService:
             "error_message": error_message
         }
 
-        history["tickets"].append(record)
-        self.save_history(target_date, history)
+        self._append_record(target_date, record)
 
         logger.warning(f"Recorded purchase error: {ticket.racecourse} {ticket.race_number}R {ticket.horse_number}番 - {error_message}")
 
@@ -235,8 +525,6 @@ class PurchaseHistoryService:
             ticket: 購入を試みたTicketオブジェクト
             target_date: 対象日（YYYYMMDD形式）
         """
-        history = self.load_history(target_date)
-
         record = {
             "race_course": ticket.racecourse,
             "race_number": ticket.race_number,
@@ -248,8 +536,7 @@ class PurchaseHistoryService:
             "note": "Screen showed success but inquiry verification failed"
         }
 
-        history["tickets"].append(record)
-        self.save_history(target_date, history)
+        self._append_record(target_date, record)
 
         logger.warning(f"Recorded unverified purchase: {ticket.racecourse} {ticket.race_number}R {ticket.horse_number}番 - inquiry verification failed")
 
@@ -264,15 +551,12 @@ class PurchaseHistoryService:
             {purchased: int, failed: int, total: int}
         """
         history = self.load_history(target_date)
-        tickets = history.get("tickets", [])
-
-        purchased = sum(1 for t in tickets if t.get("status") == "PURCHASED")
-        failed = sum(1 for t in tickets if t.get("status") == "FAILED")
+        counts = self._status_counts[target_date]
 
         return {
-            "purchased": purchased,
-            "failed": failed,
-            "total": len(tickets)
+            "purchased": counts["PURCHASED"],
+            "failed": counts["FAILED"],
+            "total": len(history.get("tickets", []))
         }
 
     def clear_cache(self, target_date: Optional[str] = None) -> None:
@@ -282,8 +566,8 @@ class PurchaseHistoryService:
         Args:
             target_date: 特定の日付のみクリア（Noneで全クリア）
         """
-        if target_date:
-            self._cache.pop(target_date, None)
-        else:
-            self._cache.clear()
+        # 未保存の記録は先に保存する
+        self.flush()
+        for cached_date in [target_date] if target_date else list(self._cache):
+            self._evict(cached_date)
         logger.debug(f"Cache cleared: {target_date or 'all'}")
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Slack通知機能"""
 import os
+import asyncio
 import logging
 from typing import Optional
 from datetime import datetime
@@ -9,6 +10,38 @@ import json
 
 logger = logging.getLogger(__name__)
 
+# Slackの1メッセージあたりのブロック数上限
+MAX_BLOCKS_PER_MESSAGE = 50
+
+# 通知の間隔が空いても接続を使い回せるようにアイドル接続を保持する秒数
+SLACK_KEEPALIVE_SECONDS = 60
+
+# 1回のSlack API呼び出しのタイムアウト（秒）
+SLACK_TIMEOUT_SECONDS = 10
+
+
+def _header_block(title: str) -> dict:
+    """見出しブロックを作成"""
+    return {"type": "header", "text": {"type": "plain_text", "text": title}}
+
+
+def _fields_block(*fields: tuple) -> dict:
+    """(項目名, 値) の組からフィールド一覧のセクションブロックを作成"""
+    return {
+        "type": "section",
+        "fields": [{"type": "mrkdwn", "text": f"*{label}:*\n{value}"} for label, value in fields]
+    }
+
+
+# 固定の見出しブロック（送信側では変更しないので通知間で共有する）
+DEPOSIT_HEADER = _header_block("💰 入金処理開始")
+DEPOSIT_START_HEADER = _header_block("🏧 入金処理開始")
+ERROR_HEADER = _header_block("⚠️ エラー発生")
+SUMMARY_HEADER = _header_block("📊 投票完了サマリー")
+SESSION_START_HEADER = _header_block("🚀 AKATSUKI BOT セッション開始")
+LOGIN_SUCCESS_HEADER = _header_block("🔐 ログイン成功")
+LOGIN_FAILURE_HEADER = _header_block("❌ ログイン失敗")
+
 
 class SlackNotifier:
     """Slack通知クラス"""
@@ -17,15 +50,103 @@ class SlackNotifier:
         self.token = token
         self.channel_id = channel_id
         self.base_url = "https://slack.com/api"
+        self._headers = {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json"
+        }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: set = set()  # まとめ送信していないときの送信中タスク
+        self._interval = 2.0
+        
+    def start_batching(self, interval: float = 2.0):
+        """キュー経由のまとめ送信を開始（投票処理をSlackのHTTP待ちで止めない）"""
+        if self._worker is None:
+            self._interval = interval
+            self._queue = asyncio.Queue(maxsize=1000)
+            self._worker = asyncio.create_task(self._drain_queue(interval))
+    
+    async def stop_batching(self):
+        """キューに残っている通知と送信中の通知を送り切ってまとめ送信を終了"""
+        if self._worker is not None:
+            await self._queue.put(None)
+            await self._worker
+            self._worker = None
+            self._queue = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+    
+    async def flush(self):
+        """キューに残っている通知と送信中の通知を送り切る（まとめ送信中なら再開する）"""
+        batching = self._worker is not None
+        await self.stop_batching()
+        if batching:
+            self.start_batching(self._interval)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Slack API用のHTTPセッション（接続・TLSセッションを使い回す）"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                connector=aiohttp.TCPConnector(limit=10, ttl_dns_cache=300, keepalive_timeout=SLACK_KEEPALIVE_SECONDS),
+                timeout=aiohttp.ClientTimeout(total=SLACK_TIMEOUT_SECONDS)
+            )
+        return self._session
+    
+    async def close(self):
+        """残っている通知を送り切ってからHTTPセッションを閉じる"""
+        await self.stop_batching()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def queue_message(self, text: str, blocks: Optional[list] = None):
+        """まとめ送信中はキューに積み、そうでなければバックグラウンドで即時送信（どちらも送信完了を待たない）"""
+        if self._queue is not None:
+            await self._queue.put((text, blocks or []))
+        else:
+            task = asyncio.create_task(self.send_message(text, blocks))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+    
+    async def _drain_queue(self, interval: float):
+        """一定間隔でキューの通知を1メッセージにまとめて送信"""
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            items = [item]
+            await asyncio.sleep(interval)
+            while not self._queue.empty():
+                next_item = self._queue.get_nowait()
+                if next_item is None:
+                    stopping = True
+                    break
+                items.append(next_item)
+            await self._send_batch(items)
+    
+    async def _send_batch(self, items: list):
+        """複数の通知をブロック上限内で1メッセージにまとめて送信"""
+        # 代替テキストは分割した各メッセージに含まれる通知の分だけにする
+        texts, blocks = [], []
+        for item_text, item_blocks in items:
+            # テキストだけの通知はブロックにしないとまとめたメッセージに表示されない
+            item_blocks = item_blocks or [{"type": "section", "text": {"type": "mrkdwn", "text": item_text}}]
+            if blocks and len(blocks) + 1 + len(item_blocks) > MAX_BLOCKS_PER_MESSAGE:
+                await self.send_message("\n".join(texts), blocks)
+                texts, blocks = [], []
+            if blocks:
+                blocks.append({"type": "divider"})
+            texts.append(item_text)
+            blocks.extend(item_blocks)
+        if blocks:
+            await self.send_message("\n".join(texts), blocks)
         
     async def send_message(self, text: str, blocks: Optional[list] = None) -> bool:
         """Slackにメッセージを送信"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
-            
             data = {
                 "channel": self.channel_id,
                 "text": text
@@ -34,20 +155,18 @@ class SlackNotifier:
             if blocks:
                 data["blocks"] = blocks
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/chat.postMessage",
-                    headers=headers,
-                    json=data
-                ) as response:
-                    result = await response.json()
-                    
-                    if result.get("ok"):
-                        logger.info(f"Slack message sent successfully")
-                        return True
-                    else:
-                        logger.error(f"Slack API error: {result.get('error', 'Unknown error')}")
-                        return False
+            async with self._get_session().post(
+                f"{self.base_url}/chat.postMessage",
+                json=data
+            ) as response:
+                result = await response.json()
+                
+                if result.get("ok"):
+                    logger.info(f"Slack message sent successfully")
+                    return True
+                else:
+                    logger.error(f"Slack API error: {result.get('error', 'Unknown error')}")
+                    return False
                         
         except Exception as e:
             logger.error(f"Failed to send Slack message: {e}")
@@ -56,34 +175,16 @@ class SlackNotifier:
     async def send_deposit_notification(self, amount: int, balance_before: int, balance_after: int):
         """入金通知を送信"""
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": "💰 入金処理開始"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*入金額:*\n¥{amount:,}"
-                    },
-                    {
-                        "type": "mrkdwn", 
-                        "text": f"*残高（入金前）:*\n¥{balance_before:,}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*残高（入金後）:*\n¥{balance_after:,}"
-                    }
-                ]
-            }
+            DEPOSIT_HEADER,
+            _fields_block(
+                ("入金額", f"¥{amount:,}"),
+                ("残高（入金前）", f"¥{balance_before:,}"),
+                ("残高（入金後）", f"¥{balance_after:,}"),
+            )
         ]
         
         text = f"入金処理: ¥{amount:,} (残高: ¥{balance_before:,} → ¥{balance_after:,})"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_bet_notification(self, racecourse: str, race_number: int, 
                                   horse_number: int, horse_name: str, amount: int, status: str = "開始"):
@@ -91,246 +192,111 @@ class SlackNotifier:
         emoji = "🎯" if status == "開始" else "✅" if status == "完了" else "❌"
         
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"{emoji} 投票{status}"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*競馬場:*\n{racecourse}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*レース:*\n{race_number}R"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*馬番:*\n{horse_number}番"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*馬名:*\n{horse_name}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*投票額:*\n¥{amount:,}"
-                    }
-                ]
-            }
+            _header_block(f"{emoji} 投票{status}"),
+            _fields_block(
+                ("競馬場", racecourse),
+                ("レース", f"{race_number}R"),
+                ("馬番", f"{horse_number}番"),
+                ("馬名", horse_name),
+                ("投票額", f"¥{amount:,}"),
+            )
         ]
         
         text = f"{status}: {racecourse} {race_number}R {horse_number}番 {horse_name} ¥{amount:,}"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_error_notification(self, error_type: str, error_message: str):
         """エラー通知を送信"""
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": "⚠️ エラー発生"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*エラータイプ:*\n{error_type}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*詳細:*\n{error_message}"
-                    }
-                ]
-            }
+            ERROR_HEADER,
+            _fields_block(
+                ("エラータイプ", error_type),
+                ("詳細", error_message),
+            )
         ]
         
         text = f"エラー: {error_type} - {error_message}"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_summary_notification(self, total_bets: int, total_amount: int, final_balance: int):
         """実行完了サマリー通知を送信"""
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": "📊 投票完了サマリー"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*総投票数:*\n{total_bets}件"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*総投票額:*\n¥{total_amount:,}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*最終残高:*\n¥{final_balance:,}"
-                    }
-                ]
-            }
+            SUMMARY_HEADER,
+            _fields_block(
+                ("総投票数", f"{total_bets}件"),
+                ("総投票額", f"¥{total_amount:,}"),
+                ("最終残高", f"¥{final_balance:,}"),
+            )
         ]
         
         text = f"投票完了: {total_bets}件 総額¥{total_amount:,} 残高¥{final_balance:,}"
         await self.send_message(text, blocks)
     
-    async def send_session_start_notification(self):
-        """セッション開始通知を送信"""
-        from datetime import datetime
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    async def send_session_start_notification(self, now: Optional[datetime] = None):
+        """セッション開始通知を送信（now を渡すと呼び出し側で取得した時刻を使う）"""
+        current_time = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
         
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": "🚀 AKATSUKI BOT セッション開始"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*開始時刻:*\n{current_time}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": "*状態:*\n稼働中"
-                    }
-                ]
-            }
+            SESSION_START_HEADER,
+            _fields_block(
+                ("開始時刻", current_time),
+                ("状態", "稼働中"),
+            )
         ]
         
         text = f"AKATSUKI BOT セッション開始 - {current_time}"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_login_notification(self, success: bool, duration: float = None, error_message: str = None):
         """ログイン通知を送信"""
         if success:
             blocks = [
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "🔐 ログイン成功"
-                    }
-                },
-                {
-                    "type": "section",
-                    "fields": [
-                        {
-                            "type": "mrkdwn",
-                            "text": "*状態:*\n認証完了"
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": f"*処理時間:*\n{duration:.1f}秒" if duration else "*処理時間:*\n-"
-                        }
-                    ]
-                }
+                LOGIN_SUCCESS_HEADER,
+                _fields_block(
+                    ("状態", "認証完了"),
+                    ("処理時間", f"{duration:.1f}秒" if duration else "-"),
+                )
             ]
             text = f"ログイン成功 ({duration:.1f}秒)" if duration else "ログイン成功"
         else:
             blocks = [
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "❌ ログイン失敗"
-                    }
-                },
-                {
-                    "type": "section",
-                    "fields": [
-                        {
-                            "type": "mrkdwn",
-                            "text": "*状態:*\n認証エラー"
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": f"*エラー:*\n{error_message}" if error_message else "*エラー:*\n不明"
-                        }
-                    ]
-                }
+                LOGIN_FAILURE_HEADER,
+                _fields_block(
+                    ("状態", "認証エラー"),
+                    ("エラー", error_message or "不明"),
+                )
             ]
             text = f"ログイン失敗: {error_message}" if error_message else "ログイン失敗"
         
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
-    async def send_balance_notification(self, balance: int, context: str = "確認"):
-        """残高通知を送信"""
+    async def send_balance_notification(self, balance: int, context: str = "確認",
+                                        now: Optional[datetime] = None):
+        """残高通知を送信（now を渡すと呼び出し側で取得した時刻を使う）"""
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"💰 残高{context}"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*現在残高:*\n¥{balance:,}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*確認時刻:*\n{datetime.now().strftime('%H:%M:%S')}"
-                    }
-                ]
-            }
+            _header_block(f"💰 残高{context}"),
+            _fields_block(
+                ("現在残高", f"¥{balance:,}"),
+                ("確認時刻", (now or datetime.now()).strftime('%H:%M:%S')),
+            )
         ]
         
         text = f"残高{context}: ¥{balance:,}"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_deposit_start_notification(self, amount: int, current_balance: int):
         """入金開始通知を送信"""
         blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": "🏧 入金処理開始"
-                }
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*現在残高:*\n¥{current_balance:,}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*入金予定額:*\n¥{amount:,}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*入金後予定残高:*\n¥{current_balance + amount:,}"
-                    }
-                ]
-            }
+            DEPOSIT_START_HEADER,
+            _fields_block(
+                ("現在残高", f"¥{current_balance:,}"),
+                ("入金予定額", f"¥{amount:,}"),
+                ("入金後予定残高", f"¥{current_balance + amount:,}"),
+            )
         ]
         
         text = f"入金開始: ¥{amount:,} (現在残高: ¥{current_balance:,})"
-        await self.send_message(text, blocks)
+        await self.queue_message(text, blocks)
     
     async def send_navigation_notification(self, page_name: str, success: bool = True):
         """ページ遷移通知を送信"""
@@ -347,4 +313,4 @@ class SlackNotifier:
         ]
         
         text = f"{page_name}へ{'遷移成功' if success else '遷移失敗'}"
-        await self.send_message(text, blocks)
\ No newline at end of file
+        await self.queue_message(text, blocks)
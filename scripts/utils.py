@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 """ユーティリティ関数"""
 import os
+import re
+import time
+import random
 import asyncio
+import itertools
+import weakref
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Literal
+import json
+import functools
 import logging
+import logging.handlers
+import queue
+import atexit
+import threading
+import boto3
 from playwright.async_api import Page, Error as PlaywrightError
 
 logger = logging.getLogger(__name__)
 
+# ファイルログのフォーマッタ（全ロガーで共有）
+FILE_LOG_FORMATTER = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%dT%H:%M:%S'
+)
+
 
 class RetryConfig:
     """リトライ設定"""
@@ -17,118 +35,411 @@ class RetryConfig:
     MAX_RETRIES = 3 if os.environ.get('ENV', 'development') == 'production' else 1
     RETRY_DELAY = 5  # seconds
     EXPONENTIAL_BACKOFF = True
+    MAX_DELAY = 30  # 待機時間の上限（秒）
+    JITTER = 0.5  # 待機時間を ±50% の範囲でばらつかせる（同時に失敗した処理が一斉に再試行しないように）
+    # 再試行しても結果が変わらないプログラムの誤り（CancelledError 等は Exception ではないのでそもそも捕捉しない）
+    UNRECOVERABLE_EXCEPTIONS = (TypeError, AttributeError, NameError)
+
+
+# Secrets Manager の取得結果を再利用する秒数（Lambdaのウォームスタート間も有効）
+SECRET_CACHE_TTL = int(os.environ.get('SECRET_CACHE_TTL', '3600'))
+
+# secret_id → (取得時刻, パース済みシークレット)
+_secret_cache: Dict[str, Any] = {}
+
+
+@functools.lru_cache(maxsize=1)
+def _secrets_manager_client():
+    """Secrets Managerクライアント（プロセス内で使い回す）"""
+    return boto3.client('secretsmanager', region_name=os.environ.get('AWS_DEFAULT_REGION', 'ap-northeast-1'))
+
+
+def fetch_secret(secret_id: str) -> dict:
+    """シークレットを取得してJSONとしてパース（SECRET_CACHE_TTL 秒以内は再取得しない）"""
+    now = time.monotonic()
+    cached = _secret_cache.get(secret_id)
+    if cached and now - cached[0] < SECRET_CACHE_TTL:
+        return cached[1]
+    response = _secrets_manager_client().get_secret_value(SecretId=secret_id)
+    secrets = json.loads(response['SecretString'])
+    _secret_cache[secret_id] = (now, secrets)
+    return secrets
+
+
+def _is_target_closed(error: Exception) -> bool:
+    """ページ・ブラウザが閉じられたことによるPlaywrightのエラーか（同じページでは再試行しても成功しない）"""
+    return isinstance(error, PlaywrightError) and "has been closed" in str(error)
 
 
 async def retry_async(func, *args, max_retries: int = RetryConfig.MAX_RETRIES, 
-                     delay: int = RetryConfig.RETRY_DELAY, **kwargs):
-    """非同期関数のリトライラッパー"""
+                     delay: int = RetryConfig.RETRY_DELAY, max_delay: float = RetryConfig.MAX_DELAY,
+                     jitter: float = RetryConfig.JITTER, retry_on: tuple = (Exception,), **kwargs):
+    """
+    非同期関数のリトライラッパー（上限付き指数バックオフ＋ジッター）
+
+    retry_on に含まれない例外、RetryConfig.UNRECOVERABLE_EXCEPTIONS、ページが閉じられたエラーは
+    再試行せずにそのまま送出する。
+    """
     last_exception = None
+    # 設定はループに入る前に一度だけ読む
+    use_backoff = RetryConfig.EXPONENTIAL_BACKOFF
+    unrecoverable = RetryConfig.UNRECOVERABLE_EXCEPTIONS
     
     for attempt in range(max_retries):
         try:
             return await func(*args, **kwargs)
         except Exception as e:
+            if (isinstance(e, unrecoverable) or not isinstance(e, retry_on)
+                    or _is_target_closed(e)):
+                logger.error("Attempt %d/%d failed with a non-retryable error, not retrying: %s", attempt + 1, max_retries, e)
+                raise
             last_exception = e
-            logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
+            logger.warning("Attempt %d/%d failed: %s", attempt + 1, max_retries, e)
             
             if attempt < max_retries - 1:
-                wait_time = delay * (2 ** attempt if RetryConfig.EXPONENTIAL_BACKOFF else 1)
-                logger.info(f"Waiting {wait_time} seconds before retry...")
+                # ジッターを掛けてから上限で切る（上限を超えて待たないように）
+                base_wait = delay * (2 ** attempt if use_backoff else 1)
+                wait_time = min(max_delay, base_wait * (1 + random.uniform(-jitter, jitter)))
+                logger.info("Waiting %.1f seconds before retry...", wait_time)
                 await asyncio.sleep(wait_time)
     
-    logger.error(f"All {max_retries} attempts failed")
+    logger.error("All %d attempts failed", max_retries)
     raise last_exception
 
 
+# 作成済みのディレクトリ（2回目以降は mkdir を呼ばない）
+_ensured_dirs = set()
+
+
+def _ensure_dir(directory: str) -> None:
+    """ディレクトリを作成（プロセス内で1回だけ）"""
+    if directory not in _ensured_dirs:
+        os.makedirs(directory, exist_ok=True)
+        _ensured_dirs.add(directory)
+
+
+# スクリーンショットのファイル名用タイムスタンプ（同じ秒の間は整形済みの文字列を使い回す）
+_last_timestamp_sec = 0
+_last_timestamp_str = ""
+# 同じ秒に複数枚撮っても上書きしないための連番
+_screenshot_counter = itertools.count()
+
+
+def _screenshot_timestamp() -> str:
+    """ファイル名用のタイムスタンプ（YYYYmmdd_HHMMSS）"""
+    global _last_timestamp_sec, _last_timestamp_str
+    sec = int(time.time())
+    if sec != _last_timestamp_sec:
+        _last_timestamp_sec = sec
+        _last_timestamp_str = time.strftime("%Y%m%d_%H%M%S", time.localtime(sec))
+    return _last_timestamp_str
+
+
 async def take_screenshot(page: Page, name: str = "error", 
-                         directory: str = "output/screenshots") -> Optional[str]:
-    """エラー時のスクリーンショット取得"""
+                         directory: str = "output/screenshots",
+                         full_page: bool = True,
+                         fmt: Literal['png', 'jpeg'] = 'png') -> Optional[str]:
+    """スクリーンショット取得（full_page=False で表示範囲のみ、fmt='jpeg' で軽いJPEG）"""
     try:
         # スクリーンショット保存ディレクトリ作成
-        screenshot_dir = Path(directory)
-        screenshot_dir.mkdir(parents=True, exist_ok=True)
+        _ensure_dir(directory)
         
-        # ファイル名生成
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{name}_{timestamp}.png"
-        filepath = screenshot_dir / filename
+        # ファイル名生成（エラー時に呼ばれるので Path を介さず文字列で組み立てる）
+        extension = "jpg" if fmt == 'jpeg' else "png"
+        filename = f"{name}_{_screenshot_timestamp()}_{next(_screenshot_counter)}.{extension}"
+        filepath = os.path.join(directory, filename)
         
         # スクリーンショット撮影
-        await page.screenshot(path=str(filepath), full_page=True)
-        logger.info(f"Screenshot saved: {filepath}")
+        if fmt == 'jpeg':
+            await page.screenshot(path=filepath, full_page=full_page, type='jpeg', quality=60)
+        else:
+            await page.screenshot(path=filepath, full_page=full_page, type='png')
+        logger.info("Screenshot saved: %s", filepath)
         
-        return str(filepath)
+        return filepath
         
     except Exception as e:
-        logger.error(f"Failed to take screenshot: {e}")
+        logger.error("Failed to take screenshot: %s", e)
         return None
 
 
+# バックグラウンドで取得中のスクリーンショット（完了前にGCされないよう参照を保持）
+_background_screenshots = set()
+
+
+def take_screenshot_in_background(page: Page, name: str = "error",
+                                  directory: str = "output/screenshots") -> None:
+    """エラー時のスクリーンショットを完了を待たずに取得（診断用なので後続の処理を止めない）"""
+    task = asyncio.create_task(take_screenshot(page, name, directory, fmt='jpeg'))
+    _background_screenshots.add(task)
+    task.add_done_callback(_background_screenshots.discard)
+
+
+async def wait_for_background_screenshots() -> None:
+    """取得中のバックグラウンドスクリーンショットの完了を待つ（ページ・ブラウザを閉じる前に呼ぶ）"""
+    if _background_screenshots:
+        await asyncio.gather(*_background_screenshots, return_exceptions=True)
+
+
+# ファイル名に使えない（使いにくい）文字の並び
+_SLUG_RE = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+def _slug(text: str, max_length: int = 40) -> str:
+    """セレクタ等をファイル名に使える短い文字列に変換"""
+    return _SLUG_RE.sub('_', text)[:max_length]
+
+
+# クリック・入力失敗時のスクリーンショットを同じページで撮り直さない間隔（秒）
+ACTION_ERROR_SCREENSHOT_INTERVAL = 10
+# ページごとの直前のクリック・入力失敗時スクリーンショットの時刻
+_last_action_error_screenshot = weakref.WeakKeyDictionary()
+
+
+async def _take_action_error_screenshot(page: Page, name: str) -> None:
+    """クリック・入力失敗時の診断用スクリーンショット（表示範囲のみ、同じページでは間隔を空ける）"""
+    now = time.monotonic()
+    last = _last_action_error_screenshot.get(page)
+    if last is not None and now - last < ACTION_ERROR_SCREENSHOT_INTERVAL:
+        logger.debug("Skipping screenshot '%s' (taken %.1fs ago on this page)", name, now - last)
+        return
+    _last_action_error_screenshot[page] = now
+    await take_screenshot(page, name, full_page=False, fmt='jpeg')
+
+
 async def wait_and_click(page: Page, selector: str, timeout: int = 30000) -> bool:
-    """要素を待機してクリック"""
+    """要素を待機してクリック（click自体が表示・有効になるまで待つ）"""
     try:
-        await page.wait_for_selector(selector, timeout=timeout)
-        await page.click(selector)
+        await page.click(selector, timeout=timeout)
         return True
     except PlaywrightError as e:
-        logger.error(f"Failed to click selector '{selector}': {e}")
-        await take_screenshot(page, f"click_error_{selector.replace(' ', '_')}")
+        logger.error("Failed to click selector '%s': %s", selector, e)
+        await _take_action_error_screenshot(page, f"click_error_{_slug(selector)}")
         return False
 
 
 async def wait_and_fill(page: Page, selector: str, value: str, timeout: int = 30000) -> bool:
-    """要素を待機して入力"""
+    """要素を待機して入力（fill自体が表示・編集可能になるまで待つ）"""
     try:
-        await page.wait_for_selector(selector, timeout=timeout)
-        await page.fill(selector, value)
+        await page.fill(selector, value, timeout=timeout)
         return True
     except PlaywrightError as e:
-        logger.error(f"Failed to fill selector '{selector}': {e}")
-        await take_screenshot(page, f"fill_error_{selector.replace(' ', '_')}")
+        logger.error("Failed to fill selector '%s': %s", selector, e)
+        await _take_action_error_screenshot(page, f"fill_error_{_slug(selector)}")
         return False
 
 
-async def safe_navigate(page: Page, url: str, timeout: int = 60000) -> bool:
-    """安全なページ遷移"""
+async def safe_navigate(page: Page, url: str, timeout: int = 60000,
+                        wait_until: str = 'domcontentloaded') -> bool:
+    """安全なページ遷移（networkidle は常時接続のあるページで待ち続けるため既定では使わない）"""
     try:
-        response = await page.goto(url, wait_until='networkidle', timeout=timeout)
+        response = await page.goto(url, wait_until=wait_until, timeout=timeout)
         if response and response.status >= 400:
-            logger.error(f"HTTP error {response.status} when navigating to {url}")
+            logger.error("HTTP error %s when navigating to %s", response.status, url)
             return False
         return True
     except Exception as e:
-        logger.error(f"Navigation failed to {url}: {e}")
-        await take_screenshot(page, "navigation_error")
+        logger.error("Navigation failed to %s: %s", url, e)
+        await take_screenshot(page, "navigation_error", fmt='jpeg')
         return False
 
 
+async def wait_for_any(page: Page, selectors: List[str], timeout: int = 30000) -> Optional[str]:
+    """複数のセレクタのうち最初に表示されたものを待機（分岐点用）"""
+    tasks = {
+        asyncio.create_task(page.wait_for_selector(selector, state="visible", timeout=timeout)): selector
+        for selector in selectors
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return tasks[task]
+        logger.warning("None of the selectors became visible within %sms: %s", timeout, selectors)
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# 読み込まないサブリソース（スタイルシートは表示判定に影響するため残す）
+BLOCKED_RESOURCE_TYPES = ("image", "font", "media")
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net")
+# ヘッドレスでは描画結果を見ないため小さめのビューポートで描画コストを抑える
+BROWSER_VIEWPORT = {'width': 1024, 'height': 600}
+
+
+async def block_unneeded_resources(context) -> None:
+    """画像・フォント・メディア・解析タグの読み込みを中止してページ読み込みを軽くする"""
+    async def _block(route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+            host in request.url for host in BLOCKED_HOSTS
+        ):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", _block)
+
+
+async def _abort_stylesheet(route) -> None:
+    if route.request.resource_type == "stylesheet":
+        await route.abort()
+    else:
+        await route.fallback()
+
+
+async def block_stylesheets(page: Page) -> None:
+    """スタイルシートの読み込みも止める（表示判定に頼らないログインフォーム入力中だけ使う）"""
+    await page.unroute("**/*", _abort_stylesheet)
+    await page.route("**/*", _abort_stylesheet)
+
+
+async def unblock_stylesheets(page: Page) -> None:
+    """block_stylesheets を解除する"""
+    await page.unroute("**/*", _abort_stylesheet)
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    書き込みをバッファし、一定間隔でまとめてファイルに書き出すローテーション付きハンドラ
+
+    WARNING以上のレコードはすぐに書き出す。ファイルサイズは自前で数える
+    （TextIOWrapper.tell() はバッファを書き出してしまうため）。
+    """
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, *args, flush_interval: float = 0.5, **kwargs):
+        self._size = 0
+        self._stop_flushing = threading.Event()
+        super().__init__(*args, **kwargs)
+        threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True).start()
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=self.BUFFER_SIZE,
+                      encoding=self.encoding, errors=self.errors)
+        self._size = os.fstat(stream.fileno()).st_size
+        return stream
+
+    def emit(self, record):
+        # レコードの整形は1回だけにし、その長さでローテーションを判定する
+        # （RotatingFileHandler.shouldRollover は判定のためだけに整形するため使わない）
+        try:
+            msg = self.format(record) + self.terminator
+            size = len(msg.encode(self.encoding or "utf-8"))
+            if self.stream is None:
+                self.stream = self._open()
+            if 0 < self.maxBytes <= self._size + size and self._size > 0:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(msg)
+            self._size += size
+            if record.levelno >= logging.WARNING:
+                self.stream.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _flush_periodically(self, interval: float):
+        while not self._stop_flushing.wait(interval):
+            with self.lock:
+                if self.stream is not None:
+                    self.stream.flush()
+
+    def close(self):
+        self._stop_flushing.set()
+        super().close()
+
+
+class PagePool:
+    """
+    ログイン済みセッションを共有するページのプール
+
+    コンテキスト・ページは作成時にまとめて用意する（ワーカーは pages から1枚ずつ使い続ける）。
+    """
+
+    def __init__(self):
+        self.contexts: List[Any] = []
+        self.pages: List[Page] = []
+
+    @classmethod
+    async def create(cls, browser, size: int, storage_state: Optional[Dict[str, Any]] = None,
+                     pages_per_context: int = 2) -> "PagePool":
+        """size枚のページを用意したプールを作成（作成に失敗したら用意できた分だけで返す）"""
+        pool = cls()
+        try:
+            while len(pool.pages) < size:
+                context = await browser.new_context(storage_state=storage_state, viewport=BROWSER_VIEWPORT)
+                await block_unneeded_resources(context)
+                pool.contexts.append(context)
+                for _ in range(min(pages_per_context, size - len(pool.pages))):
+                    pool.pages.append(await context.new_page())
+        except Exception as e:
+            logger.warning("Failed to create pooled page (%d/%d created): %s", len(pool.pages), size, e)
+        return pool
+
+    async def close(self) -> None:
+        """プールのコンテキストをすべて閉じる"""
+        for context in self.contexts:
+            await context.close()
+        self.contexts.clear()
+        self.pages.clear()
+
+
+def disable_unused_log_record_fields() -> None:
+    """
+    ログレコードごとのスレッド・プロセス情報の取得を止める（ボットのフォーマットでは使わないため）
+
+    プロセス全体のロガーに影響するので、ボットを直接実行するエントリポイントでだけ呼ぶ。
+    """
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+
 def create_logs_directory():
     """ログディレクトリの作成"""
-    logs_dir = Path("logs")
-    logs_dir.mkdir(exist_ok=True)
-    return logs_dir
+    _ensure_dir("logs")
+    return Path("logs")
 
 
 def setup_file_logging(name: str = "bot") -> logging.Logger:
-    """ファイルログの設定"""
+    """ファイルログの設定（同じロガーに2回呼んでもハンドラは1つだけ）"""
+    logger = logging.getLogger(name)
+    handler_name = f"akatsuki_file_{name}"
+    if any(handler.get_name() == handler_name for handler in logger.handlers):
+        return logger
+    
     logs_dir = create_logs_directory()
     
     # ログファイル名
     timestamp = datetime.now().strftime("%Y%m%d")
     log_file = logs_dir / f"{name}_{timestamp}.log"
     
-    # ファイルハンドラ設定
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    # ファイルハンドラ設定（バッファして書き出し、50MBごとにローテーション）
+    file_handler = BufferedRotatingFileHandler(log_file, maxBytes=50_000_000, backupCount=5, encoding='utf-8')
     file_handler.setLevel(logging.INFO)
     
-    # フォーマッタ設定
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(FILE_LOG_FORMATTER)
+    
+    # ロガーにはキューへ積むだけのハンドラを付け、ファイル書き込みは別スレッドで行う（イベントループを止めない）
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
     
     # ロガーに追加
-    logger = logging.getLogger(name)
-    logger.addHandler(file_handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.set_name(handler_name)
+    logger.addHandler(queue_handler)
+    logger._queue_listener = listener
     
     return logger
\ No newline at end of file